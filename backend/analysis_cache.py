@@ -0,0 +1,105 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from models import pack_vector, unpack_vector
+from uploads import Document, digest
+
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "./analysis_cache.db")
+# 有効期限 (秒)。0以下なら期限なし
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def document_key(contents: Document, kind: str, version: str) -> str:
+    """アップロードされたファイルの中身・解析の種類・プロンプトのバージョンから決まるキー"""
+    return f"{kind}:{version}:{digest(contents)}"
+
+
+class AnalysisCache:
+    """PDFの抽出テキスト・LLMの解析結果・ベクトルを文書単位で保存するキャッシュ
+
+    プレビュー (/process_resume/, /process_bigfive/) と登録 (/employees/) で
+    同じファイルが送られたときに、解析をやり直さずに済むようにする。
+    """
+
+    def __init__(self, path: str = ANALYSIS_CACHE_PATH, ttl: float = ANALYSIS_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache ("
+                " key TEXT PRIMARY KEY,"
+                " text TEXT NOT NULL,"
+                " result TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT text, result, vector, created_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl > 0 and time.time() - row[3] > self.ttl:
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        text, result, vector, _ = row
+        result = json.loads(result)
+        result["vector"] = unpack_vector(vector).tolist()
+        return {"text": text, "result": result}
+
+    def put(self, key: str, text: str, result: Dict[str, Any]) -> None:
+        """resultは解析結果の辞書。"vector"だけはバイナリで別カラムに保存する"""
+        fields = {name: value for name, value in result.items() if name != "vector"}
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache VALUES (?, ?, ?, ?, ?)",
+                (key, text, json.dumps(fields, ensure_ascii=False), pack_vector(result["vector"], "float32"), time.time()),
+            )
+            conn.commit()
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        # SQLiteの読み書きはイベントループの外で行う
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key: str, text: str, result: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.put, key, text, result)
+
+    def purge_expired(self) -> int:
+        if self.ttl <= 0:
+            return 0
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+analysis_cache = AnalysisCache()
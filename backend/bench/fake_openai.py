@@ -0,0 +1,185 @@
+"""ベンチマーク用のOpenAI互換サーバ
+
+チャットとエンベディングに決定的なレスポンスを返す。遅延とレート制限を設定できるので、
+APIキーなしで本番に近い待ち時間・429を再現できる。
+
+    python -m bench.fake_openai --port 8100 --chat-latency-ms 800 --embedding-latency-ms 150 --rpm 3000
+
+アプリ側は OPENAI_BASE_URL=http://127.0.0.1:8100/v1 と OPENAI_API_KEY=dummy で起動する。
+"""
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import random
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+WORDS = (
+    "experience leadership python sql communication project planning analysis design customer "
+    "team growth ownership quality delivery research stakeholder strategy mentoring operations"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    # 英語はおよそ4文字で1トークン、日本語は1文字1トークン程度として見積もる
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+def fake_embedding(text: str, model: str, dimensions: Optional[int]) -> np.ndarray:
+    size = dimensions or EMBEDDING_DIMENSIONS.get(model, 1536)
+    seed = int.from_bytes(hashlib.sha256(f"{model}\n{text}".encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(size).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def fake_completion(messages: List[Dict[str, Any]], max_tokens: Optional[int], completion_tokens: int) -> str:
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    count = min(completion_tokens, max_tokens or completion_tokens)
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数とトークン数の上限 (0なら無制限)"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window_start = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+
+    def check(self, tokens: int) -> Optional[float]:
+        """上限を超えていれば、あと何秒待てばよいかを返す"""
+        now = time.monotonic()
+        if now - self.window_start >= 60:
+            self.window_start, self.requests, self.tokens = now, 0, 0
+        if (self.rpm and self.requests + 1 > self.rpm) or (self.tpm and self.tokens + tokens > self.tpm):
+            return max(0.1, 60 - (now - self.window_start))
+        self.requests += 1
+        self.tokens += tokens
+        return None
+
+
+def create_app(chat_latency: float = 0.8, embedding_latency: float = 0.15, jitter: float = 0.2,
+               rpm: int = 0, tpm: int = 0, completion_tokens: int = 300, error_rate: float = 0.0,
+               prompt_latency: float = 0.0, output_latency: float = 0.0) -> FastAPI:
+    """prompt_latencyは入力1000トークンあたり、output_latencyは出力1トークンあたりに加える秒数"""
+    app = FastAPI()
+    limiter = RateLimiter(rpm, tpm)
+    app.state.stats = {"chat": 0, "embeddings": 0, "embedding_inputs": 0, "rate_limited": 0, "errors": 0,
+                       "prompt_tokens": 0, "completion_tokens": 0}
+
+    async def simulate(latency: float, tokens: int) -> Optional[JSONResponse]:
+        retry_after = limiter.check(tokens)
+        if retry_after is not None:
+            app.state.stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": f"{retry_after:.1f}"},
+                content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        if error_rate and random.random() < error_rate:
+            app.state.stats["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected error", "type": "server_error"}})
+        await asyncio.sleep(max(0.0, latency * (1 + random.uniform(-jitter, jitter))))
+        return None
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+        count = min(completion_tokens, body.get("max_tokens") or completion_tokens)
+        latency = chat_latency + prompt_tokens / 1000 * prompt_latency + count * output_latency
+        error = await simulate(latency, prompt_tokens + completion_tokens)
+        if error is not None:
+            return error
+        content = fake_completion(messages, body.get("max_tokens"), completion_tokens)
+        output_tokens = estimate_tokens(content)
+        app.state.stats["chat"] += 1
+        app.state.stats["prompt_tokens"] += prompt_tokens
+        app.state.stats["completion_tokens"] += output_tokens
+        return {
+            "id": f"chatcmpl-{hashlib.sha1(content.encode()).hexdigest()[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": prompt_tokens + output_tokens},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs: Union[str, List[str]] = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-small")
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        error = await simulate(embedding_latency, tokens)
+        if error is not None:
+            return error
+        app.state.stats["embeddings"] += 1
+        app.state.stats["embedding_inputs"] += len(inputs)
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, model, body.get("dimensions"))
+            # openai-pythonはnumpyがあるとbase64形式で要求する
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return {"object": "list", "data": data, "model": model,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--chat-latency-ms", type=float, default=800)
+    parser.add_argument("--embedding-latency-ms", type=float, default=150)
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter as a fraction (0.2 = ±20%%)")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429 (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute before 429 (0 = unlimited)")
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--prompt-ms-per-1k-tokens", type=float, default=0,
+                        help="extra chat latency per 1000 prompt tokens (prefill)")
+    parser.add_argument("--output-ms-per-token", type=float, default=0, help="extra chat latency per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail with 500")
+    args = parser.parse_args()
+
+    app = create_app(
+        chat_latency=args.chat_latency_ms / 1000, embedding_latency=args.embedding_latency_ms / 1000,
+        jitter=args.jitter, rpm=args.rpm, tpm=args.tpm, completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate, prompt_latency=args.prompt_ms_per_1k_tokens / 1000,
+        output_latency=args.output_ms_per_token / 1000,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
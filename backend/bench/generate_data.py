@@ -0,0 +1,215 @@
+"""ベンチマーク用の合成データを作る
+
+    python -m bench.generate_data --db ./bench.db --employees 10000 --jobposts 1000 --pdfs ./bench_pdfs --pdf-count 50
+
+--db のSQLiteに部署・グレード・求人・社員を一括登録し、--pdfs に職務経歴書とBigFiveの
+PDFを書き出す。同じ --seed なら同じデータができる。
+"""
+import os
+import random
+import argparse
+import datetime
+from typing import Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+
+from models import (
+    Base, Employee, EmployeeGrade, Grade, Department, DepartmentMember, JobPost, EmployeeJobAssignment,
+)
+from database import engine_options, tune_sqlite
+from embedding_config import EMBEDDING_MODEL, embedding_dimensions
+
+GRADES = ["G1", "G2", "G3", "M1", "M2", "E1"]
+DEPARTMENTS = ["営業部", "人事部", "開発部", "企画部", "経理部", "法務部", "品質保証部", "情報システム部"]
+SKILLS = [
+    "Python", "SQL", "Java", "project management", "negotiation", "accounting", "recruiting",
+    "machine learning", "UX research", "cloud infrastructure", "quality assurance", "legal review",
+]
+TRAITS = ["calm", "curious", "organized", "outgoing", "cooperative", "detail oriented", "decisive"]
+
+
+def make_pdf(lines: List[str], image_bytes: int = 0, seed: int = 0) -> bytes:
+    """1ページ45行ずつのテキストPDFを作る (Helvetica、ASCIIのみ)
+
+    image_bytesを指定すると、スキャンしたPDFのように1ページ目にその大きさの画像を埋め込む。
+    """
+    pages = [lines[i:i + 45] for i in range(0, len(lines), 45)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    image_id = font_id + 1
+    for index, page in enumerate(pages):
+        with_image = image_bytes > 0 and index == 0
+        xobject = f" /XObject << /Im1 {image_id} 0 R >>" if with_image else ""
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * index} 0 R"
+            f" /Resources << /Font << /F1 {font_id} 0 R >>{xobject} >> >>"
+        )
+        text = " ".join(f"({_escape_pdf(line)}) '" for line in page)
+        stream = f"BT /F1 10 Tf 50 760 Td 16 TL {text} ET"
+        if with_image:
+            stream = f"q 512 0 0 512 50 100 cm /Im1 Do Q {stream}"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    if image_bytes > 0:
+        # 圧縮できないノイズのグレースケール画像 (latin-1で1バイト=1文字になる)
+        width = 1024
+        height = -(-image_bytes // width)
+        data = random.Random(seed).randbytes(width * height).decode("latin-1")
+        objects.append(
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceGray"
+            f" /BitsPerComponent 8 /Length {len(data)} >>\nstream\n{data}\nendstream"
+        )
+
+    output = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return output.encode("latin-1")
+
+
+def _escape_pdf(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def resume_lines(rng: random.Random, pages: int = 2, nonce: str = "") -> List[str]:
+    lines = [f"Curriculum Vitae {nonce}".strip()]
+    for year in range(2010, 2010 + pages * 20):
+        skills = ", ".join(rng.sample(SKILLS, 3))
+        lines.append(f"{year}: worked on {rng.choice(['sales', 'hr', 'platform', 'finance'])} projects using {skills}")
+        lines.append(f"  achieved {rng.randint(5, 60)}% improvement in {rng.choice(SKILLS)}")
+    return lines
+
+
+def bigfive_lines(rng: random.Random, nonce: str = "") -> List[str]:
+    lines = [f"Big Five personality report {nonce}".strip()]
+    for factor in ("Neuroticism", "Extraversion", "Openness", "Agreeableness", "Conscientiousness"):
+        lines.append(f"{factor}: {rng.randint(1, 10)} / 10")
+        lines.extend(f"  tends to be {rng.choice(TRAITS)} when {rng.choice(SKILLS)} is involved" for _ in range(6))
+    return lines
+
+
+def write_pdfs(directory: str, count: int, seed: int) -> None:
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    for index in range(count):
+        with open(os.path.join(directory, f"resume_{index:04d}.pdf"), "wb") as f:
+            f.write(make_pdf(resume_lines(rng, pages=rng.randint(1, 3))))
+        with open(os.path.join(directory, f"bigfive_{index:04d}.pdf"), "wb") as f:
+            f.write(make_pdf(bigfive_lines(rng)))
+
+
+def random_vectors(rng: np.random.Generator, count: int, dims: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def batches(total: int, size: int) -> Iterator[range]:
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+def generate(url: str, employees: int, jobposts: int, employee_dims: int, jobpost_dims: int,
+             id_width: int, batch_size: int, seed: int) -> None:
+    bind = create_engine(url, **engine_options(url))
+    tune_sqlite(bind)
+    Base.metadata.create_all(bind)
+    rng = random.Random(seed)
+    vector_rng = np.random.default_rng(seed)
+
+    with bind.begin() as connection:
+        connection.execute(insert(Grade), [{"grade_id": i, "grade_name": name} for i, name in enumerate(GRADES, 1)])
+        connection.execute(insert(Department), [
+            {"department_id": i, "department_name": name, "department_detail": f"{name}の業務全般"}
+            for i, name in enumerate(DEPARTMENTS, 1)
+        ])
+        vectors = random_vectors(vector_rng, jobposts, jobpost_dims)
+        connection.execute(insert(JobPost), [
+            {
+                "jobpost_id": i + 1,
+                "department_id": i % len(DEPARTMENTS) + 1,
+                "job_title": f"{DEPARTMENTS[i % len(DEPARTMENTS)]} {rng.choice(SKILLS)}担当 #{i + 1}",
+                "job_detail": " ".join(rng.choice(SKILLS) for _ in range(40)),
+                "job_detail_vector": vectors[i],
+                "embedding_model": EMBEDDING_MODEL,
+                "embedding_dimensions": jobpost_dims,
+            }
+            for i in range(jobposts)
+        ])
+
+    hire_start = datetime.date(2000, 4, 1)
+    for chunk in batches(employees, batch_size):
+        career = random_vectors(vector_rng, len(chunk), employee_dims)
+        personality = random_vectors(vector_rng, len(chunk), employee_dims)
+        rows, grades, departments, assignments = [], [], [], []
+        for offset, i in enumerate(chunk):
+            employee_id = f"SAPPORO{str(i + 1).zfill(id_width)}"
+            hire_date = hire_start + datetime.timedelta(days=rng.randint(0, 9000))
+            rows.append({
+                "employee_id": employee_id,
+                "employee_name": f"社員 {i + 1}",
+                "birthdate": datetime.date(1960, 1, 1) + datetime.timedelta(days=rng.randint(0, 15000)),
+                "gender": rng.choice(["男性", "女性", "その他"]),
+                "academic_background": rng.choice(["学士", "修士", "博士", "高卒"]),
+                "hire_date": hire_date,
+                "recruitment_type": rng.choice(["新卒", "中途"]),
+                "career_info_detail": " ".join(rng.choice(SKILLS) for _ in range(60)),
+                "career_info_vector": career[offset],
+                "personality_detail": " ".join(rng.choice(TRAITS) for _ in range(60)),
+                "personality_vector": personality[offset],
+                "embedding_model": EMBEDDING_MODEL,
+                "embedding_dimensions": employee_dims,
+                "neuroticism_score": rng.randint(1, 10),
+                "extraversion_score": rng.randint(1, 10),
+                "openness_score": rng.randint(1, 10),
+                "agreeableness_score": rng.randint(1, 10),
+                "conscientiousness_score": rng.randint(1, 10),
+                "password_hash": "$2b$04$benchmarkbenchmarkbenchmarkbenchmarkbenchmarkbenchm",
+            })
+            grades.append({"employee_id": employee_id, "grade_id": rng.randint(1, len(GRADES))})
+            departments.append({"employee_id": employee_id, "department_id": rng.randint(1, len(DEPARTMENTS))})
+            if jobposts:
+                assignments.append({"employee_id": employee_id, "jobpost_id": rng.randint(1, jobposts),
+                                    "start_date": hire_date})
+        with bind.begin() as connection:
+            connection.execute(insert(Employee), rows)
+            connection.execute(insert(EmployeeGrade), grades)
+            connection.execute(insert(DepartmentMember), departments)
+            if assignments:
+                connection.execute(insert(EmployeeJobAssignment), assignments)
+        print(f"Inserted {chunk.stop}/{employees} employees")
+    bind.dispose()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic SQLite database and PDFs for benchmarks")
+    parser.add_argument("--db", default="./bench.db", help="SQLite file to (re)create")
+    parser.add_argument("--employees", type=int, default=10000)
+    parser.add_argument("--jobposts", type=int, default=1000)
+    parser.add_argument("--employee-dims", type=int, default=embedding_dimensions())
+    parser.add_argument("--jobpost-dims", type=int, default=embedding_dimensions())
+    parser.add_argument("--id-width", type=int, default=6, help="digits in SAPPORO employee ids")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pdfs", default=None, help="directory to write sample resume/BigFive PDFs into")
+    parser.add_argument("--pdf-count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    generate(f"sqlite:///{args.db}", args.employees, args.jobposts, args.employee_dims, args.jobpost_dims,
+             args.id_width, args.batch_size, args.seed)
+    if args.pdfs:
+        write_pdfs(args.pdfs, args.pdf_count, args.seed)
+        print(f"Wrote {args.pdf_count} resume/BigFive PDF pairs to {args.pdfs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""同時に社員を登録したときの社員IDの重複 (衝突) と払い出しの速さを測る
+
+    python -m bench.id_allocation --processes 4 --threads 8 --per-worker 50 --output bench_results/id_allocation.json
+
+一時ディレクトリに合成データのDBを作り、P個のプロセス x T個のスレッドがそれぞれ
+「IDを払い出して社員を1行登録する」をくり返す。
+- legacy: 以前の utils.create_employee_id と同じく、最大のIDを検索して+1する
+- counter: id_allocator.IdAllocator (カウンタテーブルを1文で進める)。--block-size で先取りする数を変えられる
+主キーの衝突で登録に失敗した件数、登録できた行のIDの重複、1秒あたりの登録数、1件のレイテンシを記録する。
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from bench.generate_data import generate
+from bench.run import git_commit, percentiles
+from database import engine_options, tune_sqlite
+from id_allocator import IdAllocator
+from models import Employee
+
+MODES = ("legacy", "counter")
+
+
+def employee_row(employee_id: str) -> Dict[str, Any]:
+    return {
+        "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+        "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+        "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": [],
+        "personality_detail": "", "personality_vector": [], "neuroticism_score": 5,
+        "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+        "password_hash": "",
+    }
+
+
+def legacy_register(connection, prefix: str, width: int) -> str:
+    # 以前の実装: 文字列の順で最大のIDを取り、同じトランザクションで登録する
+    last = connection.execute(
+        select(Employee.employee_id).order_by(Employee.employee_id.desc()).limit(1)
+    ).scalar_one_or_none()
+    last_id = int(last[len(prefix):]) if last else 0
+    employee_id = f"{prefix}{str(last_id + 1).zfill(width)}"
+    connection.execute(insert(Employee), [employee_row(employee_id)])
+    return employee_id
+
+
+def run_process(url: str, mode: str, threads: int, per_worker: int, prefix: str, width: int,
+                block_size: int, queue) -> None:
+    bind = create_engine(url, **engine_options(url))
+    tune_sqlite(bind)
+    allocator = IdAllocator("employee", prefix, width, block_size, column=Employee.employee_id)
+    latencies: List[float] = []
+    counts = {"created": 0, "collisions": 0, "errors": 0}
+    lock = threading.Lock()
+    start_event = threading.Event()
+
+    def worker():
+        start_event.wait()
+        for _ in range(per_worker):
+            start = time.perf_counter()
+            try:
+                with bind.begin() as connection:
+                    if mode == "legacy":
+                        legacy_register(connection, prefix, width)
+                    else:
+                        employee_id = allocator.allocate(1, bind)[0]
+                        connection.execute(insert(Employee), [employee_row(employee_id)])
+                outcome = "created"
+            except IntegrityError:
+                outcome = "collisions"
+            except Exception:
+                outcome = "errors"
+            elapsed = time.perf_counter() - start
+            with lock:
+                counts[outcome] += 1
+                if outcome == "created":
+                    latencies.append(elapsed)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_event.set()
+    for thread in workers:
+        thread.join()
+    bind.dispose()
+    queue.put({**counts, "latencies": latencies})
+
+
+def run_mode(args: argparse.Namespace, mode: str) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix="id_allocation_bench_")
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    try:
+        generate(url, args.employees, 10, 8, 8, args.id_width, 5000, args.seed)
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=run_process, args=(url, mode, args.threads, args.per_worker,
+                                                              args.prefix, args.id_width, args.block_size, queue))
+            for _ in range(args.processes)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        reports = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        bind = create_engine(url, **engine_options(url))
+        with bind.connect() as connection:
+            rows, distinct = connection.execute(
+                select(func.count(Employee.employee_id), func.count(func.distinct(Employee.employee_id)))
+            ).one()
+        bind.dispose()
+        created = sum(report["created"] for report in reports)
+        return {
+            "attempts": args.processes * args.threads * args.per_worker,
+            "created": created,
+            "collisions": sum(report["collisions"] for report in reports),
+            "errors": sum(report["errors"] for report in reports),
+            "duplicate_ids": rows - distinct,
+            "missing_rows": args.employees + created - rows,
+            "seconds": elapsed,
+            "registrations_per_second": created / elapsed if elapsed else 0.0,
+            "latency": percentiles([value for report in reports for value in report["latencies"]]),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    for mode, result in results.items():
+        print(f"{mode:8s} created {result['created']}/{result['attempts']}  collisions {result['collisions']}"
+              f"  errors {result['errors']}  duplicate ids {result['duplicate_ids']}"
+              f"  {result['registrations_per_second']:.0f}/s"
+              f"  p50 {result['latency']['p50_ms']:.2f} ms  p95 {result['latency']['p95_ms']:.2f} ms")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Stress concurrent employee id allocation")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        type=lambda value: [item.strip() for item in value.split(",") if item.strip()])
+    parser.add_argument("--employees", type=int, default=1000, help="existing employees before the run")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="threads per process")
+    parser.add_argument("--per-worker", type=int, default=50, help="registrations per thread")
+    parser.add_argument("--block-size", type=int, default=1, help="ids reserved per process at a time (counter)")
+    parser.add_argument("--prefix", default="SAPPORO")
+    parser.add_argument("--id-width", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    results = {mode: run_mode(args, mode) for mode in args.modes}
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
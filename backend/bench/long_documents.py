@@ -0,0 +1,140 @@
+"""長い職務経歴書の解析にかかるプロンプトトークン数と時間を、全文を1回で送る場合と比べる
+
+    python -m bench.long_documents --pages 2,5,10,20,30 --repeat 5 --output bench_results/long_documents.json
+
+pdfminerの抽出結果と同じ形 (ページ区切りが\f、ヘッダー・ページ番号・全角空白入り) の日本語の職務経歴書を作り、
+PDF_MAX_TEXT_CHARSで切ったテキストを
+- before: 全文をそのまま1つのプロンプトに入れる (以前の process_resume)
+- after: analyze_document_text (整形 → 予算を超えたらチャンクごとの要約 → 解析)
+で解析する。OpenAIは同じプロセス内の偽サーバーで、入力・出力のトークン数に比例する待ち時間を加える。
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from bench.fake_openai import create_app
+from bench.generate_data import SKILLS
+from bench.run import git_commit, percentiles
+from openai_scheduler import scheduler
+from utils import (PDF_MAX_TEXT_CHARS, RESUME_PROMPT, RESUME_SYSTEM_PROMPT, analyze_document_text, analyze_text,
+                   document_spec)
+
+# 1ページの本文の行数
+_PAGE_LINES = 40
+SYSTEMS = ["金融系基幹システム", "人事管理システム", "ECサイト", "物流管理システム", "社内データ基盤"]
+ROLES = ["要件定義", "基本設計", "詳細設計", "実装", "テスト", "運用保守", "チームマネジメント"]
+
+
+def long_resume_text(rng: random.Random, pages: int, nonce: str) -> str:
+    """見出し付きのプロジェクトが続き、各ページにヘッダーとページ番号が入る職務経歴書の抽出テキスト"""
+    body: List[str] = []
+    project = 0
+    while len(body) < pages * _PAGE_LINES:
+        project += 1
+        body.append(f"【プロジェクト{project}】　{rng.choice(SYSTEMS)}の再構築　{nonce}")
+        body.append(f"期間：　{rng.randint(2005, 2023)}年{rng.randint(1, 12)}月　〜　"
+                    f"{rng.randint(2005, 2023)}年{rng.randint(1, 12)}月　　　チーム規模：　{rng.randint(3, 30)}名")
+        for _ in range(rng.randint(4, 9)):
+            skills = "、".join(rng.sample(SKILLS, 2))
+            body.append(f"・{skills}を用いた{rng.choice(ROLES)}を担当し、"
+                        f"{rng.choice(SKILLS)}の処理時間を{rng.randint(5, 60)}％短縮した。")
+        body.append("")
+
+    pages_text = []
+    for page in range(pages):
+        lines = ["職務経歴書　　　　　　　　　　　　札幌 太郎", ""]
+        lines.extend(body[page * _PAGE_LINES:(page + 1) * _PAGE_LINES])
+        lines.extend(["", f"- {page + 1} -"])
+        pages_text.append("\n".join(lines) + "\n")
+    # extract_text_from_pdfと同じく上限の文字数で打ち切る
+    text = "\f".join(pages_text)
+    return text[:PDF_MAX_TEXT_CHARS] if PDF_MAX_TEXT_CHARS else text
+
+
+async def measure(app, analyze, texts: List[str]) -> Dict[str, Any]:
+    latencies = []
+    before = dict(app.state.stats)
+    for text in texts:
+        start = time.perf_counter()
+        await analyze(text)
+        latencies.append(time.perf_counter() - start)
+    stats = app.state.stats
+    result = percentiles(latencies)
+    result.update({
+        "chat_requests": (stats["chat"] - before["chat"]) / len(texts),
+        "prompt_tokens": (stats["prompt_tokens"] - before["prompt_tokens"]) / len(texts),
+        "completion_tokens": (stats["completion_tokens"] - before["completion_tokens"]) / len(texts),
+    })
+    return result
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    app = create_app(
+        chat_latency=args.chat_latency_ms / 1000, jitter=0.0, completion_tokens=args.completion_tokens,
+        prompt_latency=args.prompt_ms_per_1k_tokens / 1000, output_latency=args.output_ms_per_token / 1000,
+    )
+    scheduler.client = AsyncOpenAI(
+        api_key="dummy", base_url="http://fake-openai/v1", max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app), timeout=600),
+    )
+    spec = document_spec("resume")
+
+    async def before(text: str) -> str:
+        return await analyze_text(RESUME_SYSTEM_PROMPT, RESUME_PROMPT.format(text=text))
+
+    async def after(text: str) -> str:
+        return await analyze_document_text(spec, text)
+
+    rng = random.Random(args.seed)
+    results: Dict[str, Dict[str, Any]] = {}
+    for pages in args.pages:
+        # 毎回内容を変えて、スケジューラの同一リクエストのまとめ込みを避ける
+        texts = [long_resume_text(rng, pages, str(rng.randrange(10 ** 9))) for _ in range(args.repeat)]
+        results[f"{pages}p/before"] = await measure(app, before, texts)
+        results[f"{pages}p/after"] = await measure(app, after, texts)
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'document':14s} {'requests':>9s} {'prompt tok':>11s} {'output tok':>11s} "
+          f"{'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s}")
+    for name, result in results.items():
+        print(f"{name:14s} {result['chat_requests']:>9.1f} {result['prompt_tokens']:>11.0f} "
+              f"{result['completion_tokens']:>11.0f} {result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f} "
+              f"{result['max_ms']:>9.0f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare single-prompt and chunked analysis of long resumes")
+    parser.add_argument("--pages", default="2,5,10,20,30",
+                        type=lambda value: [int(item) for item in value.split(",") if item.strip()])
+    parser.add_argument("--repeat", type=int, default=5, help="documents per page count")
+    parser.add_argument("--chat-latency-ms", type=float, default=400, help="fixed latency per chat request")
+    parser.add_argument("--prompt-ms-per-1k-tokens", type=float, default=100)
+    parser.add_argument("--output-ms-per-token", type=float, default=10)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""保存済みのおすすめ (recommendation テーブル) の読み出しと、その場で類似度を計算する照合のレイテンシを比べる
+
+    python -m bench.recommendations --employees 2000,10000,50000 --jobposts 1000 --output bench_results/recommendations.json
+
+社員数ごとに一時ディレクトリへ合成データのDBを作り、
+- rebuild: recommendations.py と同じ全件の作り直し (ブロックごとの行列積) にかかる時間と行数
+- on_the_fly: /employees/{id}/jobposts と /jobposts/{id}/candidates の処理 (全件との類似度を計算)
+- stored: /employees/{id}/recommendations と /jobposts/{id}/recommendations の処理 (インデックスを引く1回のクエリ)
+- add_employee / refresh_jobpost: 社員の登録・求人のベクトル変更での差分の更新
+を測る。HTTPとOpenAIは使わない。
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import Session
+
+import utils
+from bench.generate_data import generate, random_vectors
+from bench.run import git_commit, percentiles
+from database import engine_options, tune_sqlite
+from embedding_config import embedding_dimensions
+from matching import matcher
+from models import Employee, EmployeeJobAssignment, JobPost
+from recommendations import RecommendationStore, recommendations
+
+
+def measure(fn: Callable[[Any], Any], ids: List[Any]) -> Dict[str, float]:
+    latencies = []
+    for item in ids:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def add_employees(db: Session, rng: np.random.Generator, count: int, dims: int, jobposts: int) -> Dict[str, float]:
+    """社員を1人ずつ追加し、おすすめの差分の更新にかかる時間を測る"""
+    latencies = []
+    for i in range(count):
+        employee_id = f"BENCH{i:06d}"
+        career, personality = random_vectors(rng, 2, dims)
+        db.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": career,
+            "personality_detail": "", "personality_vector": personality, "neuroticism_score": 5,
+            "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+            "password_hash": "",
+        }])
+        db.execute(insert(EmployeeJobAssignment), [{
+            "employee_id": employee_id, "jobpost_id": int(rng.integers(1, jobposts + 1)),
+            "start_date": datetime.date(2024, 4, 1),
+        }])
+        db.commit()
+        matcher.upsert_employee_vectors(employee_id, career, personality)
+        start = time.perf_counter()
+        recommendations.add_employees(db, [employee_id])
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def refresh_jobposts(db: Session, rng: np.random.Generator, jobpost_ids: List[int], dims: int) -> Dict[str, float]:
+    """求人のベクトルを1件ずつ変え、おすすめの差分の更新にかかる時間を測る"""
+    latencies = []
+    for jobpost_id in jobpost_ids:
+        db.execute(update(JobPost).where(JobPost.jobpost_id == jobpost_id)
+                   .values(job_detail_vector=random_vectors(rng, 1, dims)[0]))
+        db.commit()
+        start = time.perf_counter()
+        recommendations.refresh_jobposts(db, [jobpost_id])
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def run_size(args: argparse.Namespace, employees: int) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix="recommendations_bench_")
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    try:
+        generate(url, employees, args.jobposts, args.dims, args.dims, 6, 5000, args.seed)
+        bind = create_engine(url, **engine_options(url))
+        tune_sqlite(bind)
+        rng = random.Random(args.seed)
+        vector_rng = np.random.default_rng(args.seed)
+        employee_ids = [f"SAPPORO{rng.randint(1, employees):06d}" for _ in range(args.queries)]
+        jobpost_ids = [rng.randint(1, args.jobposts) for _ in range(args.queries)]
+        weights = (args.career_weight, args.personality_weight)
+
+        with Session(bind) as db:
+            store = RecommendationStore(top_n=args.top_n, career_weight=args.career_weight,
+                                        personality_weight=args.personality_weight, block_size=args.block_size)
+            rebuild = store.rebuild(db)
+            matcher.load(db)
+            recommendations.top_n = args.top_n
+            result = {
+                "rebuild_seconds": rebuild["seconds"],
+                "rows": rebuild["rows"],
+                "on_the_fly/employee": measure(
+                    lambda employee_id: utils.get_employee_jobposts(db, employee_id, args.k, *weights), employee_ids),
+                "stored/employee": measure(
+                    lambda employee_id: utils.get_employee_recommendations(db, employee_id, args.k, None), employee_ids),
+                "on_the_fly/jobpost": measure(
+                    lambda jobpost_id: utils.get_jobpost_candidates(db, jobpost_id, args.k, *weights), jobpost_ids),
+                "stored/jobpost": measure(
+                    lambda jobpost_id: utils.get_jobpost_recommendations(db, jobpost_id, args.k, None), jobpost_ids),
+                "add_employee": add_employees(db, vector_rng, args.updates, args.dims, args.jobposts),
+                "refresh_jobpost": refresh_jobposts(db, vector_rng, jobpost_ids[:args.updates], args.dims),
+            }
+        bind.dispose()
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    for size, result in results.items():
+        print(f"{size} employees: rebuild {result['rebuild_seconds']:.1f}s ({result['rows']} rows)")
+        for name in ("on_the_fly/employee", "stored/employee", "on_the_fly/jobpost", "stored/jobpost",
+                     "add_employee", "refresh_jobpost"):
+            item = result[name]
+            print(f"  {name:22s} p50 {item['p50_ms']:8.2f} ms  p95 {item['p95_ms']:8.2f} ms")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compare stored recommendations with on-the-fly matching")
+    parser.add_argument("--employees", default="2000,10000,50000",
+                        type=lambda value: [int(item) for item in value.split(",") if item.strip()])
+    parser.add_argument("--jobposts", type=int, default=1000)
+    parser.add_argument("--dims", type=int, default=embedding_dimensions())
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=20, help="results per lookup")
+    parser.add_argument("--career-weight", type=float, default=0.7)
+    parser.add_argument("--personality-weight", type=float, default=0.3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=20, help="incremental updates to time")
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = {str(employees): run_size(args, employees) for employees in args.employees}
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
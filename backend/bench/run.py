@@ -0,0 +1,280 @@
+"""ベンチマークのシナリオを実行し、スループットとp50/p95/p99を記録する
+
+事前に以下を起動しておく (backendディレクトリで実行):
+
+    python -m bench.generate_data --db ./bench.db --employees 10000 --pdfs ./bench_pdfs
+    python -m bench.fake_openai --port 8100
+    DATABASE_URL=sqlite:///./bench.db OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=dummy \\
+        uvicorn main:app --port 8000
+
+    python -m bench.run --scenarios register,list,detail,reference --concurrency 16 --duration 30 \\
+        --output bench_results/$(git rev-parse --short HEAD).json
+    python -m bench.run --compare bench_results/old.json bench_results/new.json
+
+reembed シナリオは update_job_detail_vectors を別プロセスで実行して時間を測る
+(--db と --openai-base-url を使う)。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import subprocess
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from bench.generate_data import make_pdf, resume_lines, bigfive_lines
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("register", "list", "detail", "reference", "reembed")
+
+Request = Callable[[httpx.AsyncClient, random.Random], Awaitable[httpx.Response]]
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0, "max_ms": 0.0}
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "mean_ms": float(values.mean()), "max_ms": float(values.max())}
+
+
+async def run_load(client: httpx.AsyncClient, request: Request, concurrency: int,
+                   duration: float, max_requests: int, seed: int) -> Dict[str, Any]:
+    """concurrency本のワーカーで、duration秒またはmax_requests件までリクエストを送り続ける"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    sent = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int):
+        nonlocal sent
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline and (not max_requests or sent < max_requests):
+            sent += 1
+            start = time.perf_counter()
+            try:
+                response = await request(client, rng)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            if isinstance(status, int) and status < 400:
+                latencies.append(elapsed)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(latencies) + sum(errors.values()),
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        **percentiles(latencies),
+    }
+
+
+async def employee_ids(client: httpx.AsyncClient, limit: int = 2000) -> List[str]:
+    ids: List[str] = []
+    cursor: Optional[str] = None
+    while len(ids) < limit:
+        params = {"limit": 500, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/employees/", params=params)
+        response.raise_for_status()
+        ids.extend(item["employee_id"] for item in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    return ids
+
+
+def registration_form(rng: random.Random) -> Dict[str, str]:
+    return {
+        "employee_name": f"bench {rng.randrange(10 ** 9)}",
+        "birthdate": "1990-04-01",
+        "gender": "その他",
+        "academic_background": "学士",
+        "hire_date": datetime.date.today().isoformat(),
+        "recruitment_type": "中途",
+        "grade_id": str(rng.randint(1, 3)),
+        "department_id": str(rng.randint(1, 3)),
+        "jobpost_id": "1",
+        "password": "benchmark",
+        "neuroticism_score": str(rng.randint(1, 10)),
+        "extraversion_score": str(rng.randint(1, 10)),
+        "openness_score": str(rng.randint(1, 10)),
+        "agreeableness_score": str(rng.randint(1, 10)),
+        "conscientiousness_score": str(rng.randint(1, 10)),
+    }
+
+
+async def build_request(scenario: str, client: httpx.AsyncClient, args: argparse.Namespace) -> Request:
+    if scenario == "register":
+        async def register(client: httpx.AsyncClient, rng: random.Random) -> httpx.Response:
+            # 毎回内容の異なるPDFを送り、解析キャッシュに当たらないようにする (--reuse-pdfs で当てる)
+            nonce = "" if args.reuse_pdfs else str(rng.randrange(10 ** 12))
+            pdf_rng = random.Random(nonce or 0)
+            files = {
+                "resume": ("resume.pdf", make_pdf(resume_lines(pdf_rng, pages=2, nonce=nonce)), "application/pdf"),
+                "bigfive": ("bigfive.pdf", make_pdf(bigfive_lines(pdf_rng, nonce=nonce)), "application/pdf"),
+            }
+            params = {"async": "true"} if args.async_register else None
+            return await client.post("/employees/", data=registration_form(rng), files=files, params=params)
+        return register
+
+    if scenario in ("list", "detail"):
+        ids = await employee_ids(client)
+        if not ids:
+            raise SystemExit("No employees found; run bench.generate_data first")
+
+        if scenario == "list":
+            async def list_page(client: httpx.AsyncClient, rng: random.Random) -> httpx.Response:
+                params = {"limit": args.page_size, "cursor": rng.choice(ids)}
+                if args.fields:
+                    params["fields"] = args.fields
+                return await client.get("/employees/", params=params)
+            return list_page
+
+        async def detail(client: httpx.AsyncClient, rng: random.Random) -> httpx.Response:
+            return await client.get(f"/employees/{rng.choice(ids)}")
+        return detail
+
+    if scenario == "reference":
+        departments = [item["department_id"] for item in (await client.get("/departments/")).json()]
+        paths = ["/grades/", "/departments/", *[f"/departments/{i}/jobposts/" for i in departments]]
+
+        async def reference(client: httpx.AsyncClient, rng: random.Random) -> httpx.Response:
+            return await client.get(rng.choice(paths))
+        return reference
+
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def run_reembed(args: argparse.Namespace) -> Dict[str, Any]:
+    """update_job_detail_vectorsを別プロセスで実行し、求人1件あたりの処理速度を測る"""
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "dummy")
+    env["OPENAI_BASE_URL"] = args.openai_base_url
+    env["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    env["EMBEDDING_CACHE_PATH"] = os.path.abspath(args.db) + ".embedding_cache.db"
+    env["EMBEDDING_CHECKPOINT_PATH"] = os.path.abspath(args.db) + ".checkpoint.json"
+    code = (
+        "import time, json, sqlite3, embedding\n"
+        "start = time.perf_counter()\n"
+        "embedding.update_job_detail_vectors(force=True, restart=True)\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"count = sqlite3.connect({os.path.abspath(args.db)!r}).execute('SELECT COUNT(*) FROM job_post').fetchone()[0]\n"
+        "print(json.dumps({'jobposts': count, 'wall_seconds': elapsed}))\n"
+    )
+    if os.path.exists(env["EMBEDDING_CACHE_PATH"]):
+        os.remove(env["EMBEDDING_CACHE_PATH"])
+    completed = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"update_job_detail_vectors failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["throughput_rps"] = result["jobposts"] / result["wall_seconds"] if result["wall_seconds"] else 0.0
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'scenario':12s} {'requests':>9s} {'errors':>7s} {'rps':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for scenario, result in results.items():
+        errors = sum(result.get("errors", {}).values())
+        print(f"{scenario:12s} {result.get('requests', result.get('jobposts', 0)):>9d} {errors:>7d} "
+              f"{result['throughput_rps']:>9.1f} {result.get('p50_ms', 0):>9.1f} {result.get('p95_ms', 0):>9.1f} "
+              f"{result.get('p99_ms', 0):>9.1f}")
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print(f"{'scenario':12s} {'metric':>14s} {'old':>10s} {'new':>10s} {'change':>8s}")
+    for scenario, result in new["results"].items():
+        before = old["results"].get(scenario)
+        if before is None:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if metric not in result or metric not in before:
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f"{scenario:12s} {metric:>14s} {before[metric]:>10.1f} {result[metric]:>10.1f} {change:>+7.1f}%")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        for scenario in args.scenarios:
+            if scenario == "reembed":
+                results[scenario] = await asyncio.to_thread(run_reembed, args)
+                continue
+            request = await build_request(scenario, client, args)
+            if args.warmup:
+                await run_load(client, request, args.concurrency, args.warmup, 0, args.seed + 1)
+            results[scenario] = await run_load(client, request, args.concurrency, args.duration,
+                                               args.requests, args.seed)
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run backend load scenarios")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", default="list,detail,reference",
+                        type=lambda value: [item.strip() for item in value.split(",") if item.strip()],
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = duration only)")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unrecorded warm-up per scenario")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--fields", default=None, help="fields parameter for the list scenario")
+    parser.add_argument("--async-register", action="store_true", help="register with ?async=true")
+    parser.add_argument("--reuse-pdfs", action="store_true", help="send identical PDFs (analysis cache hits)")
+    parser.add_argument("--db", default="./bench.db", help="SQLite file for the reembed scenario")
+    parser.add_argument("--openai-base-url", default="http://127.0.0.1:8100/v1",
+                        help="fake OpenAI server used by the reembed scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""「似ている社員」インデックスの再現率とレイテンシを総当たりと比べる
+
+    python -m bench.similar --employees 100000 --nprobe 4,8,16,32,64 --output bench_results/similar.json
+
+クラスタ構造を持つ合成ベクトル (実際のエンベディングに近い) でインデックスを作り、
+無作為に選んだ社員について全クラスタを調べた結果 (総当たり) と nprobe ごとの結果を比べる。
+DBとOpenAIは使わない。
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bench.run import git_commit, percentiles
+from embedding_config import embedding_dimensions
+from vector_index import SEARCH_SPACES, SPACES, VectorIndex
+
+
+def clustered_vectors(rng: np.random.Generator, centers: np.ndarray, count: int, noise: float) -> np.ndarray:
+    labels = rng.integers(0, len(centers), count)
+    vectors = centers[labels] + noise * rng.standard_normal((count, centers.shape[1])).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_chunks(count: int, dims: int, clusters: int, noise: float, seed: int,
+                     chunk_size: int = 10000) -> Iterator[Tuple[Sequence[str], Dict[str, np.ndarray]]]:
+    rng = np.random.default_rng(seed)
+    centers = {
+        space: (rng.standard_normal((clusters, dims)) / np.sqrt(dims)).astype(np.float32) for space in SPACES
+    }
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        ids = [f"SAPPORO{i + 1:06d}" for i in range(start, start + size)]
+        yield ids, {space: clustered_vectors(rng, centers[space], size, noise) for space in SPACES}
+
+
+def recall(found: List[Tuple[str, float]], expected: List[Tuple[str, float]]) -> float:
+    if not expected:
+        return 1.0
+    return len({item[0] for item in found} & {item[0] for item in expected}) / len(expected)
+
+
+def measure(index: VectorIndex, query_ids: List[str], space: str, k: int, nprobe: int,
+            exact: Dict[str, List[Tuple[str, float]]]) -> Dict[str, float]:
+    latencies, recalls = [], []
+    for employee_id in query_ids:
+        start = time.perf_counter()
+        found = index.similar(employee_id, k, space, nprobe)
+        latencies.append(time.perf_counter() - start)
+        if exact:
+            recalls.append(recall(found, exact[employee_id]))
+    result = percentiles(latencies)
+    if recalls:
+        result["recall"] = float(np.mean(recalls))
+    return result
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict]:
+    directory = args.dir or tempfile.mkdtemp(prefix="vector_index_bench_")
+    results: Dict[str, Dict] = {}
+    try:
+        index = VectorIndex(directory)
+        start = time.perf_counter()
+        index.build(synthetic_chunks(args.employees, args.dims, args.clusters, args.noise, args.seed),
+                    args.employees, args.dims, args.nlist)
+        results["build"] = {"seconds": time.perf_counter() - start}
+
+        # 別のワーカーが起動したときと同じく、作成済みのファイルを開くだけの時間
+        start = time.perf_counter()
+        reopened = VectorIndex(directory)
+        nlist = reopened.stats()["nlist"]
+        results["open"] = {"seconds": time.perf_counter() - start}
+
+        rng = np.random.default_rng(args.seed + 1)
+        query_ids = [f"SAPPORO{i + 1:06d}" for i in rng.choice(args.employees, args.queries, replace=False)]
+        for space in SEARCH_SPACES:
+            # 全クラスタを調べる = 総当たり
+            exact = {employee_id: reopened.similar(employee_id, args.k, space, nlist) for employee_id in query_ids}
+            results[f"{space}/brute-force"] = measure(reopened, query_ids, space, args.k, nlist, {})
+            for nprobe in args.nprobe:
+                results[f"{space}/nprobe={nprobe}"] = measure(reopened, query_ids, space, args.k, nprobe, exact)
+
+        # 登録1件ごとの追記と、追記分がある状態での検索
+        extra = next(synthetic_chunks(args.inserts, args.dims, args.clusters, args.noise, args.seed + 2))
+        latencies = []
+        for i, employee_id in enumerate(extra[0]):
+            start = time.perf_counter()
+            reopened.add(f"NEW{employee_id}", extra[1]["career"][i], extra[1]["personality"][i])
+            latencies.append(time.perf_counter() - start)
+        results["insert"] = percentiles(latencies)
+        results[f"blend/nprobe={index.nprobe}+delta"] = measure(
+            reopened, query_ids, "blend", args.k, index.nprobe, {}
+        )
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+    results["config"] = {"nlist": nlist}
+    return results
+
+
+def print_results(results: Dict[str, Dict]) -> None:
+    print(f"build {results['build']['seconds']:.1f}s, open {results['open']['seconds'] * 1000:.1f}ms, "
+          f"nlist {results['config']['nlist']}")
+    print(f"{'search':28s} {'recall':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, result in results.items():
+        if "p50_ms" not in result:
+            continue
+        recall_text = f"{result['recall']:.3f}" if "recall" in result else "-"
+        print(f"{name:28s} {recall_text:>7s} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the similar-employee vector index against brute force")
+    parser.add_argument("--employees", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=embedding_dimensions())
+    parser.add_argument("--clusters", type=int, default=500, help="clusters in the synthetic vectors")
+    parser.add_argument("--noise", type=float, default=0.03, help="spread of vectors around their cluster center")
+    parser.add_argument("--nlist", type=int, default=0, help="index clusters (0 = sqrt of employees)")
+    parser.add_argument("--nprobe", default="4,8,16,32",
+                        type=lambda value: [int(item) for item in value.split(",") if item.strip()])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--inserts", type=int, default=500, help="employees appended after the build")
+    parser.add_argument("--dir", default=None, help="keep the index in this directory instead of a temp dir")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""サーバーの起動にかかる時間 (import・待ち受け開始・レディ・最初のマッチングのリクエスト) を測る
+
+    python -m bench.startup --employees 10000 --repeat 5 --output bench_results/startup.json
+
+一時ディレクトリにDBを作り、uvicornを子プロセスとして繰り返し起動して
+- import: python -c "import main" にかかる時間 (別プロセスで計測)
+- listen: 起動から /healthz が応答するまで (/healthz がない場合は --ready-path と同じ)
+- ready: 起動から --ready-path が200を返すまで
+- first_match: レディになった直後の /jobposts/{id}/candidates のレイテンシ
+を記録する。DBに接続できない状態で main をimportできるかも確かめる。
+/readyz のないコミットと比べるときは --ready-path /grades/ を指定する。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.run import BACKEND_DIR, git_commit, percentiles
+from bench.upload_memory import tree_rss_mb
+
+
+def wait_for_status(url: str, process: subprocess.Popen, status: int, timeout: float) -> None:
+    """urlがstatusを返すまで待つ (upload_memory.wait_until_readyより細かい間隔で確かめる)"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == status:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not return {status} within {timeout}s")
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, check=True,
+                            capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def import_without_database(env: Dict[str, str]) -> bool:
+    # 存在しないディレクトリのSQLiteはconnect時に失敗する
+    env = {**env, "DATABASE_URL": "sqlite:////nonexistent/startup_bench/bench.db"}
+    return subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                          capture_output=True).returncode == 0
+
+
+def start_server(args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, Any]:
+    base_url = f"http://127.0.0.1:{args.port}"
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        listen_path = "/healthz" if args.ready_path == "/readyz" else args.ready_path
+        wait_for_status(base_url + listen_path, server, 200, args.timeout)
+        listen = time.perf_counter() - start
+        wait_for_status(base_url + args.ready_path, server, 200, args.timeout)
+        ready = time.perf_counter() - start
+
+        request_start = time.perf_counter()
+        response = httpx.get(f"{base_url}/jobposts/1/candidates", timeout=args.timeout)
+        first_match = time.perf_counter() - request_start
+        return {"listen": listen, "ready": ready, "first_match": first_match,
+                "first_match_status": response.status_code, "rss_mb": tree_rss_mb(server.pid)}
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix="startup_bench_")
+    db = os.path.join(directory, "bench.db")
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "dummy",
+        "DATABASE_URL": f"sqlite:///{db}",
+        "CPU_WORKERS": str(args.cpu_workers),
+        "ANALYSIS_CACHE_PATH": os.path.join(directory, "analysis_cache.db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(directory, "embedding_cache.db"),
+        "JOB_QUEUE_PATH": os.path.join(directory, "job_queue.db"),
+        "JOB_FILES_DIR": os.path.join(directory, "job_files"),
+        "PICTURE_STORE_DIR": os.path.join(directory, "pictures"),
+        "VECTOR_INDEX_DIR": os.path.join(directory, "vector_index"),
+    })
+    try:
+        subprocess.run([sys.executable, "-m", "bench.generate_data", "--db", db, "--employees", str(args.employees),
+                        "--jobposts", str(args.jobposts)], cwd=BACKEND_DIR, env=env, check=True,
+                       capture_output=True)
+        if os.path.exists(os.path.join(BACKEND_DIR, "migrate.py")):
+            subprocess.run([sys.executable, "migrate.py"], cwd=BACKEND_DIR, env=env, check=True,
+                           capture_output=True)
+
+        imports = [measure_import(env) for _ in range(args.repeat)]
+        # 1回目は「似ている社員」のインデックスを作るので、2回目以降と分けて記録する
+        runs = [start_server(args, env) for _ in range(args.repeat + 1)]
+        statuses: Dict[str, int] = {}
+        for item in runs:
+            statuses[str(item["first_match_status"])] = statuses.get(str(item["first_match_status"]), 0) + 1
+        warm = runs[1:]
+        return {
+            "import": percentiles(imports),
+            "listen": percentiles([item["listen"] for item in warm]),
+            "ready": percentiles([item["ready"] for item in warm]),
+            "first_match": percentiles([item["first_match"] for item in warm]),
+            "first_start": runs[0],
+            "first_match_statuses": statuses,
+            "rss_mb": max(item["rss_mb"] for item in warm),
+            "import_without_database": import_without_database(env),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f"{'phase':12s} {'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s}")
+    for name in ("import", "listen", "ready", "first_match"):
+        result = results[name]
+        print(f"{name:12s} {result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f} {result['max_ms']:>9.0f}")
+    first = results["first_start"]
+    print(f"first start: listen {first['listen'] * 1000:.0f} ms, ready {first['ready'] * 1000:.0f} ms, "
+          f"first match {first['first_match'] * 1000:.0f} ms")
+    print(f"first match statuses {results['first_match_statuses']}, rss {results['rss_mb']:.1f} MB, "
+          f"import without database {'ok' if results['import_without_database'] else 'failed'}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure server start-up time until it is ready to serve")
+    parser.add_argument("--employees", type=int, default=10000)
+    parser.add_argument("--jobposts", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5, help="server starts to measure (after the first one)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn --workers")
+    parser.add_argument("--cpu-workers", type=int, default=2, help="CPU_WORKERS for the server")
+    parser.add_argument("--ready-path", default="/readyz", help="path that returns 200 once the server is ready")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--port", type=int, default=8220)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
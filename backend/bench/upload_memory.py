@@ -0,0 +1,234 @@
+"""大きなPDF・画像を同時に登録したときのサーバーのメモリ使用量 (ピークRSS) を測る
+
+    python -m bench.upload_memory --concurrency 8 --pdf-mb 15 --picture-mb 8 --output bench_results/upload_memory.json
+
+一時ディレクトリにDBを作り、偽のOpenAIサーバーとuvicornを子プロセスとして起動する。
+小さな登録で一度ウォームアップしてからRSSを記録し、大きなファイルを添付した登録を同時に送って
+サーバーとその子プロセス (CPU_WORKERSのプロセスプール) のRSSの合計の最大値を比べる。
+/proc を読むのでLinuxでのみ動く。
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from bench.generate_data import make_pdf, resume_lines, bigfive_lines
+from bench.run import BACKEND_DIR, git_commit, percentiles, registration_form
+
+_MB = 1024 * 1024
+
+
+def process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    for index in range(len(pids)):
+        try:
+            tasks = os.listdir(f"/proc/{pids[index]}/task")
+        except FileNotFoundError:
+            continue
+        for task in tasks:
+            try:
+                with open(f"/proc/{pids[index]}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except FileNotFoundError:
+                pass
+    return pids
+
+
+def status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+def tree_rss_mb(pid: int) -> float:
+    return sum(status_kb(child, "VmRSS") for child in process_tree(pid)) / 1024
+
+
+class RssSampler(threading.Thread):
+    """プロセスツリーのRSS合計を一定間隔で読み、最大値を記録する"""
+
+    def __init__(self, pid: int, interval: float = 0.02):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak_mb = max(self.peak_mb, tree_rss_mb(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self) -> float:
+        self._stop_event.set()
+        self.join()
+        return self.peak_mb
+
+
+def noise_picture(size_bytes: int, seed: int) -> bytes:
+    """圧縮できないノイズのPNG (ほぼ size_bytes の大きさになる)"""
+    side = max(int((size_bytes / 3) ** 0.5), 1)
+    image = Image.frombytes("RGB", (side, side), random.Random(seed).randbytes(side * side * 3))
+    output = io.BytesIO()
+    image.save(output, format="PNG", compress_level=1)
+    return output.getvalue()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+async def register_all(base_url: str, files: Dict[str, Any], count: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=count, max_keepalive_connections=count)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        async def register(index: int):
+            start = time.perf_counter()
+            response = await client.post("/employees/", data=registration_form(rng), files=files)
+            return response.status_code, time.perf_counter() - start
+
+        outcomes = await asyncio.gather(*(register(i) for i in range(count)))
+    statuses: Dict[str, int] = {}
+    for status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {"statuses": statuses, **percentiles([elapsed for _, elapsed in outcomes])}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix="upload_memory_bench_")
+    db = os.path.join(directory, "bench.db")
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "dummy",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "DATABASE_URL": f"sqlite:///{db}",
+        "CPU_WORKERS": str(args.cpu_workers),
+        "ANALYSIS_CACHE_PATH": os.path.join(directory, "analysis_cache.db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(directory, "embedding_cache.db"),
+        "JOB_QUEUE_PATH": os.path.join(directory, "job_queue.db"),
+        "JOB_FILES_DIR": os.path.join(directory, "job_files"),
+        "PICTURE_STORE_DIR": os.path.join(directory, "pictures"),
+        "VECTOR_INDEX_DIR": os.path.join(directory, "vector_index"),
+    })
+    processes: List[subprocess.Popen] = []
+    try:
+        subprocess.run([sys.executable, "-m", "bench.generate_data", "--db", db, "--employees", "100",
+                        "--jobposts", "10"], cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "bench.fake_openai", "--port", str(args.openai_port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        processes.append(server)
+        base_url = f"http://127.0.0.1:{args.port}"
+        wait_until_ready(f"http://127.0.0.1:{args.openai_port}/stats", processes[0])
+        wait_until_ready(f"{base_url}/readyz", server)
+
+        pdf_rng = random.Random(args.seed)
+        small = {
+            "resume": ("resume.pdf", make_pdf(resume_lines(pdf_rng, pages=2)), "application/pdf"),
+            "bigfive": ("bigfive.pdf", make_pdf(bigfive_lines(pdf_rng)), "application/pdf"),
+        }
+        # pdfminerやPillowの読み込みなど、初回だけのメモリはここで済ませる
+        warmup = asyncio.run(register_all(base_url, small, 2, args.seed))
+        baseline_mb = tree_rss_mb(server.pid)
+
+        large = {
+            "resume": ("resume.pdf", make_pdf(resume_lines(pdf_rng, pages=args.pages),
+                                              image_bytes=int(args.pdf_mb * _MB), seed=args.seed),
+                       "application/pdf"),
+            "bigfive": ("bigfive.pdf", make_pdf(bigfive_lines(pdf_rng)), "application/pdf"),
+            "picture": ("picture.png", noise_picture(int(args.picture_mb * _MB), args.seed), "image/png"),
+        }
+        request_mb = sum(len(item[1]) for item in large.values()) / _MB
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        try:
+            results = asyncio.run(register_all(base_url, large, args.concurrency, args.seed + 1))
+        finally:
+            peak_mb = sampler.stop()
+        results.update({
+            "warmup_statuses": warmup["statuses"],
+            "request_mb": request_mb,
+            "baseline_rss_mb": baseline_mb,
+            "peak_rss_mb": peak_mb,
+            "growth_mb": peak_mb - baseline_mb,
+            "growth_per_request_mb": (peak_mb - baseline_mb) / args.concurrency,
+            "server_vmhwm_mb": status_kb(server.pid, "VmHWM") / 1024,
+        })
+        return results
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f"statuses {results['statuses']} (request {results['request_mb']:.1f} MB)")
+    print(f"latency p50 {results['p50_ms']:.0f} ms, p95 {results['p95_ms']:.0f} ms, max {results['max_ms']:.0f} ms")
+    print(f"rss baseline {results['baseline_rss_mb']:.1f} MB, peak {results['peak_rss_mb']:.1f} MB, "
+          f"growth {results['growth_mb']:.1f} MB ({results['growth_per_request_mb']:.1f} MB/request), "
+          f"server VmHWM {results['server_vmhwm_mb']:.1f} MB")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure server memory while registering large uploads concurrently")
+    parser.add_argument("--concurrency", type=int, default=8, help="registrations sent at the same time")
+    parser.add_argument("--pdf-mb", type=float, default=15, help="size of the resume PDF (padded with an image)")
+    parser.add_argument("--pages", type=int, default=5, help="text pages in the resume PDF")
+    parser.add_argument("--picture-mb", type=float, default=8, help="size of the attached picture")
+    parser.add_argument("--cpu-workers", type=int, default=2, help="CPU_WORKERS for the server")
+    parser.add_argument("--port", type=int, default=8210)
+    parser.add_argument("--openai-port", type=int, default=8211)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"commit": git_commit(), "created_at": datetime.datetime.now().isoformat(),
+                       "config": config, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
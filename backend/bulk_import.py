@@ -0,0 +1,251 @@
+import os
+import io
+import csv
+import asyncio
+import logging
+import zipfile
+from itertools import islice, repeat
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import utils
+from id_allocator import employee_ids
+from openai_scheduler import BATCH, lane as openai_lane
+from embedding_config import embedding_space
+from models import Employee, EmployeeGrade, DepartmentMember, EmployeeJobAssignment
+from schemas import EmployeeCreate, BulkImportResponse, BulkImportRowResult
+
+# 1回のトランザクションで登録する行数
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "100"))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "5000"))
+
+# CSVでアーカイブ内のファイル名を指定するカラム
+FILE_COLUMNS = {"resume": "resume_file", "bigfive": "bigfive_file", "picture": "picture_file"}
+# アーカイブ内のファイルごとの上限 (画面からの登録と同じ)
+FILE_MAX_BYTES = {"resume": utils.PDF_MAX_BYTES, "bigfive": utils.PDF_MAX_BYTES, "picture": utils.PICTURE_MAX_BYTES}
+
+
+def read_rows(csv_file: UploadFile) -> Iterator[Tuple[int, Dict[str, str]]]:
+    # アップロードされたCSVを行ごとに読み出す (行番号はヘッダを1行目とする)
+    text = io.TextIOWrapper(csv_file.file, encoding="utf-8-sig", newline="")
+    try:
+        for line_number, row in enumerate(csv.DictReader(text), start=2):
+            yield line_number, {key.strip(): (value or "").strip() for key, value in row.items() if key}
+    finally:
+        text.detach()
+
+
+class Archive:
+    """zipをメモリに展開せず、必要になったファイルだけをその都度読み出す"""
+
+    def __init__(self, upload: Optional[UploadFile]):
+        self.zip = None
+        if upload is not None:
+            try:
+                self.zip = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="archive is not a valid zip file")
+
+    def read(self, name: str, max_bytes: int) -> Optional[bytes]:
+        if not name:
+            return None
+        if self.zip is None:
+            raise ValueError(f"{name} given but no archive uploaded")
+        try:
+            info = self.zip.getinfo(name)
+        except KeyError:
+            raise ValueError(f"{name} not found in archive")
+        # 展開後の大きさで確認する (圧縮率の極端なファイルを展開しないように)
+        if info.file_size > max_bytes:
+            raise ValueError(f"{name} exceeds {max_bytes} bytes")
+        return self.zip.read(info)
+
+
+def count_rows(csv_file: UploadFile) -> int:
+    # 登録を始める前に行数の上限を確かめる (途中で413を返すと、それまでのチャンクだけ登録された状態になる)
+    count = sum(1 for _ in read_rows(csv_file))
+    csv_file.file.seek(0)
+    return count
+
+
+def read_chunk(rows: Iterator[Tuple[int, Dict[str, str]]], size: int) -> List[Tuple[int, Dict[str, str]]]:
+    return list(islice(rows, size))
+
+
+async def import_employees(db: AsyncSession, csv_file: UploadFile, archive_file: Optional[UploadFile]) -> BulkImportResponse:
+    # CSVの解析とzipの読み出しは大きなファイルだとイベントループを止めるので、スレッドで行う
+    if await asyncio.to_thread(count_rows, csv_file) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"CSV has more than {BULK_MAX_ROWS} rows")
+    archive = await asyncio.to_thread(Archive, archive_file)
+    results: List[BulkImportRowResult] = []
+
+    rows = read_rows(csv_file)
+    while chunk := await asyncio.to_thread(read_chunk, rows, BULK_CHUNK_SIZE):
+        results.extend(await import_chunk_safely(db, chunk, archive))
+
+    created = sum(1 for result in results if result.status == "created")
+    return BulkImportResponse(created=created, failed=len(results) - created, rows=results)
+
+
+async def import_chunk_safely(db: AsyncSession, chunk: List[Tuple[int, Dict[str, str]]],
+                              archive: Archive) -> List[BulkImportRowResult]:
+    # 想定外のエラーでもそのチャンクの行を失敗として記録し、ほかのチャンクの結果とあわせて返す
+    try:
+        return await import_chunk(db, chunk, archive)
+    except Exception:
+        logging.exception("Failed to import bulk import chunk")
+        await db.rollback()
+        return [BulkImportRowResult(row=line_number, status="failed", error="Error importing employee data")
+                for line_number, _ in chunk]
+
+
+def prepare_rows(chunk: List[Tuple[int, Dict[str, str]]], archive: Archive,
+                 results: Dict[int, BulkImportRowResult]) -> List[Dict[str, Any]]:
+    """入力のチェックとアーカイブからのファイル読み出し (zipの展開を含むのでスレッドで実行する)"""
+    prepared: List[Dict[str, Any]] = []
+    for line_number, row in chunk:
+        try:
+            employee = EmployeeCreate(**{key: value for key, value in row.items() if key not in FILE_COLUMNS.values()})
+            files = {
+                kind: archive.read(row.get(column, ""), FILE_MAX_BYTES[kind]) for kind, column in FILE_COLUMNS.items()
+            }
+        except (ValidationError, ValueError) as e:
+            results[line_number] = BulkImportRowResult(row=line_number, status="failed", error=str(e))
+            continue
+        prepared.append({"row": line_number, "employee": employee, "files": files})
+    return prepared
+
+
+async def import_chunk(db: AsyncSession, chunk: List[Tuple[int, Dict[str, str]]], archive: Archive) -> List[BulkImportRowResult]:
+    results: Dict[int, BulkImportRowResult] = {}
+    prepared = await asyncio.to_thread(prepare_rows, chunk, archive, results)
+
+    # 書類の解析とパスワードハッシュを並行して行う
+    resumes = [item for item in prepared if item["files"]["resume"]]
+    bigfives = [item for item in prepared if item["files"]["bigfive"]]
+    # 一括登録のOpenAI呼び出しは、画面からの個別登録より後回しにする
+    with openai_lane(BATCH):
+        resume_results, bigfive_results, password_hashes = await asyncio.gather(
+            utils.analyze_documents("resume", [item["files"]["resume"] for item in resumes]),
+            utils.analyze_documents("bigfive", [item["files"]["bigfive"] for item in bigfives]),
+            asyncio.gather(*[utils.hash_password_async(item["employee"].password) for item in prepared], return_exceptions=True),
+            return_exceptions=True,
+        )
+    # 種類ごとの処理全体が失敗したときは、その種類のすべての行を失敗にする
+    for items, outcomes, key in ((resumes, resume_results, "resume"), (bigfives, bigfive_results, "bigfive"),
+                                 (prepared, password_hashes, "password_hash")):
+        for item, result in zip(items, outcomes if not isinstance(outcomes, BaseException) else repeat(outcomes)):
+            item[key] = result
+    ready = split_failed(prepared, results)
+
+    # 画像は保存先に残ってしまうので、ほかの処理が成功した行だけ保存する
+    pictures = [item for item in ready if item["files"]["picture"]]
+    picture_hashes = await asyncio.gather(*[utils.save_picture_async(item["files"]["picture"]) for item in pictures],
+                                          return_exceptions=True)
+    for item, result in zip(pictures, picture_hashes):
+        item["picture_hash"] = result
+    ready = split_failed(ready, results)
+
+    if ready:
+        # チャンクの件数分のIDを1文でまとめて確保する
+        for item, employee_id in zip(ready, await employee_ids.allocate_async(len(ready))):
+            item["employee_id"] = employee_id
+        await db.run_sync(insert_chunk, ready, results)
+        # マッチング・インデックス・おすすめへの反映はチャンク単位でまとめて行う (求人ごとのリストの読み書きを1回で済ませる)
+        await utils.index_employees([
+            (item["employee_id"], item["career_info_vector"], item["personality_vector"])
+            for item in ready if results[item["row"]].status == "created"
+        ])
+    return [results[line_number] for line_number, _ in chunk]
+
+
+def split_failed(items: List[Dict[str, Any]], results: Dict[int, BulkImportRowResult]) -> List[Dict[str, Any]]:
+    """いずれかの処理が例外になった行を失敗として記録し、残りの行を返す"""
+    remaining = []
+    for item in items:
+        error = next(
+            (value for value in (item.get("resume"), item.get("bigfive"), item.get("password_hash"), item.get("picture_hash"))
+             if isinstance(value, BaseException)),
+            None,
+        )
+        if error is not None:
+            detail = getattr(error, "detail", None) or str(error) or type(error).__name__
+            results[item["row"]] = BulkImportRowResult(row=item["row"], status="failed", error=str(detail))
+        else:
+            remaining.append(item)
+    return remaining
+
+
+def employee_rows(item: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """1行分の4テーブルの行"""
+    employee_id = item["employee_id"]
+    employee: EmployeeCreate = item["employee"]
+    resume = item.get("resume") or {}
+    bigfive = item.get("bigfive") or {}
+    item["career_info_vector"] = resume.get("vector", [])
+    item["personality_vector"] = bigfive.get("vector", [])
+    return {
+        "employee": {
+            "employee_id": employee_id,
+            "employee_name": employee.employee_name,
+            "birthdate": employee.birthdate,
+            "gender": employee.gender,
+            "academic_background": employee.academic_background,
+            "hire_date": employee.hire_date,
+            "recruitment_type": employee.recruitment_type,
+            "career_info_detail": resume.get("analysis", ""),
+            "career_info_vector": item["career_info_vector"],
+            "personality_detail": bigfive.get("detailed_analysis", ""),
+            "personality_vector": item["personality_vector"],
+            "neuroticism_score": employee.neuroticism_score,
+            "extraversion_score": employee.extraversion_score,
+            "openness_score": employee.openness_score,
+            "agreeableness_score": employee.agreeableness_score,
+            "conscientiousness_score": employee.conscientiousness_score,
+            "password_hash": item["password_hash"],
+            "picture_hash": item.get("picture_hash"),
+            **embedding_space(),
+        },
+        "grade": {"employee_id": employee_id, "grade_id": employee.grade_id},
+        "department": {"employee_id": employee_id, "department_id": employee.department_id},
+        "assignment": {"employee_id": employee_id, "jobpost_id": employee.jobpost_id, "start_date": employee.hire_date},
+    }
+
+
+def insert_rows(db: Session, rows: List[Dict[str, Dict[str, Any]]]) -> None:
+    db.execute(insert(Employee), [row["employee"] for row in rows])
+    db.execute(insert(EmployeeGrade), [row["grade"] for row in rows])
+    db.execute(insert(DepartmentMember), [row["department"] for row in rows])
+    db.execute(insert(EmployeeJobAssignment), [row["assignment"] for row in rows])
+
+
+def insert_chunk(db: Session, ready: List[Dict[str, Any]], results: Dict[int, BulkImportRowResult]) -> None:
+    # 4テーブルを1トランザクションで一括登録する。失敗したら、失敗した行だけを特定するため1行ずつ登録し直す
+    rows = [employee_rows(item) for item in ready]
+    try:
+        insert_rows(db, rows)
+        db.commit()
+        for item in ready:
+            results[item["row"]] = BulkImportRowResult(row=item["row"], status="created", employee_id=item["employee_id"])
+        return
+    except Exception:
+        db.rollback()
+        logging.warning("Failed to insert bulk import chunk; retrying row by row", exc_info=True)
+
+    for item, row in zip(ready, rows):
+        try:
+            insert_rows(db, [row])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.exception(f"Failed to insert bulk import row {item['row']}")
+            detail = str(getattr(e, "orig", None) or type(e).__name__)
+            results[item["row"]] = BulkImportRowResult(row=item["row"], status="failed",
+                                                       error=f"Error saving employee data: {detail}")
+            continue
+        results[item["row"]] = BulkImportRowResult(row=item["row"], status="created", employee_id=item["employee_id"])
@@ -1,12 +1,146 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./R&D.db"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base = declarative_base()
\ No newline at end of file
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+# DBの接続先はここだけで決める (.env または環境変数 DATABASE_URL)
+load_dotenv()
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./R&D.db")
+
+# SQLite以外のDBで使うコネクションプールの大きさ
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# SQLiteの設定
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+def async_database_url(url: str) -> str:
+    # 同期用のURLから非同期ドライバのURLを作る (SQLiteはaiosqlite、PostgreSQLはasyncpg)
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if parsed.get_backend_name() == "postgresql":
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    return url
+
+def engine_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False}}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_pre_ping": True}
+
+def tune_sqlite(sync_engine):
+    """同時アクセスで "database is locked" にならないよう、接続ごとにSQLiteを設定する"""
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.close()
+
+# エンジンは最初に使うときに作る (importしただけではDBドライバの読み込みも接続もしない)。
+# gunicorn --preload でフォークする前に接続を作らないようにするためでもある
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+# セッションの接続先はエンジンを作ったときに設定する
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+            tune_sqlite(_engine)
+            SessionLocal.configure(bind=_engine)
+    return _engine
+
+def get_async_engine():
+    # イベントループをブロックしないための非同期エンジン
+    global _async_engine
+    with _engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(
+                async_database_url(SQLALCHEMY_DATABASE_URL), **engine_options(SQLALCHEMY_DATABASE_URL)
+            )
+            tune_sqlite(_async_engine.sync_engine)
+            AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+def async_session():
+    get_async_engine()
+    return AsyncSessionLocal()
+
+async def dispose_engines() -> None:
+    global _engine, _async_engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+        async_engine, _async_engine = _async_engine, None
+    if engine is not None:
+        engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+async def ping() -> None:
+    """DBに接続できるか確かめる (/readyz 用)"""
+    async with get_async_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+@contextmanager
+def read_snapshot(bind) -> Iterator:
+    """複数のSELECTを同じスナップショットで読む接続 (件数と中身を別々のクエリで読むときに使う)"""
+    with bind.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # READ COMMITTEDでは文ごとにスナップショットが変わる
+            connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            if connection.dialect.name == "sqlite":
+                # pysqliteはSELECTの前にBEGINを出さないので、読み取りトランザクションを自分で始める
+                connection.exec_driver_sql("BEGIN")
+            yield connection
+
+Base = declarative_base()
+
+def add_missing_columns(bind):
+    """既存のテーブルに、モデルに後から追加されたNULL許容カラムを追加する"""
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+def missing_schema(bind) -> List[str]:
+    """モデルにあってDBにないテーブル・カラム ("table" / "table.column")"""
+    inspector = inspect(bind)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in existing)
+    return missing
+
+def migrate(bind) -> None:
+    """テーブルを作り、足りないカラムを追加する (python migrate.py で実行する。サーバーの起動時には行わない)"""
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
@@ -0,0 +1,221 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from openai_scheduler import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # トークン数は tiktoken が入っている場合のみ正確に数える (なければ文字数から見積もる)
+    tiktoken = None
+
+# 書類のテキストをプロンプトに入れる前の整形・トークン数の計測・チャンク分割
+
+
+class PromptBudget(NamedTuple):
+    """1種類の書類の解析に使うモデルとトークン数の予算"""
+    model: str
+    # 解析の出力トークン数の上限
+    max_tokens: int
+    # 書類のテキストをそのままプロンプトに入れる上限。超えたらチャンクごとに要約してから解析する
+    input_tokens: int
+    # 要約するチャンク1つの大きさ・要約1つの出力の上限・チャンク数の上限 (残りは読まない)
+    chunk_tokens: int
+    summary_tokens: int
+    max_chunks: int
+    summary_model: str
+
+    @classmethod
+    def from_env(cls, prefix: str, model: str, max_tokens: int, input_tokens: int, chunk_tokens: int,
+                 summary_tokens: int, max_chunks: int) -> "PromptBudget":
+        """{prefix}_ANALYSIS_MODEL, {prefix}_INPUT_TOKENS などの環境変数で上書きできる予算"""
+        model = os.getenv(f"{prefix}_ANALYSIS_MODEL", model)
+        return cls(
+            model=model,
+            max_tokens=int(os.getenv(f"{prefix}_MAX_TOKENS", str(max_tokens))),
+            input_tokens=int(os.getenv(f"{prefix}_INPUT_TOKENS", str(input_tokens))),
+            chunk_tokens=int(os.getenv(f"{prefix}_CHUNK_TOKENS", str(chunk_tokens))),
+            summary_tokens=int(os.getenv(f"{prefix}_SUMMARY_TOKENS", str(summary_tokens))),
+            max_chunks=int(os.getenv(f"{prefix}_MAX_CHUNKS", str(max_chunks))),
+            summary_model=os.getenv(f"{prefix}_SUMMARY_MODEL", model),
+        )
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # エンコーディングのファイルを取得できない (オフラインなど) 場合は見積もりで数える
+        logging.warning(f"Could not load the tokenizer for {model}; estimating token counts instead")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    encoding = _encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    # estimate_tokensと同じ数え方で、上限に達する位置で切る
+    used = 0.0
+    for index, char in enumerate(text):
+        used += 0.25 if ord(char) < 128 else 1
+        if used > max_tokens:
+            return text[:index]
+    return text
+
+
+# --- 整形 ---
+
+_SPACES = re.compile(r"[ \t　\xa0]+")
+# 区切り線だけの行
+_RULE = re.compile(r"[-‐―─━=＝_＿*・.。…~〜]{3,}")
+# ページ番号だけの行 (「- 3 -」「3 / 10」「Page 3」「3ページ」)
+_PAGE_NUMBER = re.compile(r"(?i)(?:page\s*)?[-‐–—]?\s*\d{1,3}\s*(?:/\s*\d{1,3})?\s*[-‐–—]?|\d{1,3}\s*ページ")
+# ヘッダー・フッターとして扱うページの先頭・末尾の行数
+_EDGE_LINES = 2
+
+
+def _edge_indexes(lines: Sequence[str]) -> List[int]:
+    filled = [index for index, line in enumerate(lines) if line]
+    return filled[:_EDGE_LINES] + filled[-_EDGE_LINES:]
+
+
+def clean_text(text: str) -> str:
+    """空白を詰め、ページごとのヘッダー・フッター・ページ番号・区切り線を取り除く
+
+    pdfminerの出力はページの区切りが改ページ文字 (\\f) になっている。
+    """
+    pages = [[_SPACES.sub(" ", line).strip() for line in page.splitlines()] for page in text.split("\f")]
+    pages = [lines for lines in pages if any(lines)]
+
+    # 半数以上のページの先頭・末尾に同じ行があればヘッダー・フッターとみなす
+    repeated = set()
+    if len(pages) >= 3:
+        counts = {}
+        for lines in pages:
+            for line in {lines[index] for index in _edge_indexes(lines)}:
+                counts[line] = counts.get(line, 0) + 1
+        repeated = {line for line, count in counts.items() if count >= max(3, len(pages) // 2)}
+
+    output: List[str] = []
+    for lines in pages:
+        edges = set(_edge_indexes(lines))
+        for index, line in enumerate(lines):
+            if _RULE.fullmatch(line):
+                continue
+            if index in edges and (line in repeated or _PAGE_NUMBER.fullmatch(line)):
+                continue
+            if line or (output and output[-1]):
+                output.append(line)
+    return "\n".join(output).strip()
+
+
+# --- チャンク分割 ---
+
+# 見出しとみなす行 (記号・番号・【】で始まる短い行や、コロンで終わる短い行)
+_HEADING = re.compile(
+    r"(?:#{1,6} |[■□◆◇●○▼▽▶►★☆【\[［<＜]"
+    r"|(?:\d{1,2}|[０-９]{1,2}|[一二三四五六七八九十]{1,3})[.．、)）] ?\S)"
+)
+_HEADING_MAX_CHARS = 40
+
+
+def is_heading(line: str) -> bool:
+    if not line or len(line) > _HEADING_MAX_CHARS:
+        return False
+    return bool(_HEADING.match(line)) or line.endswith((":", "："))
+
+
+def split_sections(text: str) -> List[str]:
+    """見出しの行の前で区切る"""
+    sections: List[List[str]] = [[]]
+    for line in text.split("\n"):
+        if is_heading(line) and any(sections[-1]):
+            sections.append([])
+        sections[-1].append(line)
+    return ["\n".join(lines).strip() for lines in sections if any(lines)]
+
+
+# 大きすぎるセクションを分ける区切り (段落 → 行 → 文 → 語)
+_SEPARATORS = ("\n\n", "\n", "。", " ")
+
+
+def _split_oversized(text: str, max_tokens: int, model: str, separators: Sequence[str] = _SEPARATORS) -> List[str]:
+    if count_tokens(text, model) <= max_tokens:
+        return [text]
+    if not separators:
+        return _hard_split(text, max_tokens, model)
+
+    separator, rest = separators[0], separators[1:]
+    parts = text.split(separator)
+    if separator == "。":
+        parts = [part + separator for part in parts[:-1]] + parts[-1:]
+    if len(parts) == 1:
+        return _split_oversized(text, max_tokens, model, rest)
+    joiner = "" if separator == "。" else separator
+    pieces: List[str] = []
+    for part in parts:
+        if part.strip():
+            pieces.extend(_split_oversized(part, max_tokens, model, rest))
+    return _pack(pieces, max_tokens, model, joiner)
+
+
+def _hard_split(text: str, max_tokens: int, model: str) -> List[str]:
+    """区切りのないテキストをトークン数で切る"""
+    encoding = _encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+    chunks = []
+    while text:
+        head = truncate_tokens(text, max_tokens, model) or text[:1]
+        chunks.append(head)
+        text = text[len(head):]
+    return chunks
+
+
+def _pack(pieces: Sequence[str], max_tokens: int, model: str, joiner: str) -> List[str]:
+    """上限を超えない範囲で隣り合う断片をつなげる"""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for piece in pieces:
+        tokens = count_tokens(piece, model)
+        if current and size + tokens > max_tokens:
+            chunks.append(joiner.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        chunks.append(joiner.join(current))
+    return chunks
+
+
+def chunk_text(text: str, max_tokens: int, model: str, max_chunks: Optional[int] = None) -> Tuple[List[str], int]:
+    """見出しの区切りを優先して、max_tokens以下のチャンクに分ける
+
+    max_chunksを超えた分は捨て、(チャンク, 捨てたトークン数) を返す。
+    """
+    pieces: List[str] = []
+    for section in split_sections(text):
+        pieces.extend(_split_oversized(section, max_tokens, model))
+    chunks = _pack(pieces, max_tokens, model, "\n\n")
+    if max_chunks is None or len(chunks) <= max_chunks:
+        return chunks, 0
+    dropped = sum(count_tokens(chunk, model) for chunk in chunks[max_chunks:])
+    return chunks[:max_chunks], dropped
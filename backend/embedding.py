@@ -1,59 +1,271 @@
-import os
-from openai import OpenAI
-import sqlalchemy as sa
-from sqlalchemy import create_engine, MetaData, Table, select, update
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
-import json
-from models import JobPost
-
-# .env ファイルから APIキーとデータベースURLを読み込む
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# OpenAI APIキーを設定
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# SQLAlchemy データベース接続設定
-engine = create_engine(DATABASE_URL)
-metadata = MetaData()
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# テーブル定義
-job_post = Table('job_post', metadata, autoload_with=engine)
-
-## Embeddingを生成する関数
-def get_embedding(text, model="text-embedding-3-large"): 
-    text = text.replace("\n", " ")  # 改行をスペースに置換
-    return client.embeddings.create(input = [text], model=model).data[0].embedding
-
-def update_job_detail_vectors():
-    with engine.connect() as connection:
-        # job_postテーブルからjobpost_idとjob_detailを取得
-        query = select(JobPost.jobpost_id, JobPost.job_detail)
-        result = connection.execute(query)
-
-        for row in result:
-            jobpost_id = row[0]
-            job_detail = row[1]
-
-            # job_detailをembeddingに変換
-            embedding = get_embedding(job_detail)
-
-            # embeddingをjob_detail_vectorに挿入 (修正箇所)
-            update_query = (
-                update(job_post)
-                .where(job_post.c.jobpost_id == jobpost_id)
-                .values(job_detail_vector=json.dumps(embedding))
-            )
-            connection.execute(update_query)
-
-            # 変更をデータベースにコミット (追記)
-            connection.commit() 
-
-            print(f"Updated jobpost_id {jobpost_id} with embedding.")
-
-if __name__ == "__main__":
-    update_job_detail_vectors()
\ No newline at end of file
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from sqlalchemy import select, update, bindparam
+from dotenv import load_dotenv
+from models import Employee, JobPost
+from database import SessionLocal, get_engine, missing_schema
+from embedding_cache import embedding_cache
+from embedding_config import EMBEDDING_MODEL, embedding_dimensions, embedding_space, is_current, request_dimensions
+from openai_scheduler import scheduler, BATCH, lane
+from vector_index import vector_index
+from recommendations import recommendations
+
+# .env ファイルから APIキーを読み込む (データベースURLはdatabase.pyで読み込む)
+load_dotenv()
+
+# 再エンベディングのバッチ設定 (モデルと次元数はembedding_config.pyで設定する)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_RPM = float(os.getenv("EMBEDDING_RPM", "500"))
+EMBEDDING_CHECKPOINT_PATH = os.getenv("EMBEDDING_CHECKPOINT_PATH", "./job_detail_vectors.checkpoint.json")
+EMPLOYEE_EMBEDDING_CHECKPOINT_PATH = os.getenv(
+    "EMPLOYEE_EMBEDDING_CHECKPOINT_PATH", "./employee_vectors.checkpoint.json"
+)
+
+## Embeddingを生成する関数 (OpenAIの呼び出しはopenai_schedulerを通す)
+async def get_embedding(text, model=EMBEDDING_MODEL):
+    # 変更のないjob_detailはキャッシュから返す (改行のスペース置換はキャッシュ側で行う)
+    dimensions = request_dimensions(model)
+    return await embedding_cache.get_or_create_async(
+        text, model, lambda normalized: scheduler.embed_one(normalized, model, dimensions, priority=BATCH), dimensions
+    )
+
+async def get_embeddings(texts, model=EMBEDDING_MODEL):
+    # 複数テキストを1回のAPI呼び出しでまとめて変換する (キャッシュ済みのものは送らない)
+    dimensions = request_dimensions(model)
+    return await embedding_cache.get_or_create_many_async(
+        texts, model, lambda normalized_texts: scheduler.embed(normalized_texts, model, dimensions, priority=BATCH),
+        dimensions,
+    )
+
+def job_detail_hash(job_detail: str, model: str = EMBEDDING_MODEL) -> str:
+    # モデルや次元数を変えた場合も再計算されるように両方を含める
+    return hashlib.sha256(f"{model}\n{embedding_dimensions(model)}\n{job_detail}".encode("utf-8")).hexdigest()
+
+class Checkpoint:
+    """処理済みのID (jobpost_id / employee_id) を記録し、中断後はその続きから再開できるようにする
+
+    バッチは並行に完了するので、先頭から途切れずに完了した範囲の最大IDだけを保存する。
+    """
+
+    def __init__(self, path: str, key: str = "last_jobpost_id", initial=0):
+        self.path = path
+        self.key = key
+        self.initial = initial
+        self.lock = threading.Lock()
+        self.pending = []
+        self.done = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self.initial
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f).get(self.key, self.initial)
+
+    def plan(self, batches):
+        self.pending = [batch[-1]["_id"] for batch in batches]
+
+    def complete(self, last_id: int):
+        with self.lock:
+            self.done.add(last_id)
+            watermark = None
+            while self.pending and self.pending[0] in self.done:
+                watermark = self.pending.pop(0)
+            if watermark is not None:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({self.key: watermark}, f)
+                os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def check_schema():
+    # スキーマの変更はmigrate.pyだけで行う (job_detail_hashなどのカラムがなければ実行前に止める)
+    missing = missing_schema(get_engine())
+    if missing:
+        sys.exit(f"Database schema is out of date (missing {', '.join(missing)}); run python migrate.py")
+
+def update_vectors(jobposts=True, employees=False, batch_size=EMBEDDING_BATCH_SIZE,
+                   concurrency=EMBEDDING_CONCURRENCY, rpm=EMBEDDING_RPM, force=False, restart=False):
+    # schedulerとそのAsyncOpenAIクライアントは最初に使ったイベントループに結びつくので、
+    # 求人と社員の両方を作り直すときも1回のasyncio.runの中で続けて実行する
+    asyncio.run(_update_vectors(jobposts, employees, batch_size, concurrency, rpm, force, restart))
+
+async def _update_vectors(jobposts, employees, *options):
+    if jobposts:
+        await _update_job_detail_vectors(*options)
+    if employees:
+        await _update_employee_vectors(*options)
+
+def update_job_detail_vectors(batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY,
+                              rpm=EMBEDDING_RPM, force=False, restart=False):
+    update_vectors(True, False, batch_size, concurrency, rpm, force, restart)
+
+async def _update_job_detail_vectors(batch_size, concurrency, rpm, force, restart):
+    check_schema()
+    checkpoint = Checkpoint(EMBEDDING_CHECKPOINT_PATH)
+    if restart:
+        checkpoint.clear()
+    start_after = checkpoint.load()
+    if start_after:
+        print(f"Resuming after jobpost_id {start_after}.")
+
+    # job_postテーブルから未処理・変更ありの行だけを取り出す
+    with get_engine().connect() as connection:
+        query = (
+            select(JobPost.jobpost_id, JobPost.job_detail, JobPost.job_detail_hash)
+            .where(JobPost.jobpost_id > start_after)
+            .order_by(JobPost.jobpost_id)
+        )
+        rows = connection.execute(query).all()
+
+    targets = []
+    for jobpost_id, job_detail, stored_hash in rows:
+        new_hash = job_detail_hash(job_detail)
+        if force or new_hash != stored_hash:
+            targets.append({"_id": jobpost_id, "job_detail": job_detail, "hash": new_hash})
+
+    print(f"{len(targets)} of {len(rows)} job posts need new embeddings.")
+    if not targets:
+        checkpoint.clear()
+        return
+
+    batches = [targets[i:i + batch_size] for i in range(0, len(targets), batch_size)]
+    checkpoint.plan(batches)
+    # このプロセスからのリクエスト数の上限 (429を受けた場合はスケジューラが待って再試行する)
+    scheduler.configure(rpm=rpm, concurrency=concurrency)
+    update_query = (
+        update(JobPost)
+        .where(JobPost.jobpost_id == bindparam("_id"))
+        .values(job_detail_vector=bindparam("vector"), job_detail_hash=bindparam("hash"), **embedding_space())
+    )
+
+    def write(params):
+        # バッチ単位で1トランザクションにまとめて書き込む
+        with get_engine().begin() as connection:
+            connection.execute(update_query, params)
+
+    async def process(batch):
+        embeddings = await get_embeddings([row["job_detail"] for row in batch])
+        params = [
+            {"_id": row["_id"], "vector": embedding, "hash": row["hash"]}
+            for row, embedding in zip(batch, embeddings)
+        ]
+        await asyncio.to_thread(write, params)
+        checkpoint.complete(batch[-1]["_id"])
+        print(f"Updated jobpost_id {batch[0]['_id']}..{batch[-1]['_id']} ({len(batch)} rows) with embeddings.")
+
+    # 同時実行数とレート制限はスケジューラが守る。いずれかのバッチが失敗したら例外を送出する (チェックポイントから再開可能)
+    with lane(BATCH):
+        await asyncio.gather(*(process(batch) for batch in batches))
+
+    checkpoint.clear()
+    # 保存済みのおすすめのうち、ベクトルが変わった求人に関わるリストを作り直す
+    await asyncio.to_thread(refresh_recommendations, [row["_id"] for row in targets])
+
+def refresh_recommendations(jobpost_ids=None):
+    # jobpost_idsがNoneなら全件を作り直す
+    try:
+        with SessionLocal() as db:
+            if jobpost_ids is None:
+                recommendations.rebuild(db)
+            else:
+                recommendations.refresh_jobposts(db, jobpost_ids)
+    except Exception:
+        logging.exception("Failed to update recommendations; run python recommendations.py")
+
+def update_employee_vectors(batch_size=EMBEDDING_BATCH_SIZE, concurrency=EMBEDDING_CONCURRENCY,
+                            rpm=EMBEDDING_RPM, force=False, restart=False):
+    update_vectors(False, True, batch_size, concurrency, rpm, force, restart)
+
+async def _update_employee_vectors(batch_size, concurrency, rpm, force, restart):
+    # 職務経歴・性格の分析結果を、現在のモデルと次元数でエンベディングし直す (求人と同じ空間にそろえる)
+    check_schema()
+    checkpoint = Checkpoint(EMPLOYEE_EMBEDDING_CHECKPOINT_PATH, key="last_employee_id", initial="")
+    if restart:
+        checkpoint.clear()
+    start_after = checkpoint.load()
+    if start_after:
+        print(f"Resuming after employee_id {start_after}.")
+
+    with get_engine().connect() as connection:
+        query = (
+            select(Employee.employee_id, Employee.career_info_detail, Employee.personality_detail,
+                   Employee.embedding_model, Employee.embedding_dimensions)
+            .where(Employee.employee_id > start_after)
+            .order_by(Employee.employee_id)
+        )
+        rows = connection.execute(query).all()
+
+    targets = [
+        {"_id": employee_id, "career": career or "", "personality": personality or ""}
+        for employee_id, career, personality, model, dimensions in rows
+        if force or not is_current(model, dimensions)
+    ]
+
+    print(f"{len(targets)} of {len(rows)} employees need new embeddings.")
+    if not targets:
+        checkpoint.clear()
+        return
+
+    batches = [targets[i:i + batch_size] for i in range(0, len(targets), batch_size)]
+    checkpoint.plan(batches)
+    scheduler.configure(rpm=rpm, concurrency=concurrency)
+    update_query = (
+        update(Employee)
+        .where(Employee.employee_id == bindparam("_id"))
+        .values(career_info_vector=bindparam("career_vector"), personality_vector=bindparam("personality_vector"),
+                **embedding_space())
+    )
+
+    def write(params):
+        with get_engine().begin() as connection:
+            connection.execute(update_query, params)
+
+    async def process(batch):
+        # 空のテキストはAPIに送らず空のベクトルにする (登録時と同じ)
+        texts = [text for row in batch for text in (row["career"], row["personality"]) if text]
+        embeddings = iter(await get_embeddings(texts)) if texts else iter(())
+        params = [
+            {
+                "_id": row["_id"],
+                "career_vector": next(embeddings) if row["career"] else [],
+                "personality_vector": next(embeddings) if row["personality"] else [],
+            }
+            for row in batch
+        ]
+        await asyncio.to_thread(write, params)
+        checkpoint.complete(batch[-1]["_id"])
+        print(f"Updated employee_id {batch[0]['_id']}..{batch[-1]['_id']} ({len(batch)} rows) with embeddings.")
+
+    with lane(BATCH):
+        await asyncio.gather(*(process(batch) for batch in batches))
+
+    checkpoint.clear()
+    # 「似ている社員」のインデックスとおすすめも新しいベクトルで作り直す
+    await asyncio.to_thread(vector_index.compact)
+    await asyncio.to_thread(refresh_recommendations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-embed job posts (and optionally employees) with the configured embedding model and dimensions"
+    )
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_CONCURRENCY)
+    parser.add_argument("--rpm", type=float, default=EMBEDDING_RPM, help="max embedding requests per minute")
+    parser.add_argument("--force", action="store_true", help="re-embed all rows even if they are already current")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--employees", action="store_true", help="re-embed employee career/personality vectors only")
+    target.add_argument("--all", action="store_true", help="re-embed both job posts and employees")
+    args = parser.parse_args()
+    update_vectors(not args.employees, args.employees or args.all,
+                   args.batch_size, args.concurrency, args.rpm, args.force, args.restart)
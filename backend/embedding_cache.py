@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from models import pack_vector, unpack_vector
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "1024"))
+# 参照時刻 (accessed_at) の更新は、この件数たまるか次の書き込みのときにまとめて行う
+_TOUCH_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    # APIに送るテキストと同じ正規化をキャッシュキーにも使う
+    return text.replace("\n", " ").strip()
+
+
+def cache_key(text: str, model: str, dimensions: Optional[int] = None) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{dimensions or ''}:{digest}"
+
+
+class EmbeddingCache:
+    """(モデル, 次元数, 正規化済みテキストのsha256) をキーにしたEmbeddingの永続キャッシュ
+
+    メモリ上のLRUとSQLiteファイルの2段構成。ファイルが上限サイズを超えたら
+    最後に参照された時刻が古いものから削除する。
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._total_bytes = 0
+        self._touched: Dict[str, float] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        # 初回アクセス時に接続する
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " dimensions INTEGER,"
+                " vector BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_accessed_at ON embedding_cache (accessed_at)")
+            conn.commit()
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def connect(self) -> None:
+        """接続とテーブルの作成を先に済ませておく (起動時のウォームアップ用)"""
+        with self._lock:
+            self._connection()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            now = time.time()
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self.memory_hits += 1
+                    # メモリで見つかったものもファイル上の参照時刻を更新する (よく使うものほど古く見えて先に消されないように)
+                    self._touched[key] = now
+                else:
+                    missing.append(key)
+
+            if missing:
+                conn = self._connection()
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ", ".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = unpack_vector(blob).tolist()
+                        found[key] = vector
+                        self._remember(key, vector)
+                    self._touched.update((key, now) for key, _ in rows)
+            if len(self._touched) >= _TOUCH_BATCH:
+                conn = self._connection()
+                self._flush_touched(conn)
+                conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]], model: str, dimensions: Optional[int] = None) -> None:
+        if not items:
+            return
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            rows = []
+            for key, vector in items.items():
+                blob = pack_vector(np.asarray(vector, dtype=np.float32), "float32")
+                rows.append((key, model, dimensions, blob, len(blob), now))
+                self._remember(key, list(vector))
+            conn.executemany("INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._flush_touched(conn)
+            conn.commit()
+            self._total_bytes += sum(row[4] for row in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _flush_touched(self, conn: sqlite3.Connection) -> None:
+        # 参照のたびにcommitしないよう、参照時刻の更新はまとめて書く (commitは呼び出し側で行う)
+        if self._touched:
+            conn.executemany("UPDATE embedding_cache SET accessed_at = ? WHERE key = ?",
+                             [(accessed_at, key) for key, accessed_at in self._touched.items()])
+            self._touched = {}
+
+    async def get_many_async(self, keys: List[str]) -> Dict[str, List[float]]:
+        # SQLiteの読み書きはイベントループの外で行う
+        return await asyncio.to_thread(self.get_many, keys)
+
+    async def put_many_async(self, items: Dict[str, List[float]], model: str, dimensions: Optional[int] = None) -> None:
+        await asyncio.to_thread(self.put_many, items, model, dimensions)
+
+    def _evict(self) -> None:
+        # 上限の9割まで古いものから削除する
+        conn = self._connection()
+        self._flush_touched(conn)
+        target = int(self.max_bytes * 0.9)
+        self._total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embedding_cache").fetchone()[0]
+        removed = 0
+        while self._total_bytes > target:
+            rows = conn.execute(
+                "SELECT key, size FROM embedding_cache ORDER BY accessed_at LIMIT 500"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                conn.execute("DELETE FROM embedding_cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._total_bytes -= size
+                removed += 1
+            conn.commit()
+        logging.info(f"Evicted {removed} entries from embedding cache")
+
+    async def get_or_create_async(self, text: str, model: str, create: Callable[[str], Awaitable[List[float]]],
+                                  dimensions: Optional[int] = None) -> List[float]:
+        """キャッシュにあれば返し、なければcreate(正規化済みテキスト)で生成して保存する (createはコルーチン関数)"""
+        key = cache_key(text, model, dimensions)
+        found = await self.get_many_async([key])
+        if key in found:
+            return found[key]
+        vector = await create(normalize_text(text))
+        await self.put_many_async({key: vector}, model, dimensions)
+        return vector
+
+    async def get_or_create_many_async(self, texts: List[str], model: str,
+                                       create: Callable[[List[str]], Awaitable[List[List[float]]]],
+                                       dimensions: Optional[int] = None) -> List[List[float]]:
+        """複数テキスト版。キャッシュにないものだけをまとめてcreateに渡す"""
+        keys = [cache_key(text, model, dimensions) for text in texts]
+        found = await self.get_many_async(list(dict.fromkeys(keys)))
+
+        pending: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = normalize_text(text)
+        if pending:
+            created = dict(zip(pending.keys(), await create(list(pending.values()))))
+            await self.put_many_async(created, model, dimensions)
+            found.update(created)
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._total_bytes,
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,47 @@
+import os
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+# 社員・求人のベクトルはすべてこの設定で作る (同じ空間でないと類似度を比較できない)
+load_dotenv()
+
+# モデルごとの本来の次元数
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+# dimensionsで切り詰められるモデル (text-embedding-3系のみ)
+_TRUNCATABLE_MODELS = ("text-embedding-3-small", "text-embedding-3-large")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+# 0ならモデル本来の次元数。text-embedding-3-largeを1024次元にすると、3072次元の1/3の大きさで
+# text-embedding-3-small(1536次元)より高い精度が得られる
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
+# 新しく書き込むベクトルの保存形式 (float32 / float16 / int8)。int8はfloat32の約1/4の大きさ
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+
+
+def embedding_dimensions(model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS) -> int:
+    """実際に保存されるベクトルの次元数"""
+    native = MODEL_DIMENSIONS.get(model)
+    if dimensions and (native is None or dimensions < native):
+        return dimensions
+    return native or dimensions
+
+
+def request_dimensions(model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS) -> Optional[int]:
+    """APIに渡すdimensions (切り詰めない場合はNone)"""
+    if model in _TRUNCATABLE_MODELS and dimensions and dimensions < MODEL_DIMENSIONS[model]:
+        return dimensions
+    return None
+
+
+def embedding_space() -> Dict[str, Any]:
+    """ベクトルと一緒に保存するモデル名と次元数"""
+    return {"embedding_model": EMBEDDING_MODEL, "embedding_dimensions": embedding_dimensions()}
+
+
+def is_current(model: Optional[str], dimensions: Optional[int]) -> bool:
+    return model == EMBEDDING_MODEL and dimensions == embedding_dimensions()
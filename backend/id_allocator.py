@@ -0,0 +1,137 @@
+import os
+import asyncio
+import logging
+import argparse
+import threading
+from typing import List, Optional
+
+from sqlalchemy import Integer, bindparam, cast, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Employee, IdSequence
+from database import get_engine
+
+# 社員IDの形式 (接頭辞 + 0埋めした連番。桁数を超えた番号はそのまま桁が増える)
+EMPLOYEE_ID_PREFIX = os.getenv("EMPLOYEE_ID_PREFIX", "SAPPORO")
+EMPLOYEE_ID_WIDTH = int(os.getenv("EMPLOYEE_ID_WIDTH", "4"))
+# プロセスごとに先取りしておく番号の数。1なら登録のたびに払い出す (ワーカーが複数だと番号の順と登録順がずれる)
+EMPLOYEE_ID_BLOCK_SIZE = int(os.getenv("EMPLOYEE_ID_BLOCK_SIZE", "1"))
+
+_sequences = IdSequence.__table__
+
+
+class IdAllocator:
+    """カウンタテーブル (id_sequence) の1行を1文で進めてIDを払い出す
+
+    最大IDを検索して+1する方法と違い、同時に登録しても同じ番号は払い出さない。
+    カウンタの更新は登録とは別の短いトランザクションで行うので、登録が失敗した番号は欠番になる。
+    """
+
+    def __init__(self, name: str, prefix: str, width: int, block_size: int = 1, column=None):
+        self.name = name
+        self.prefix = prefix
+        self.width = width
+        self.block_size = max(block_size, 1)
+        # カウンタがまだないときに、この列の既存のIDの最大の番号から始める
+        self.column = column
+        self._lock = threading.Lock()
+        # 先取りした番号のうち未使用の範囲 [_next, _end)
+        self._next = 0
+        self._end = 0
+
+    def format(self, number: int) -> str:
+        return f"{self.prefix}{str(number).zfill(self.width)}"
+
+    def _existing_max(self):
+        # 文字列の順序ではなく、接頭辞を除いた番号の数値で最大を取る (SAPPORO9999 の次も正しく扱う)
+        number = cast(func.substr(self.column, len(self.prefix) + 1), Integer)
+        return select(literal(self.name), func.coalesce(func.max(number), 0)).where(
+            self.column.like(f"{self.prefix}%")
+        )
+
+    def _create(self, bind) -> None:
+        try:
+            with bind.begin() as connection:
+                if self.column is None:
+                    connection.execute(insert(_sequences).values(name=self.name, value=0))
+                else:
+                    connection.execute(insert(_sequences).from_select(["name", "value"], self._existing_max()))
+        except IntegrityError:
+            # 別のワーカーが先に作った
+            pass
+
+    def _reserve(self, count: int, bind) -> int:
+        """count個の番号を確保し、最後の番号を返す"""
+        statement = (
+            update(_sequences)
+            .where(_sequences.c.name == self.name)
+            .values(value=_sequences.c.value + bindparam("count"))
+            .returning(_sequences.c.value)
+        )
+        for _ in range(2):
+            with bind.begin() as connection:
+                value = connection.execute(statement, {"count": count}).scalar_one_or_none()
+            if value is not None:
+                return value
+            self._create(bind)
+        raise RuntimeError(f"Could not create the id sequence {self.name!r}")
+
+    def allocate(self, count: int = 1, bind=None) -> List[str]:
+        """count個のIDを払い出す (先取りした番号が足りなければ、まとめて1文で確保する)"""
+        if count <= 0:
+            return []
+        with self._lock:
+            numbers = list(range(self._next, min(self._end, self._next + count)))
+            self._next += len(numbers)
+            remaining = count - len(numbers)
+            if remaining:
+                reserved = max(remaining, self.block_size)
+                last = self._reserve(reserved, bind or get_engine())
+                first = last - reserved + 1
+                numbers.extend(range(first, first + remaining))
+                self._next, self._end = first + remaining, last + 1
+        return [self.format(number) for number in numbers]
+
+    async def allocate_async(self, count: int = 1) -> List[str]:
+        return await asyncio.to_thread(self.allocate, count)
+
+    def current(self, bind=None) -> Optional[int]:
+        with (bind or get_engine()).connect() as connection:
+            return connection.execute(
+                select(_sequences.c.value).where(_sequences.c.name == self.name)
+            ).scalar_one_or_none()
+
+    def sync(self, bind=None) -> int:
+        """既存のIDの最大の番号より小さければカウンタを進める (別の経路でIDを入れた後に使う)"""
+        bind = bind or get_engine()
+        self._create(bind)
+        with bind.begin() as connection:
+            if self.column is not None:
+                existing = connection.execute(self._existing_max()).one()[1]
+                connection.execute(
+                    update(_sequences).where(_sequences.c.name == self.name, _sequences.c.value < existing)
+                    .values(value=existing)
+                )
+            value = connection.execute(select(_sequences.c.value).where(_sequences.c.name == self.name)).scalar_one()
+        with self._lock:
+            # 先取りした番号は捨てる
+            self._next = self._end = 0
+        return value
+
+
+employee_ids = IdAllocator("employee", EMPLOYEE_ID_PREFIX, EMPLOYEE_ID_WIDTH, EMPLOYEE_ID_BLOCK_SIZE,
+                           column=Employee.employee_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or fix the employee id counter")
+    parser.add_argument("--sync", action="store_true",
+                        help="advance the counter past the largest existing employee id")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.sync:
+        value = employee_ids.sync()
+    else:
+        value = employee_ids.current()
+    print(f"{employee_ids.name}: last allocated {value}"
+          + (f", next {employee_ids.format(value + 1)}" if value is not None else " (created on first registration)"))
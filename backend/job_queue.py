@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from uploads import Document, SpooledFile
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "./job_queue.db")
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", "./job_files")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 再試行の待ち時間 (秒)。attempts回目の失敗後は JOB_RETRY_BASE * 2**(attempts-1) 秒待つ
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "5"))
+# 実行中のジョブがこの秒数を超えて更新されなければ、プロセスが落ちたとみなして再実行する
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+
+class Job:
+    def __init__(self, row: sqlite3.Row):
+        self.job_id = row["job_id"]
+        self.kind = row["kind"]
+        self.status = row["status"]
+        self.progress = row["progress"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        self.payload = json.loads(row["payload"])
+        self.result = json.loads(row["result"]) if row["result"] else None
+        self.error = row["error"]
+        self.created_at = row["created_at"]
+        self.updated_at = row["updated_at"]
+
+    @property
+    def files_dir(self) -> str:
+        return os.path.join(JOB_FILES_DIR, self.job_id)
+
+    def read_file(self, name: str) -> Optional[bytes]:
+        path = os.path.join(self.files_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def file(self, name: str) -> Optional[SpooledFile]:
+        # 中身を読み込まずにパスで扱う (大きなPDFをメモリに載せない)
+        path = os.path.join(self.files_dir, name)
+        return SpooledFile(path) if os.path.exists(path) else None
+
+
+class JobQueue:
+    """SQLiteに保存する永続ジョブキュー
+
+    ジョブはqueued → running → succeeded / failed と遷移する。失敗したジョブは
+    指数バックオフで再試行され、プロセスの再起動後も処理が続けられる。
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, workers: int = JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self.handlers: Dict[str, Callable[[Job, Callable[[str], Awaitable[None]]], Awaitable[Any]]] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: list[asyncio.Task] = []
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # 複数のuvicornワーカーから同じファイルを使えるよう、トランザクションは明示的に管理する
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job ("
+                " job_id TEXT PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " progress TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " result TEXT,"
+                " error TEXT,"
+                " next_run_at REAL NOT NULL,"
+                " locked_by TEXT,"
+                " locked_until REAL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_job_status_next_run_at ON job (status, next_run_at)")
+            self._conn = conn
+        return self._conn
+
+    def handler(self, kind: str):
+        """ジョブの種類ごとの処理を登録するデコレータ"""
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], files: Optional[Dict[str, Optional[Document]]] = None,
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        job_id = uuid.uuid4().hex
+        # ファイルを先に保存してからジョブを登録する (ワーカーが中途半端な状態を見ないように)
+        if files:
+            files_dir = os.path.join(JOB_FILES_DIR, job_id)
+            os.makedirs(files_dir, exist_ok=True)
+            for name, data in files.items():
+                if data is None:
+                    continue
+                path = os.path.join(files_dir, name)
+                if isinstance(data, SpooledFile):
+                    # 書き出し済みのアップロードはコピーせずに移動する
+                    shutil.move(data.path, path)
+                    with open(path, "rb+") as f:
+                        os.fsync(f.fileno())
+                    continue
+                with open(path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        now = time.time()
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO job (job_id, kind, status, progress, attempts, max_attempts, payload, next_run_at,"
+                " created_at, updated_at) VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?, ?, ?)",
+                (job_id, kind, max_attempts, json.dumps(payload, ensure_ascii=False, default=str), now, now, now),
+            )
+        return job_id
+
+    async def enqueue_async(self, kind: str, payload: Dict[str, Any],
+                            files: Optional[Dict[str, Optional[Document]]] = None,
+                            max_attempts: int = JOB_MAX_ATTEMPTS) -> str:
+        # ファイルの移動・fsyncとINSERTはイベントループの外で行う
+        return await asyncio.to_thread(self.enqueue, kind, payload, files, max_attempts)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._connection().execute("SELECT * FROM job WHERE job_id = ?", (job_id,)).fetchone()
+        return Job(row) if row is not None else None
+
+    async def get_async(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.get, job_id)
+
+    def _claim(self) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            # BEGIN IMMEDIATEで書き込みロックを取り、他プロセスと同じジョブを取り合わないようにする
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM job WHERE (status = 'queued' AND next_run_at <= ?)"
+                    " OR (status = 'running' AND locked_until < ?)"
+                    " ORDER BY next_run_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE job SET status = 'running', attempts = attempts + 1, locked_by = ?, locked_until = ?,"
+                    " updated_at = ? WHERE job_id = ?",
+                    (self._worker_id, now + JOB_LEASE_SECONDS, now, row["job_id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            row = conn.execute("SELECT * FROM job WHERE job_id = ?", (row["job_id"],)).fetchone()
+        return Job(row)
+
+    def _update(self, job_id: str, **values) -> None:
+        values["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        with self._lock:
+            self._connection().execute(
+                f"UPDATE job SET {assignments} WHERE job_id = ?", (*values.values(), job_id)
+            )
+
+    def set_progress(self, job_id: str, progress: str) -> None:
+        # 進捗の更新はリースの延長も兼ねる
+        self._update(job_id, progress=progress, locked_until=time.time() + JOB_LEASE_SECONDS)
+
+    async def set_progress_async(self, job_id: str, progress: str) -> None:
+        await asyncio.to_thread(self.set_progress, job_id, progress)
+
+    def update_payload(self, job: Job, **values) -> None:
+        """再試行でも引き継ぐ値をジョブに記録する (払い出した社員IDなど)"""
+        job.payload.update(values)
+        self._update(job.job_id, payload=json.dumps(job.payload, ensure_ascii=False, default=str))
+
+    async def update_payload_async(self, job: Job, **values) -> None:
+        await asyncio.to_thread(self.update_payload, job, **values)
+
+    def _finish(self, job: Job, **values) -> None:
+        # 状態の更新と、終わったジョブのファイルの削除 (再試行するときはファイルを残す)
+        self._update(job.job_id, **values)
+        if values["status"] != "queued":
+            shutil.rmtree(job.files_dir, ignore_errors=True)
+
+    async def _run(self, job: Job) -> None:
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind {job.kind}")
+            result = await handler(job, lambda progress: self.set_progress_async(job.job_id, progress))
+        except Exception as e:
+            logging.exception(f"Job {job.job_id} failed (attempt {job.attempts})")
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            if job.attempts < job.max_attempts:
+                delay = JOB_RETRY_BASE * 2 ** (job.attempts - 1)
+                await asyncio.to_thread(self._finish, job, status="queued", progress="retrying", error=str(error),
+                                        next_run_at=time.time() + delay, locked_by=None, locked_until=None)
+            else:
+                await asyncio.to_thread(self._finish, job, status="failed", progress="failed", error=str(error),
+                                        locked_by=None, locked_until=None)
+            return
+
+        await asyncio.to_thread(self._finish, job, status="succeeded", progress="done", error=None,
+                                result=json.dumps(result, ensure_ascii=False, default=str),
+                                locked_by=None, locked_until=None)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception:
+                logging.exception("Failed to claim job")
+                job = None
+            if job is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            await self._run(job)
+
+    def start(self) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Job queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 途中で止めたジョブはリース切れを待たずに次の起動で再実行させる
+        await asyncio.to_thread(self._release)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._connection().execute(
+                "UPDATE job SET status = 'queued', attempts = attempts - 1, locked_by = NULL, locked_until = NULL"
+                " WHERE status = 'running' AND locked_by = ?",
+                (self._worker_id,),
+            )
+
+
+job_queue = JobQueue()
@@ -1,118 +1,432 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form
-from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-import models, schemas, utils
-from database import SessionLocal, engine
-from fastapi.responses import JSONResponse
-import logging
-from fastapi.exceptions import RequestValidationError
-from datetime import datetime
-import base64
-import uvicorn
-
-models.Base.metadata.create_all(bind=engine)
-logging.basicConfig(level=logging.INFO)
-app = FastAPI()
-
-# CORS設定
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# データベースセッションを取得するための依存関係
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@app.exception_handler(RequestValidationError)
-async def validation_exception_handler(request, exc):
-    return JSONResponse(
-        status_code=422,
-        content={"detail": exc.errors(), "body": exc.body},
-    )
-
-@app.post("/employees/", response_model=schemas.EmployeeResponse)
-async def register_employee(
-    employee_data: schemas.EmployeeCreate = Depends(schemas.EmployeeCreate.as_form),
-    resume: UploadFile = File(None),
-    bigfive: UploadFile = File(None),
-    picture: UploadFile = File(None),
-    db: Session = Depends(get_db)
-):
-    try:
-        # ファイル処理
-        career_info_detail, career_info_vector = await utils.process_career_files(resume)
-        personality_detail, personality_vector = await utils.process_personality_file(bigfive)
-        picture_data = await picture.read() if picture else None
-
-        # 新しい社員データを保存
-        new_employee = utils.save_employee_data(
-            db=db,
-            employee=employee_data,
-            career_info_detail=career_info_detail,
-            career_info_vector=career_info_vector,
-            personality_detail=personality_detail,
-            personality_vector=personality_vector,
-            picture=picture_data
-        )
-
-        return utils.create_employee_response(new_employee, db)
-
-    except HTTPException as http_err:
-        logging.error(f"HTTP error occurred: {http_err.detail}")
-        raise http_err
-    except Exception as e:
-        logging.exception("Unexpected error occurred while registering employee")
-        raise HTTPException(status_code=500, detail="Error registering employee")
-    
-@app.post("/process_resume/", response_model=dict)
-async def process_resume_endpoint(file: UploadFile):
-    return await utils.process_resume_file(file)
-
-@app.post("/process_bigfive/", response_model=dict)
-async def process_bigfive_endpoint(file: UploadFile = File(...)):
-    try:
-        return await utils.process_bigfive_file(file)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
-
-@app.get("/grades/", response_model=List[schemas.GradeResponse])
-async def get_grades(db: Session = Depends(get_db)):
-    return utils.get_grades(db)
-
-@app.get("/departments/", response_model=List[schemas.DepartmentResponse])
-async def get_departments(db: Session = Depends(get_db)):
-    return utils.get_departments(db)
-
-@app.get("/jobposts/", response_model=List[schemas.JobPostResponse])
-async def get_jobposts(db: Session = Depends(get_db)):
-    return utils.get_jobposts(db)
-
-@app.get("/departments/{department_id}/jobposts/", response_model=List[schemas.JobPostResponse])
-async def get_jobposts_by_department(department_id: int, db: Session = Depends(get_db)):
-    jobposts = utils.get_jobposts_by_department(db, department_id)
-    if not jobposts:
-        raise HTTPException(status_code=404, detail="No job posts found for this department")
-    return jobposts
-
-@app.get("/employees/", response_model=List[schemas.EmployeeResponse])
-async def get_employees(db: Session = Depends(get_db)):
-    return utils.get_employees(db)
-
-@app.get("/employees/{employee_id}", response_model=schemas.EmployeeResponse)
-async def get_employee(employee_id: str, db: Session = Depends(get_db)):
-    employee = utils.get_employee_by_id(db, employee_id)
-    if employee is None:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    return utils.create_employee_response(employee, db)
-
-if __name__ == "__main__":
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Form, Query, Response, Request
+from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+import models, schemas, utils, picture_store, bulk_import, uploads
+from database import (SessionLocal, async_session, dispose_engines, get_async_engine, get_engine, migrate,
+                      missing_schema, ping)
+from workers import cpu_pool
+from analysis_cache import analysis_cache
+from job_queue import job_queue
+from id_allocator import employee_ids
+from serialization import FastJSONResponse, to_jsonable
+from embedding_cache import embedding_cache
+from vector_index import vector_index
+from matching import matcher
+from openai_scheduler import scheduler
+from warmup import warmup
+import metrics
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
+import os
+import logging
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi.exceptions import RequestValidationError
+from datetime import datetime, date
+import base64
+import uvicorn
+
+# 起動時にテーブルの作成・カラムの追加を行うか (開発用。本番では python migrate.py を先に実行する)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true"
+# /readyz でDBの応答を待つ上限
+READYZ_DB_TIMEOUT = float(os.getenv("READYZ_DB_TIMEOUT", "2"))
+
+logging.basicConfig(level=logging.INFO)
+
+# --- 起動・終了 ---
+# importしただけではDB・OpenAI・ワーカープロセスに触れない。重い準備は起動後にウォームアップで行い、
+# 終わるまでは /readyz が503を返す (/healthz はプロセスが応答できれば常に200)
+
+async def check_database():
+    async with get_async_engine().connect() as connection:
+        missing = await connection.run_sync(missing_schema)
+    if missing:
+        raise RuntimeError(f"Database schema is out of date (missing {', '.join(missing)}); run python migrate.py")
+
+def load_matching():
+    with SessionLocal() as db:
+        matcher.load(db)
+
+async def load_reference_data():
+    async with async_session() as db:
+        await utils.get_reference_data(db, "grades", schemas.GradeResponse, utils.get_grades)
+        await utils.get_reference_data(db, "departments", schemas.DepartmentResponse, utils.get_departments)
+        await utils.get_reference_data(db, "jobposts", schemas.JobPostResponse, utils.get_jobposts)
+
+def open_caches():
+    embedding_cache.connect()
+    # 期限切れの解析キャッシュを削除
+    analysis_cache.purge_expired()
+
+WARMUP_STAGES = [
+    # PDF解析・パスワードハッシュ用のワーカープロセスは、行列やキャッシュを読み込む前 (メモリが小さいうち) に起動する
+    {"cpu_pool": lambda: asyncio.to_thread(cpu_pool.start)},
+    {"database": check_database},
+    {
+        "matching": lambda: asyncio.to_thread(load_matching),
+        "reference_data": load_reference_data,
+        "vector_index": lambda: asyncio.to_thread(vector_index.stats),
+        "caches": lambda: asyncio.to_thread(open_caches),
+        "openai_client": lambda: asyncio.to_thread(lambda: scheduler.client),
+    },
+]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SQLの実行回数を /metrics で公開する
+    metrics.count_queries(get_engine())
+    metrics.count_queries(get_async_engine().sync_engine)
+    if DB_AUTO_MIGRATE:
+        await asyncio.to_thread(migrate, get_engine())
+    # 「似ている社員」用のインデックスがなければ作り、以降は追記分が増えたら作り直す
+    vector_index.start()
+    # ジョブの実行はウォームアップが終わってから始める
+    warmup.start(WARMUP_STAGES, on_ready=job_queue.start)
+    try:
+        yield
+    finally:
+        await warmup.stop()
+        await job_queue.stop()
+        await vector_index.stop()
+        cpu_pool.shutdown()
+        await dispose_engines()
+
+app = FastAPI(lifespan=lifespan)
+
+# アップロードを含むリクエスト本文の上限 (超えた時点で受信を打ち切って413を返す)。
+# 413にもCORSヘッダが付くよう、CORSより内側に置く
+app.add_middleware(
+    uploads.RequestSizeLimitMiddleware,
+    max_bytes=uploads.UPLOAD_MAX_REQUEST_BYTES,
+    path_limits={"/employees/bulk": uploads.BULK_IMPORT_MAX_REQUEST_BYTES},
+)
+
+# CORS設定
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+# /metrics で公開するキャッシュのヒット率
+metrics.register_cache("embedding", embedding_cache.stats)
+metrics.register_cache("analysis", analysis_cache.stats)
+metrics.register_cache("reference", utils.reference_cache.stats)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # ルートのテンプレート (/employees/{employee_id}) ごとにレイテンシとSQLの回数を記録する
+    queries = metrics.start_query_count()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=path, status=str(status))
+        metrics.REQUEST_DB_QUERIES.observe(queries[0], method=request.method, route=path)
+
+# ベクトルの返し方 (serialization.VECTOR_FORMATS)
+VectorFormat = Literal["list", "b64f32"]
+# 似ている社員を探すベクトル (vector_index.SEARCH_SPACES)
+SimilarSpace = Literal["career", "personality", "blend"]
+
+# データベースセッションを取得するための依存関係
+# 既存の同期処理は db.run_sync() で呼び出し、DBの待ち時間でイベントループを止めないようにする
+async def get_db():
+    async with async_session() as db:
+        yield db
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc):
+    return JSONResponse(
+        status_code=422,
+        content={"detail": exc.errors(), "body": exc.body},
+    )
+
+@app.post("/employees/", response_model=schemas.EmployeeResponse,
+          responses={202: {"model": schemas.JobAcceptedResponse}})
+async def register_employee(
+    employee_data: schemas.EmployeeCreate = Depends(schemas.EmployeeCreate.as_form),
+    resume: UploadFile = File(None),
+    bigfive: UploadFile = File(None),
+    picture: UploadFile = File(None),
+    run_async: bool = Query(False, alias="async"),
+    db: AsyncSession = Depends(get_db)
+):
+    spool = uploads.UploadSpool()
+    try:
+        # ファイルはメモリに読み込まず、上限を確認しながら一時ファイルに書き出す
+        resume_data = await spool.add(resume, utils.PDF_MAX_BYTES)
+        bigfive_data = await spool.add(bigfive, utils.PDF_MAX_BYTES)
+        picture_data = await spool.add(picture, picture_store.PICTURE_MAX_BYTES)
+
+        if run_async:
+            # ジョブキューに登録してすぐに202を返す (パスワードはハッシュ化してから保存する)
+            password_hash = await utils.hash_password_async(employee_data.password)
+            payload = employee_data.model_dump(mode="json", exclude={"password"})
+            payload["password_hash"] = password_hash
+            job_id = await job_queue.enqueue_async(
+                "register_employee", payload,
+                files={"resume": resume_data, "bigfive": bigfive_data, "picture": picture_data}
+            )
+            accepted = schemas.JobAcceptedResponse(job_id=job_id, status="queued", status_url=f"/jobs/{job_id}")
+            return JSONResponse(status_code=202, content=accepted.model_dump())
+
+        new_employee = await utils.register_employee(db, employee_data, resume_data, bigfive_data, picture_data)
+        return FastJSONResponse(await db.run_sync(lambda session: utils.create_employee_response(new_employee, session)))
+
+    except HTTPException as http_err:
+        logging.error(f"HTTP error occurred: {http_err.detail}")
+        raise http_err
+    except Exception as e:
+        logging.exception("Unexpected error occurred while registering employee")
+        raise HTTPException(status_code=500, detail="Error registering employee")
+    finally:
+        spool.cleanup()
+
+@app.post("/employees/bulk", response_model=schemas.BulkImportResponse)
+async def bulk_import_employees(
+    employees_csv: UploadFile = File(...),
+    archive: UploadFile = File(None),
+    db: AsyncSession = Depends(get_db)
+):
+    # CSVの各行を登録し、行ごとの結果を返す (書類・画像はzipアーカイブ内のファイル名で指定)
+    return await bulk_import.import_employees(db, employees_csv, archive)
+
+@job_queue.handler("register_employee")
+async def run_registration_job(job, on_progress):
+    payload = dict(job.payload)
+    password_hash = payload.pop("password_hash")
+    employee_id = payload.pop("employee_id", None)
+    employee_data = schemas.EmployeeCreate(**payload, password="")
+    if employee_id is None:
+        # 再試行で同じ社員を二重に登録しないよう、IDは保存の前に払い出してジョブに記録しておく
+        employee_id = (await employee_ids.allocate_async(1))[0]
+        await job_queue.update_payload_async(job, employee_id=employee_id)
+    async with async_session() as db:
+        new_employee = await db.run_sync(utils.get_employee_by_id, employee_id)
+        if new_employee is None:
+            new_employee = await utils.register_employee(
+                db, employee_data, job.file("resume"), job.file("bigfive"), job.file("picture"),
+                password_hash=password_hash, on_progress=on_progress, employee_id=employee_id
+            )
+        else:
+            # 前回の実行で保存済み。保存後に止まっていた場合に備えて、インデックスなどへの反映だけやり直す
+            await utils.index_employees([
+                (employee_id, new_employee.career_info_vector, new_employee.personality_vector)
+            ])
+        response = await db.run_sync(lambda session: utils.create_employee_response(new_employee, session))
+        return to_jsonable(response)
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobStatusResponse)
+async def get_job(job_id: str):
+    job = await job_queue.get_async(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return schemas.JobStatusResponse(
+        job_id=job.job_id,
+        status=job.status,
+        progress=job.progress,
+        attempts=job.attempts,
+        error=job.error,
+        result=job.result,
+        created_at=datetime.fromtimestamp(job.created_at),
+        updated_at=datetime.fromtimestamp(job.updated_at)
+    )
+    
+@app.post("/process_resume/", response_model=dict)
+async def process_resume_endpoint(file: UploadFile):
+    return await utils.process_resume_file(file)
+
+@app.post("/process_bigfive/", response_model=dict)
+async def process_bigfive_endpoint(file: UploadFile = File(...)):
+    try:
+        return await utils.process_bigfive_file(file)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Matchのいずれかのタグがetagと一致するか (弱いタグ W/"..." も同じものとして比べる)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def reference_response(request: Request, data: utils.ReferenceData) -> Response:
+    headers = {"ETag": data.etag, "Cache-Control": f"private, max-age={utils.REFERENCE_CACHE_MAX_AGE}"}
+    if etag_matches(request, data.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data.body, media_type="application/json", headers=headers)
+
+@app.get("/grades/", response_model=List[schemas.GradeResponse])
+async def get_grades(request: Request, db: AsyncSession = Depends(get_db)):
+    data = await utils.get_reference_data(db, "grades", schemas.GradeResponse, utils.get_grades)
+    return reference_response(request, data)
+
+@app.get("/departments/", response_model=List[schemas.DepartmentResponse])
+async def get_departments(request: Request, db: AsyncSession = Depends(get_db)):
+    data = await utils.get_reference_data(db, "departments", schemas.DepartmentResponse, utils.get_departments)
+    return reference_response(request, data)
+
+@app.get("/jobposts/", response_model=List[schemas.JobPostResponse])
+async def get_jobposts(request: Request, db: AsyncSession = Depends(get_db)):
+    data = await utils.get_reference_data(db, "jobposts", schemas.JobPostResponse, utils.get_jobposts)
+    return reference_response(request, data)
+
+@app.get("/departments/{department_id}/jobposts/", response_model=List[schemas.JobPostResponse])
+async def get_jobposts_by_department(department_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    data = await utils.get_reference_data(
+        db, f"departments/{department_id}/jobposts", schemas.JobPostResponse,
+        utils.get_jobposts_by_department, department_id
+    )
+    if data.count == 0:
+        raise HTTPException(status_code=404, detail="No job posts found for this department")
+    return reference_response(request, data)
+
+@app.get("/employees/", response_model=List[schemas.EmployeeResponse], response_model_exclude_unset=True)
+async def get_employees(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    department_id: Optional[int] = None,
+    grade_id: Optional[int] = None,
+    hired_from: Optional[date] = None,
+    hired_to: Optional[date] = None,
+    fields: Optional[str] = Query(None, description="career_info_vector,personality_vector"),
+    vector_format: VectorFormat = "list",
+    db: AsyncSession = Depends(get_db)
+):
+    include = utils.parse_employee_fields(fields)
+    # 1件多く取得して次のページがあるかを判定する
+    employees = await db.run_sync(utils.get_employees, cursor, limit + 1, department_id, grade_id, hired_from, hired_to, include)
+    headers = {}
+    if len(employees) > limit:
+        employees = employees[:limit]
+        headers["X-Next-Cursor"] = employees[-1].employee_id
+    # response_modelでの再検証を通さずにorjsonで直接書き出す
+    return FastJSONResponse(utils.create_employee_responses(employees, include, vector_format),
+                            exclude_unset=True, headers=headers)
+
+@app.get("/employees/{employee_id}", response_model=schemas.EmployeeResponse)
+async def get_employee(employee_id: str, vector_format: VectorFormat = "list", db: AsyncSession = Depends(get_db)):
+    employee = await db.run_sync(utils.get_employee_by_id, employee_id)
+    if employee is None:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    return FastJSONResponse(await db.run_sync(
+        lambda session: utils.create_employee_response(employee, session, vector_format=vector_format)
+    ))
+
+@app.get("/employees/{employee_id}/picture")
+async def get_employee_picture(
+    employee_id: str,
+    request: Request,
+    thumbnail: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    picture = await db.run_sync(utils.get_picture, employee_id, thumbnail)
+    if picture is None:
+        raise HTTPException(status_code=404, detail="Picture not found")
+
+    if isinstance(picture, bytes):
+        # migrate_pictures.py で移す前のBLOBはそのまま返す (ETagは移した後と同じsha256)
+        etag = f'"{await asyncio.to_thread(picture_store.digest, picture)}"'
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=picture, media_type=picture_store.media_type(picture[:12]), headers=headers)
+
+    # ファイル名がsha256なので、そのままETagとして使える
+    etag = f'"{os.path.basename(picture)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(picture, media_type=picture_store.content_type(picture), headers=headers)
+
+@app.get("/jobposts/{jobpost_id}/candidates", response_model=List[schemas.CandidateResponse])
+async def get_jobpost_candidates(
+    jobpost_id: int,
+    k: int = Query(10, ge=1, le=1000),
+    career_weight: float = Query(0.7, ge=0),
+    personality_weight: float = Query(0.3, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    await matcher.ensure_loaded_async()
+    return await db.run_sync(utils.get_jobpost_candidates, jobpost_id, k, career_weight, personality_weight)
+
+@app.get("/employees/{employee_id}/jobposts", response_model=List[schemas.JobPostMatchResponse])
+async def get_employee_jobposts(
+    employee_id: str,
+    k: int = Query(10, ge=1, le=1000),
+    career_weight: float = Query(0.7, ge=0),
+    personality_weight: float = Query(0.3, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    await matcher.ensure_loaded_async()
+    return await db.run_sync(utils.get_employee_jobposts, employee_id, k, career_weight, personality_weight)
+
+def page_response(items: list, next_cursor: Optional[int]) -> FastJSONResponse:
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+    return FastJSONResponse(items, headers=headers)
+
+# 保存済みのおすすめ (recommendations.pyで更新した上位N件) を順位順に返す。次のページは X-Next-Cursor をcursorに渡す
+@app.get("/employees/{employee_id}/recommendations", response_model=List[schemas.JobPostMatchResponse])
+async def get_employee_recommendations(
+    employee_id: str,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    return page_response(*await db.run_sync(utils.get_employee_recommendations, employee_id, limit, cursor))
+
+@app.get("/jobposts/{jobpost_id}/recommendations", response_model=List[schemas.CandidateResponse])
+async def get_jobpost_recommendations(
+    jobpost_id: int,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    return page_response(*await db.run_sync(utils.get_jobpost_recommendations, jobpost_id, limit, cursor))
+
+@app.get("/employees/{employee_id}/similar", response_model=List[schemas.CandidateResponse])
+async def get_similar_employees(
+    employee_id: str,
+    k: int = Query(10, ge=1, le=100),
+    space: SimilarSpace = Query("blend"),
+    db: AsyncSession = Depends(get_db)
+):
+    # ベクトルインデックスにない社員は総当たりで探すので、行列も読み込んでおく
+    await matcher.ensure_loaded_async()
+    return await db.run_sync(utils.get_similar_employees, employee_id, k, space)
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # プロセスが動いていてイベントループが応答できるか (DBなどの依存先は見ない)
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    # ウォームアップが終わっていて、DBに接続できるときだけ200 (ロードバランサはこれで振り分ける)
+    body = warmup.as_dict()
+    if not warmup.ready:
+        return JSONResponse(status_code=503, content=body)
+    try:
+        await asyncio.wait_for(ping(), READYZ_DB_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={**body, "status": "unavailable", "error": f"database: {e}"})
+    return body
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,324 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import Employee, JobPost
+from database import SessionLocal, get_engine
+from embedding_config import embedding_dimensions
+
+# 別プロセス(embedding.pyなど)での更新を拾うため、一定間隔で全件を読み直す
+RELOAD_INTERVAL = float(os.getenv("MATCHING_RELOAD_INTERVAL", "300"))
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    # 行ごとにL2正規化 (ゼロベクトルはゼロのまま)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class _VectorTable:
+    """IDごとの行を持つ正規化済みfloat32行列の集合 (列名ごとに1行列)"""
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        self.ids: List = []
+        self.index: Dict = {}
+        self.dims: Dict[str, Optional[int]] = {name: None for name in self.columns}
+        self._matrices: Dict[str, np.ndarray] = {}
+        self._capacity = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def matrix(self, column: str) -> np.ndarray:
+        dim = self.dims[column] or 0
+        if column not in self._matrices:
+            return np.zeros((len(self.ids), dim), dtype=np.float32)
+        return self._matrices[column][:len(self.ids)]
+
+    def load(self, ids: list, vectors: Dict[str, list], expected_dim: Optional[int] = None) -> None:
+        # 再エンベディングの途中で次元数が混在している場合は、設定どおりの次元数の行を使う
+        self.ids = list(ids)
+        self.index = {key: i for i, key in enumerate(self.ids)}
+        self._capacity = len(self.ids)
+        self._matrices = {}
+        for name in self.columns:
+            self.dims[name] = None
+            rows = vectors[name]
+            dims = {len(row) for row in rows if row is not None and len(row) > 0}
+            if not dims:
+                continue
+            dim = expected_dim if expected_dim in dims else next(
+                len(row) for row in rows if row is not None and len(row) > 0
+            )
+            matrix = np.zeros((self._capacity, dim), dtype=np.float32)
+            skipped = 0
+            for i, row in enumerate(rows):
+                if row is not None and len(row) == dim:
+                    matrix[i] = row
+                elif row is not None and len(row) > 0:
+                    skipped += 1
+            if skipped:
+                logging.warning(f"Skipped {skipped} {name} vectors whose dimension != {dim}; run embedding.py --all")
+            self.dims[name] = dim
+            self._matrices[name] = _normalize_rows(matrix)
+
+    def upsert(self, key, vectors: Dict[str, list]) -> None:
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.ids)
+            self._grow(row + 1)
+            self.ids.append(key)
+            self.index[key] = row
+
+        for name in self.columns:
+            vector = vectors.get(name)
+            if vector is None or len(vector) == 0:
+                if name in self._matrices:
+                    self._matrices[name][row] = 0.0
+                continue
+            if self.dims[name] is None:
+                self.dims[name] = len(vector)
+                self._matrices[name] = np.zeros((self._capacity, len(vector)), dtype=np.float32)
+            elif len(vector) != self.dims[name]:
+                logging.warning(f"Skipping {name} vector of id {key}: dimension {len(vector)} != {self.dims[name]}")
+                self._matrices[name][row] = 0.0
+                continue
+            self._matrices[name][row] = vector
+            _normalize_rows(self._matrices[name][row:row + 1])
+
+    def _grow(self, size: int) -> None:
+        # 行追加のたびに再確保しないよう、容量を倍々で確保する
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2, 16)
+        for name, matrix in self._matrices.items():
+            grown = np.zeros((capacity, matrix.shape[1]), dtype=np.float32)
+            grown[:len(self.ids)] = matrix[:len(self.ids)]
+            self._matrices[name] = grown
+        self._capacity = capacity
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコアの上位k件のインデックスを降順で返す"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class MatchingEngine:
+    """社員ベクトルと求人ベクトルをメモリ上の行列として保持し、コサイン類似度で照合する"""
+
+    def __init__(self):
+        self.employees = _VectorTable(("career", "personality"))
+        self.jobposts = _VectorTable(("job",))
+        self._lock = threading.RLock()
+        # 読み直しは同時に1つだけ行う
+        self._reload_lock = threading.Lock()
+        # ensure_loaded からの読み込みは専用のスレッドで行い、実行中の読み込みを呼び出し元で共有する
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="matching")
+        self._loading: Optional[Future] = None
+        # 読み直し中に反映した更新 (読み直した行列に上書きし直す。読み直し中でなければNone)
+        self._reloading: Optional[List[Tuple[_VectorTable, object, Dict[str, list]]]] = None
+        self._loaded_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > RELOAD_INTERVAL
+
+    def load(self, db: Session) -> None:
+        with self._reload_lock:
+            self._load(db)
+
+    def _load(self, db: Session) -> None:
+        with self._lock:
+            self._reloading = []
+        try:
+            employees = db.query(
+                Employee.employee_id, Employee.career_info_vector, Employee.personality_vector
+            ).all()
+            jobposts = db.query(JobPost.jobpost_id, JobPost.job_detail_vector).all()
+
+            with self._lock:
+                self.employees.load(
+                    [row[0] for row in employees],
+                    {"career": [row[1] for row in employees], "personality": [row[2] for row in employees]},
+                    embedding_dimensions(),
+                )
+                self.jobposts.load([row[0] for row in jobposts], {"job": [row[1] for row in jobposts]},
+                                   embedding_dimensions())
+                # 読み込みのクエリより後にコミットされた社員・求人を取りこぼさない
+                for table, key, vectors in self._reloading:
+                    table.upsert(key, vectors)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._reloading = None
+        logging.info(f"Matching engine loaded {len(employees)} employees and {len(jobposts)} job posts")
+
+    def _load_in_session(self) -> None:
+        get_engine()
+        with SessionLocal() as db:
+            self.load(db)
+
+    def _reload(self) -> Future:
+        """読み込みを始める (実行中ならその読み込みを返す)"""
+        with self._lock:
+            future = self._loading
+            if future is None:
+                future = self._loading = self._loader.submit(self._load_in_session)
+                future.add_done_callback(self._reloaded)
+            return future
+
+    def _reloaded(self, future: Future) -> None:
+        with self._lock:
+            if self._loading is future:
+                self._loading = None
+        if future.exception() is not None:
+            logging.error("Failed to load the matching engine", exc_info=future.exception())
+
+    def ensure_loaded(self) -> None:
+        """未ロードなら読み込みを待つ。古くなっていれば裏で読み直し、それまでは今の行列を使う"""
+        if not self.stale:
+            return
+        future = self._reload()
+        if not self.loaded:
+            future.result()
+
+    async def ensure_loaded_async(self) -> None:
+        """イベントループから使う ensure_loaded (読み込みは専用のスレッドで行い、ループは止めない)"""
+        if not self.stale:
+            return
+        future = self._reload()
+        if not self.loaded:
+            await asyncio.wrap_future(future)
+
+    def upsert_employee(self, employee: Employee) -> None:
+        self.upsert_employee_vectors(employee.employee_id, employee.career_info_vector, employee.personality_vector)
+
+    def upsert_employee_vectors(self, employee_id: str, career_vector, personality_vector) -> None:
+        self._upsert(self.employees, employee_id, {"career": career_vector, "personality": personality_vector})
+
+    def upsert_jobpost(self, jobpost: JobPost) -> None:
+        self._upsert(self.jobposts, jobpost.jobpost_id, {"job": jobpost.job_detail_vector})
+
+    def _upsert(self, table: _VectorTable, key, vectors: Dict[str, list]) -> None:
+        with self._lock:
+            if self._reloading is not None:
+                self._reloading.append((table, key, vectors))
+            # 未ロードなら次回のロードで反映されるので行列には入れない
+            if self.loaded:
+                table.upsert(key, vectors)
+
+    def _check_dims(self, column: str) -> None:
+        employee_dim = self.employees.dims[column]
+        job_dim = self.jobposts.dims["job"]
+        if employee_dim is not None and job_dim is not None and employee_dim != job_dim:
+            raise ValueError(
+                f"Embedding dimensions differ: {column} vectors have {employee_dim}, job post vectors have {job_dim}"
+            )
+
+    def _candidate_scores(self, jobpost_id: int, career_weight: float, personality_weight: float) -> np.ndarray:
+        row = self.jobposts.index.get(jobpost_id)
+        if row is None:
+            raise KeyError(jobpost_id)
+        job = self.jobposts.matrix("job")[row]
+
+        scores = np.zeros(len(self.employees), dtype=np.float32)
+        for column, weight in (("career", career_weight), ("personality", personality_weight)):
+            if weight == 0 or self.employees.dims[column] is None or job.size == 0:
+                continue
+            self._check_dims(column)
+            scores += weight * (self.employees.matrix(column) @ job)
+        return scores
+
+    def _jobpost_scores(self, employee_ids: Sequence[str], career_weight: float,
+                        personality_weight: float) -> np.ndarray:
+        rows = []
+        for employee_id in employee_ids:
+            row = self.employees.index.get(employee_id)
+            if row is None:
+                raise KeyError(employee_id)
+            rows.append(row)
+
+        # 重み付きの合成クエリにすれば行列積は1回で済む
+        query = None
+        for column, weight in (("career", career_weight), ("personality", personality_weight)):
+            if weight == 0 or self.employees.dims[column] is None:
+                continue
+            self._check_dims(column)
+            part = weight * self.employees.matrix(column)[rows]
+            query = part if query is None else query + part
+
+        jobs = self.jobposts.matrix("job")
+        if query is None or jobs.shape[1] == 0:
+            return np.zeros((len(rows), len(self.jobposts)), dtype=np.float32)
+        return query @ jobs.T
+
+    def candidate_scores(self, jobpost_ids: Sequence[int], career_weight: float = 1.0,
+                         personality_weight: float = 0.0) -> Tuple[List[str], np.ndarray]:
+        """求人ごとの全社員とのスコア (社員IDの並びと、社員数×求人数の行列)"""
+        with self._lock:
+            scores = [self._candidate_scores(jobpost_id, career_weight, personality_weight) for jobpost_id in jobpost_ids]
+            matrix = np.stack(scores, axis=1) if scores else np.zeros((len(self.employees), 0), dtype=np.float32)
+            return list(self.employees.ids), matrix
+
+    def jobpost_scores(self, employee_ids: Sequence[str], career_weight: float = 1.0,
+                       personality_weight: float = 0.0) -> Tuple[List[int], np.ndarray]:
+        """社員ごとの全求人とのスコア (求人IDの並びと、社員数×求人数の行列)"""
+        with self._lock:
+            return list(self.jobposts.ids), self._jobpost_scores(employee_ids, career_weight, personality_weight)
+
+    def top_candidates(self, jobpost_id: int, k: int, career_weight: float = 1.0,
+                       personality_weight: float = 0.0) -> List[Tuple[str, float]]:
+        """求人に近い社員を上位k件返す"""
+        with self._lock:
+            scores = self._candidate_scores(jobpost_id, career_weight, personality_weight)
+            order = top_k(scores, k)
+            return [(self.employees.ids[i], float(scores[i])) for i in order]
+
+    def top_jobposts(self, employee_id: str, k: int, career_weight: float = 1.0,
+                     personality_weight: float = 0.0) -> List[Tuple[int, float]]:
+        """社員に合う求人を上位k件返す"""
+        with self._lock:
+            scores = self._jobpost_scores([employee_id], career_weight, personality_weight)[0]
+            order = top_k(scores, k)
+            return [(self.jobposts.ids[i], float(scores[i])) for i in order]
+
+    def similar_employees(self, employee_id: str, k: int, space: str = "blend") -> List[Tuple[str, float]]:
+        """社員に似ている社員を上位k件返す (全件との総当たり。ベクトルインデックスが使えないときに使う)"""
+        columns = ("career", "personality") if space == "blend" else (space,)
+        with self._lock:
+            row = self.employees.index.get(employee_id)
+            if row is None:
+                raise KeyError(employee_id)
+
+            scores = np.zeros(len(self.employees), dtype=np.float32)
+            for column in columns:
+                if self.employees.dims[column] is None:
+                    continue
+                matrix = self.employees.matrix(column)
+                scores += (matrix @ matrix[row]) / len(columns)
+            scores[row] = -np.inf
+
+            order = top_k(scores, min(k, len(self.employees) - 1))
+            return [(self.employees.ids[i], float(scores[i])) for i in order]
+
+
+matcher = MatchingEngine()
@@ -0,0 +1,231 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("tlflow")
+except ImportError:  # トレースは opentelemetry が入っている場合のみ
+    tracer = None
+
+# 処理時間のヒストグラムの区切り (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # ラベルごとに [各バケットの件数..., +Infの件数], 合計値
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total[0]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Prometheusのテキスト形式で出力するメトリクスの一覧
+
+    値はプロセスごとに集計される (uvicornを複数ワーカーで動かす場合はワーカーごとに取得する)。
+    """
+
+    def __init__(self):
+        self.metrics: List[object] = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[str]]) -> Callable[[], List[str]]:
+        """出力のたびに呼ばれ、その時点の値を返す関数を登録する (キャッシュの統計など)"""
+        self.collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "tlflow_stage_duration_seconds", "Time spent in each processing stage.", ["stage"]
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "tlflow_http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+))
+REQUEST_DB_QUERIES = REGISTRY.register(Histogram(
+    "tlflow_http_request_db_queries", "Number of SQL statements executed per HTTP request.", ["method", "route"],
+    buckets=QUERY_COUNT_BUCKETS,
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "tlflow_openai_tokens_total", "Tokens reported by the OpenAI API.", ["model", "kind"]
+))
+OPENAI_REQUESTS = REGISTRY.register(Counter(
+    "tlflow_openai_requests_total", "Requests sent to the OpenAI API.", ["model", "endpoint"]
+))
+OPENAI_RETRIES = REGISTRY.register(Counter(
+    "tlflow_openai_retries_total", "OpenAI requests retried after a rate limit or transient error.", ["endpoint", "reason"]
+))
+DB_QUERIES = REGISTRY.register(Counter(
+    "tlflow_db_queries_total", "SQL statements executed."
+))
+
+
+def timed(stage: str):
+    """関数の実行時間をSTAGE_SECONDSに記録するデコレータ (同期・非同期の両方に使える)"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage), STAGE_SECONDS.time(stage=stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage), STAGE_SECONDS.time(stage=stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    if tracer is None:
+        yield
+        return
+    with tracer.start_as_current_span(name):
+        yield
+
+
+def record_openai_usage(model: str, endpoint: str, response) -> None:
+    """OpenAIのレスポンスのusageからトークン数を記録する"""
+    OPENAI_REQUESTS.inc(model=model, endpoint=endpoint)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    if endpoint == "embeddings":
+        OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="embedding")
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+
+# リクエストごとのSQL実行回数 (ミドルウェアがリクエストの開始時に新しいカウンタを入れる)
+_query_counter: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("query_counter", default=None)
+
+
+def start_query_count() -> List[int]:
+    counter = [0]
+    _query_counter.set(counter)
+    return counter
+
+
+def count_queries(sync_engine) -> None:
+    """エンジンで実行されたSQLを数える"""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc()
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+# キャッシュ名 -> hits/misses/hit_rateを返すstats()
+_caches: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    _caches[name] = stats
+
+
+@REGISTRY.register_collector
+def _collect_caches() -> List[str]:
+    rows = [(name, stats()) for name, stats in sorted(_caches.items())]
+    lines: List[str] = []
+    for metric, kind, field, documentation in (
+        ("tlflow_cache_hits_total", "counter", "hits", "Cache lookups that were served from the cache."),
+        ("tlflow_cache_misses_total", "counter", "misses", "Cache lookups that missed."),
+        ("tlflow_cache_hit_ratio", "gauge", "hit_rate", "Fraction of cache lookups that hit."),
+    ):
+        lines += [f"# HELP {metric} {documentation}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {values[field]}' for name, values in rows]
+    return lines
@@ -0,0 +1,40 @@
+"""DBのテーブルを作り、モデルに追加されたカラムを既存のテーブルに追加する
+
+    python migrate.py [--check]
+
+サーバーは起動時にスキーマを変更しない (ワーカーごとに繰り返さず、DBが使えなくても起動できるように)。
+モデルを変更したら、デプロイのたびにサーバーの起動前に実行する。
+"""
+import sys
+import argparse
+import logging
+
+import models  # noqa: F401 (テーブル定義をBase.metadataに登録する)
+from database import get_engine, migrate, missing_schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create tables and add missing columns")
+    parser.add_argument("--check", action="store_true",
+                        help="only list missing tables/columns; exit with status 1 if any")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    engine = get_engine()
+    missing = missing_schema(engine)
+    if args.check:
+        for name in missing:
+            print(name)
+        sys.exit(1 if missing else 0)
+
+    migrate(engine)
+    logging.info(f"Schema is up to date ({len(missing)} tables/columns added)")
+    remaining = missing_schema(engine)
+    if remaining:
+        # NOT NULLのカラムは自動で追加しない
+        logging.error(f"Could not add {', '.join(remaining)}; migrate these columns manually")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
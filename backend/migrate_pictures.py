@@ -0,0 +1,61 @@
+"""employee.pictureのBLOBを画像ストア(PICTURE_STORE_DIR)に移す一回限りの移行スクリプト
+
+    python migrate_pictures.py [--vacuum]
+"""
+import argparse
+import logging
+
+from sqlalchemy import bindparam, select, update
+
+from database import get_engine, add_missing_columns
+from models import Employee
+from picture_store import save_picture
+
+BATCH_SIZE = 100
+
+
+def migrate_pictures() -> int:
+    table = Employee.__table__
+    stmt = (
+        update(table)
+        .where(table.c.employee_id == bindparam("_id"))
+        .values(picture_hash=bindparam("picture_hash"), picture=None)
+    )
+    # BLOBを一度に読み込まないよう、IDだけ先に取得してバッチごとに処理する
+    with get_engine().connect() as connection:
+        ids = connection.execute(
+            select(table.c.employee_id)
+            .where(table.c.picture.is_not(None), table.c.picture_hash.is_(None))
+            .order_by(table.c.employee_id)
+        ).scalars().all()
+        connection.commit()
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            with connection.begin():
+                rows = connection.execute(
+                    select(table.c.employee_id, table.c.picture).where(table.c.employee_id.in_(batch))
+                ).all()
+                params = [{"_id": employee_id, "picture_hash": save_picture(picture)} for employee_id, picture in rows]
+                connection.execute(stmt, params)
+            logging.info(f"Moved {start + len(batch)}/{len(ids)} pictures")
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move employee picture BLOBs into the picture store")
+    parser.add_argument("--vacuum", action="store_true", help="run VACUUM afterwards to shrink the SQLite file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    add_missing_columns(get_engine())
+    count = migrate_pictures()
+    logging.info(f"Migrated {count} pictures")
+
+    if args.vacuum and get_engine().dialect.name == "sqlite":
+        with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""JSONで保存されているベクトルをパックしたバイナリ形式に変換する一回限りの移行スクリプト
+
+    python migrate_vectors.py [--dtype float32|float16|int8] [--vacuum]
+"""
+import argparse
+import logging
+
+from sqlalchemy import bindparam, update
+
+from database import get_engine
+from models import Employee, JobPost, VECTOR_DTYPE, pack_vector, unpack_vector
+
+# (モデル, 主キー, ベクトルカラム)
+TARGETS = [
+    (Employee, "employee_id", ["career_info_vector", "personality_vector"]),
+    (JobPost, "jobpost_id", ["job_detail_vector"]),
+]
+
+BATCH_SIZE = 500
+
+
+def _needs_migration(value, dtype: str) -> bool:
+    if value is None:
+        return False
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # 既にバイナリでも、指定と異なる形式なら変換し直す
+        return bytes(value[:4]) != pack_vector([], dtype)[:4]
+    return True
+
+
+def _convert(values: dict, pk: str, columns: list[str], dtype: str) -> dict:
+    param = {"_pk": values[pk]}
+    for column in columns:
+        value = values[column]
+        param[column] = None if value is None else pack_vector(unpack_vector(value), dtype)
+    return param
+
+
+def migrate_table(engine, model, pk: str, columns: list[str], dtype: str) -> int:
+    table = model.__table__
+    column_list = ", ".join([pk] + columns)
+    stmt = (
+        update(table)
+        .where(table.c[pk] == bindparam("_pk"))
+        .values({column: bindparam(column, type_=table.c[column].type.impl) for column in columns})
+    )
+    count = 0
+    # テーブル全体を読み込まないよう、BATCH_SIZE行ずつ読みながら変換して書き込む
+    # (読み込み用と書き込み用で接続を分ける。WALなので読み込み中でもバッチごとにコミットできる)
+    with engine.connect() as reader, engine.connect() as writer:
+        # 型変換を通さずに生の値を読む
+        result = reader.execution_options(yield_per=BATCH_SIZE).exec_driver_sql(
+            f"SELECT {column_list} FROM {table.name}"
+        )
+        for rows in result.partitions(BATCH_SIZE):
+            params = []
+            for row in rows:
+                values = dict(zip([pk] + columns, row))
+                if any(_needs_migration(values[column], dtype) for column in columns):
+                    params.append(_convert(values, pk, columns, dtype))
+            if params:
+                with writer.begin():
+                    writer.execute(stmt, params)
+                count += len(params)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON vector columns to packed binary vectors")
+    parser.add_argument("--dtype", default=VECTOR_DTYPE, choices=["float32", "float16", "int8"])
+    parser.add_argument("--vacuum", action="store_true", help="run VACUUM afterwards to shrink the SQLite file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for model, pk, columns in TARGETS:
+        count = migrate_table(get_engine(), model, pk, columns, args.dtype)
+        logging.info(f"Migrated {count} rows in {model.__tablename__}")
+
+    if args.vacuum and get_engine().dialect.name == "sqlite":
+        with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,194 @@
-from sqlalchemy import Column, Integer, String, Date, LargeBinary, ForeignKey, JSON
-from sqlalchemy.orm import relationship
-from database import Base
-
-class Grade(Base):
-    __tablename__ = "grade"
-
-    grade_id = Column(Integer, primary_key=True, index=True)
-    grade_name = Column(String, nullable=False)
-
-    employees = relationship("EmployeeGrade", back_populates="grade")
-
-class EmployeeGrade(Base):
-    __tablename__ = "employee_grade"
-
-    employeegrade_id = Column(Integer, primary_key=True, index=True)
-    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
-    grade_id = Column(Integer, ForeignKey("grade.grade_id"), nullable=False)
-
-    employee = relationship("Employee", back_populates="grades")
-    grade = relationship("Grade", back_populates="employees")
-
-class Employee(Base):
-    __tablename__ = 'employee'
-
-    employee_id = Column(String, primary_key=True)
-    employee_name = Column(String, nullable=False)
-    birthdate = Column(Date, nullable=False)
-    gender = Column(String, nullable=False)
-    academic_background = Column(String, nullable=False)
-    hire_date = Column(Date, nullable=False)
-    recruitment_type = Column(String, nullable=False)
-    picture = Column(LargeBinary)
-    career_info_detail = Column(String, nullable=False)
-    career_info_vector = Column(JSON, nullable=False)
-    personality_detail = Column(String, nullable=False)
-    personality_vector = Column(JSON, nullable=False)
-    neuroticism_score = Column(Integer, nullable=False)
-    extraversion_score = Column(Integer, nullable=False)
-    openness_score = Column(Integer, nullable=False)
-    agreeableness_score = Column(Integer, nullable=False)
-    conscientiousness_score = Column(Integer, nullable=False)
-    password_hash = Column(String, nullable=False)
-
-    grades = relationship("EmployeeGrade", back_populates="employee")
-    departments = relationship("DepartmentMember", back_populates="employee")
-    job_assignments = relationship("EmployeeJobAssignment", back_populates="employee")
-
-class Department(Base):
-    __tablename__ = "department"
-
-    department_id = Column(Integer, primary_key=True, index=True)
-    department_name = Column(String, nullable=False)
-    department_detail = Column(String, nullable=False)
-
-    employees = relationship("DepartmentMember", back_populates="department")
-    job_posts = relationship("JobPost", back_populates="department")
-
-class DepartmentMember(Base):
-    __tablename__ = "department_member"
-
-    departmentmember_id = Column(Integer, primary_key=True, index=True)
-    department_id = Column(Integer, ForeignKey("department.department_id"), nullable=False)
-    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
-
-    department = relationship("Department", back_populates="employees")
-    employee = relationship("Employee", back_populates="departments")
-    
-class EmployeeJobAssignment(Base):
-    __tablename__ = "employee_job_assignment"
-
-    assignment_id = Column(Integer, primary_key=True, index=True)
-    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
-    jobpost_id = Column(Integer, ForeignKey("job_post.jobpost_id"), nullable=False)
-    start_date = Column(Date, nullable=False)
-    end_date = Column(Date, nullable=True)
-
-    employee = relationship("Employee", back_populates="job_assignments")
-    job_post = relationship("JobPost", back_populates="assigned_employees")
-
-class JobPost(Base):
-    __tablename__ = "job_post"
-
-    jobpost_id = Column(Integer, primary_key=True, index=True)
-    department_id = Column(Integer, ForeignKey("department.department_id"), nullable=False)
-    job_title = Column(String, nullable=False)
-    job_detail = Column(String, nullable=False)
-    job_detail_vector = Column(JSON, nullable=False)
-
-    department = relationship("Department", back_populates="job_posts")
-    assigned_employees = relationship("EmployeeJobAssignment", back_populates="job_post")
+import json
+import struct
+import numpy as np
+from sqlalchemy import Column, Integer, String, Date, Float, LargeBinary, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
+from database import Base
+# 新しく書き込むベクトルの保存形式 (float32 / float16 / int8)
+from embedding_config import VECTOR_DTYPE
+
+# 先頭4バイトのヘッダで保存形式を識別する (以降のデータは4バイト境界に揃う)
+_VECTOR_HEADERS = {
+    "float32": b"F32\x00",
+    "float16": b"F16\x00",
+    "int8": b"I08\x00",
+}
+
+def pack_vector(vector, dtype: str = VECTOR_DTYPE) -> bytes:
+    array = np.asarray(vector, dtype=np.float32).ravel()
+    if dtype == "float32":
+        return _VECTOR_HEADERS[dtype] + array.astype("<f4").tobytes()
+    if dtype == "float16":
+        return _VECTOR_HEADERS[dtype] + array.astype("<f2").tobytes()
+    if dtype == "int8":
+        # ベクトルごとの対称スケールで量子化し、スケールをヘッダの直後に置く
+        max_abs = float(np.abs(array).max()) if array.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        quantized = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+        return _VECTOR_HEADERS[dtype] + struct.pack("<f", scale) + quantized.tobytes()
+    raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+def unpack_vector(value) -> np.ndarray:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        header = value[:4]
+        if header == _VECTOR_HEADERS["float32"]:
+            # コピーなしで読み出す (読み取り専用の配列になる)
+            return np.frombuffer(value, dtype="<f4", offset=4)
+        if header == _VECTOR_HEADERS["float16"]:
+            return np.frombuffer(value, dtype="<f2", offset=4).astype(np.float32)
+        if header == _VECTOR_HEADERS["int8"]:
+            scale = struct.unpack_from("<f", value, 4)[0]
+            return np.frombuffer(value, dtype=np.int8, offset=8).astype(np.float32) * np.float32(scale)
+        raise ValueError("Unknown vector header")
+
+    # 移行前のJSON形式 (json.dumpsで二重にエンコードされた文字列も含む)
+    while isinstance(value, str):
+        value = json.loads(value) if value else []
+    return np.asarray(value, dtype=np.float32)
+
+class Vector(TypeDecorator):
+    """ベクトルをJSONではなくパックしたバイナリとして保存するカラム型"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype: str = VECTOR_DTYPE):
+        super().__init__()
+        self.dtype = dtype
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value)
+        if isinstance(value, str):
+            value = unpack_vector(value)
+        return pack_vector(value, self.dtype)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return unpack_vector(value)
+
+class IdSequence(Base):
+    """IDの払い出しに使うカウンタ (nameごとに最後に払い出した番号。id_allocator.pyで更新する)"""
+    __tablename__ = "id_sequence"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+class Grade(Base):
+    __tablename__ = "grade"
+
+    grade_id = Column(Integer, primary_key=True, index=True)
+    grade_name = Column(String, nullable=False)
+
+    employees = relationship("EmployeeGrade", back_populates="grade")
+
+class EmployeeGrade(Base):
+    __tablename__ = "employee_grade"
+
+    employeegrade_id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
+    grade_id = Column(Integer, ForeignKey("grade.grade_id"), nullable=False)
+
+    employee = relationship("Employee", back_populates="grades")
+    grade = relationship("Grade", back_populates="employees")
+
+class Employee(Base):
+    __tablename__ = 'employee'
+
+    employee_id = Column(String, primary_key=True)
+    employee_name = Column(String, nullable=False)
+    birthdate = Column(Date, nullable=False)
+    gender = Column(String, nullable=False)
+    academic_background = Column(String, nullable=False)
+    hire_date = Column(Date, nullable=False)
+    recruitment_type = Column(String, nullable=False)
+    # 画像本体はpicture_storeに保存する (pictureは移行前のデータのみ)
+    picture = Column(LargeBinary)
+    picture_hash = Column(String, nullable=True)
+    career_info_detail = Column(String, nullable=False)
+    career_info_vector = Column(Vector(), nullable=False)
+    personality_detail = Column(String, nullable=False)
+    personality_vector = Column(Vector(), nullable=False)
+    # ベクトルを作ったモデルと次元数 (embedding_configと異なる行はembedding.py --employeesで作り直す)
+    embedding_model = Column(String, nullable=True)
+    embedding_dimensions = Column(Integer, nullable=True)
+    neuroticism_score = Column(Integer, nullable=False)
+    extraversion_score = Column(Integer, nullable=False)
+    openness_score = Column(Integer, nullable=False)
+    agreeableness_score = Column(Integer, nullable=False)
+    conscientiousness_score = Column(Integer, nullable=False)
+    password_hash = Column(String, nullable=False)
+
+    grades = relationship("EmployeeGrade", back_populates="employee")
+    departments = relationship("DepartmentMember", back_populates="employee")
+    job_assignments = relationship("EmployeeJobAssignment", back_populates="employee")
+
+class Department(Base):
+    __tablename__ = "department"
+
+    department_id = Column(Integer, primary_key=True, index=True)
+    department_name = Column(String, nullable=False)
+    department_detail = Column(String, nullable=False)
+
+    employees = relationship("DepartmentMember", back_populates="department")
+    job_posts = relationship("JobPost", back_populates="department")
+
+class DepartmentMember(Base):
+    __tablename__ = "department_member"
+
+    departmentmember_id = Column(Integer, primary_key=True, index=True)
+    department_id = Column(Integer, ForeignKey("department.department_id"), nullable=False)
+    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
+
+    department = relationship("Department", back_populates="employees")
+    employee = relationship("Employee", back_populates="departments")
+    
+class EmployeeJobAssignment(Base):
+    __tablename__ = "employee_job_assignment"
+
+    assignment_id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(String, ForeignKey("employee.employee_id"), nullable=False)
+    jobpost_id = Column(Integer, ForeignKey("job_post.jobpost_id"), nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=True)
+
+    employee = relationship("Employee", back_populates="job_assignments")
+    job_post = relationship("JobPost", back_populates="assigned_employees")
+
+class JobPost(Base):
+    __tablename__ = "job_post"
+
+    jobpost_id = Column(Integer, primary_key=True, index=True)
+    department_id = Column(Integer, ForeignKey("department.department_id"), nullable=False)
+    job_title = Column(String, nullable=False)
+    job_detail = Column(String, nullable=False)
+    job_detail_vector = Column(Vector(), nullable=False)
+    job_detail_hash = Column(String, nullable=True)
+    embedding_model = Column(String, nullable=True)
+    embedding_dimensions = Column(Integer, nullable=True)
+
+    department = relationship("Department", back_populates="job_posts")
+    assigned_employees = relationship("EmployeeJobAssignment", back_populates="job_post")
+
+class Recommendation(Base):
+    """社員と求人の組み合わせのスコアの上位N件 (recommendations.pyで更新する)
+
+    社員ごとの上位N件の求人にはemployee_rank、求人ごとの上位N件の社員にはjobpost_rankを入れる
+    (両方の上位に入る組み合わせは1行で両方を持つ)。現在の配属先は含めない。
+    """
+    __tablename__ = "recommendation"
+
+    employee_id = Column(String, ForeignKey("employee.employee_id"), primary_key=True)
+    jobpost_id = Column(Integer, ForeignKey("job_post.jobpost_id"), primary_key=True)
+    score = Column(Float, nullable=False)
+    employee_rank = Column(Integer, nullable=True)
+    jobpost_rank = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_recommendation_employee_rank", "employee_id", "employee_rank"),
+        Index("ix_recommendation_jobpost_rank", "jobpost_id", "jobpost_rank"),
+    )
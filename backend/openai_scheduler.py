@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import logging
+import itertools
+import contextvars
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from metrics import OPENAI_RETRIES, record_openai_usage
+
+# openaiパッケージは読み込みに時間がかかるので、クライアントを作るとき (起動後のウォームアップ) に読み込む
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# アカウントのレート制限 (0なら制限しない)。429を受けたときはRetry-Afterの間すべての送信を止める
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "0"))
+# OpenAIへの同時リクエスト数の上限 (プロセス全体で共有)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_RETRY_BASE = float(os.getenv("OPENAI_RETRY_BASE", "1"))
+OPENAI_RETRY_MAX = float(os.getenv("OPENAI_RETRY_MAX", "60"))
+# get_embeddingの呼び出しをまとめるまでの待ち時間と、1リクエストに入れる最大件数
+EMBEDDING_MICROBATCH_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_WAIT_MS", "5"))
+EMBEDDING_MICROBATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_MICROBATCH_MAX_INPUTS", "256"))
+
+# 優先度 (小さいほど先に送る)。登録などの画面からの処理を、一括の再エンベディングより優先する
+INTERACTIVE = 0
+BATCH = 1
+
+_lane: contextvars.ContextVar[int] = contextvars.ContextVar("openai_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def lane(priority: int) -> Iterator[None]:
+    """このブロック内のOpenAI呼び出しの優先度を変える"""
+    token = _lane.set(priority)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    # 英数字はおよそ4文字で1トークン、日本語は1文字1トークン程度として見積もる
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+class TokenBucket:
+    """1分あたりの量を制限するトークンバケット (rate_per_minuteが0なら無制限)"""
+
+    def __init__(self, rate_per_minute: float):
+        self.configure(rate_per_minute)
+
+    def configure(self, rate_per_minute: float) -> None:
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        # 見積もりと実際の使用量の差を戻す (負なら追加で消費する)
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class OpenAIScheduler:
+    """チャットとエンベディングの呼び出しをすべて通すスケジューラ
+
+    - リクエスト数とトークン数のトークンバケットで、アカウントのRPM/TPMを超えないように送る
+    - 優先度の高い呼び出し (INTERACTIVE) から順に送信枠を割り当てる
+    - 429/5xx/接続エラーは指数バックオフ (Retry-Afterがあればそれに従う) で再試行する
+    - 同時に来た1件ずつのエンベディングを1回の複数入力リクエストにまとめる
+    - 同じ内容の実行中リクエストには相乗りする
+    """
+
+    def __init__(self, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM, concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 max_retries: int = OPENAI_MAX_RETRIES):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._client: Optional["AsyncOpenAI"] = None
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, int]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._blocked_until = 0.0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._batches: Dict[Tuple[str, Optional[int], int], Tuple[Dict[str, asyncio.Future], asyncio.TimerHandle]] = {}
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        # 再試行はスケジューラで行うので、SDK側の再試行は無効にする
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(max_retries=0)
+        return self._client
+
+    @client.setter
+    def client(self, client: Any) -> None:
+        self._client = client
+
+    def configure(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                  concurrency: Optional[int] = None) -> None:
+        if rpm is not None:
+            self.requests.configure(rpm)
+        if tpm is not None:
+            self.tokens.configure(tpm)
+        if concurrency is not None:
+            self.concurrency = concurrency
+
+    # --- 送信枠の割り当て ---
+
+    def _pump(self) -> None:
+        self._timer = None
+        loop = asyncio.get_running_loop()
+        while self._waiters and self._active < self.concurrency:
+            priority, sequence, future, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self._blocked_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                self._timer = loop.call_later(wait, self._pump)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._active += 1
+            future.set_result(None)
+
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future, tokens))
+        if self._timer is None:
+            self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        if self._timer is None:
+            self._pump()
+
+    # --- 再試行 ---
+
+    async def _request(self, endpoint: str, model: str, estimated_tokens: int, priority: int,
+                       call: Callable[[], Awaitable[Any]]) -> Any:
+        import openai
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, estimated_tokens)
+            try:
+                response = await call()
+                error = None
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                error = e
+            finally:
+                # 待っている間は送信枠を返す (429が続いても優先度の高い呼び出しが枠を取れるように)
+                self._release()
+
+            if error is None:
+                record_openai_usage(model, endpoint, response)
+                usage = getattr(response, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    self.tokens.give_back(estimated_tokens - usage.total_tokens)
+                return response
+
+            # 失敗したリクエストはトークンを使っていないので戻す (再試行でもう一度取る)
+            self.tokens.give_back(estimated_tokens)
+            retry_after = _retry_after(error)
+            delay = retry_after if retry_after is not None else min(OPENAI_RETRY_MAX, OPENAI_RETRY_BASE * 2 ** attempt)
+            delay *= random.uniform(1.0, 1.2)
+            if isinstance(error, openai.RateLimitError):
+                # アカウント全体の制限なので、他の呼び出しも待たせる
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            OPENAI_RETRIES.inc(endpoint=endpoint, reason=type(error).__name__)
+            if attempt == self.max_retries:
+                logging.error(f"OpenAI {endpoint} failed after {attempt + 1} attempts: {error}")
+                raise HTTPException(status_code=503, detail="OpenAI API is unavailable; please retry later",
+                                    headers={"Retry-After": str(int(delay) + 1)})
+            logging.warning(f"OpenAI {endpoint} {type(error).__name__}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _coalesce(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        # 同じ内容のリクエストが実行中なら、その結果を待つ
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    # --- 公開API ---
+
+    async def chat(self, model: str, messages: List[Dict[str, str]], max_tokens: int,
+                   priority: Optional[int] = None, **params: Any) -> Any:
+        priority = _lane.get() if priority is None else priority
+        estimated = sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+        key = "chat:" + hashlib.sha256(json.dumps(
+            {"model": model, "messages": messages, "max_tokens": max_tokens, **params}, sort_keys=True, ensure_ascii=False
+        ).encode("utf-8")).hexdigest()
+
+        return await self._coalesce(key, lambda: self._request(
+            "chat.completions", model, estimated, priority,
+            lambda: self.client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens, **params),
+        ))
+
+    async def embed(self, texts: List[str], model: str, dimensions: Optional[int] = None,
+                    priority: Optional[int] = None) -> List[List[float]]:
+        """複数のテキストを1回のリクエストでエンベディングにする"""
+        priority = _lane.get() if priority is None else priority
+        params = {"dimensions": dimensions} if dimensions else {}
+        estimated = sum(estimate_tokens(text) for text in texts)
+        key = "embeddings:" + hashlib.sha256(json.dumps(
+            [model, dimensions, texts], ensure_ascii=False
+        ).encode("utf-8")).hexdigest()
+
+        async def create() -> List[List[float]]:
+            response = await self._request(
+                "embeddings", model, estimated, priority,
+                lambda: self.client.embeddings.create(input=texts, model=model, **params),
+            )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        return await self._coalesce(key, create)
+
+    async def embed_one(self, text: str, model: str, dimensions: Optional[int] = None,
+                        priority: Optional[int] = None) -> List[float]:
+        """1件のエンベディング。数ミリ秒のあいだに来た呼び出しをまとめて1回で送る"""
+        priority = _lane.get() if priority is None else priority
+        key = (model, dimensions, priority)
+        loop = asyncio.get_running_loop()
+        if key not in self._batches:
+            timer = loop.call_later(EMBEDDING_MICROBATCH_WAIT_MS / 1000, self._flush, key)
+            self._batches[key] = ({}, timer)
+        pending, _ = self._batches[key]
+        future = pending.get(text)
+        if future is None:
+            future = pending[text] = loop.create_future()
+        if len(pending) >= EMBEDDING_MICROBATCH_MAX_INPUTS:
+            self._flush(key)
+        return await asyncio.shield(future)
+
+    def _flush(self, key: Tuple[str, Optional[int], int]) -> None:
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        pending, timer = batch
+        timer.cancel()
+        model, dimensions, priority = key
+        texts = list(pending)
+        task = asyncio.ensure_future(self.embed(texts, model, dimensions, priority))
+
+        def distribute(task: asyncio.Future) -> None:
+            error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+            for index, text in enumerate(texts):
+                future = pending[text]
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(task.result()[index])
+
+        task.add_done_callback(distribute)
+
+
+scheduler = OpenAIScheduler()
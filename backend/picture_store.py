@@ -0,0 +1,98 @@
+import os
+import shutil
+import hashlib
+import logging
+from io import BytesIO
+from typing import Optional, Union
+
+from PIL import Image
+
+PICTURE_STORE_DIR = os.getenv("PICTURE_STORE_DIR", "./pictures")
+PICTURE_THUMBNAIL_SIZE = int(os.getenv("PICTURE_THUMBNAIL_SIZE", "256"))
+PICTURE_MAX_BYTES = int(os.getenv("PICTURE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# 先頭バイトから判定する画像形式
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+def picture_path(picture_hash: str, thumbnail: bool = False) -> str:
+    # 1ディレクトリにファイルが集中しないよう、ハッシュの先頭2文字で分ける
+    name = f"{picture_hash}.thumb.jpg" if thumbnail else picture_hash
+    return os.path.join(PICTURE_STORE_DIR, picture_hash[:2], name)
+
+
+def media_type(head: bytes) -> str:
+    for signature, media_type in _SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+
+def content_type(path: str) -> str:
+    with open(path, "rb") as f:
+        return media_type(f.read(12))
+
+
+def _write_atomic(path: str, data: Union[bytes, str]) -> None:
+    # dataがstrならそのパスのファイルをコピーする
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if isinstance(data, str):
+        shutil.copyfile(data, tmp_path)
+    else:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_thumbnail(data: Union[bytes, str]) -> Optional[bytes]:
+    try:
+        with Image.open(BytesIO(data) if isinstance(data, bytes) else data) as image:
+            # JPEGは縮小しながらデコードする (元の大きさのままメモリに展開しない)
+            image.draft("RGB", (PICTURE_THUMBNAIL_SIZE, PICTURE_THUMBNAIL_SIZE))
+            image.thumbnail((PICTURE_THUMBNAIL_SIZE, PICTURE_THUMBNAIL_SIZE))
+            output = BytesIO()
+            image.convert("RGB").save(output, format="JPEG", quality=85)
+            return output.getvalue()
+    except Exception as e:
+        logging.warning(f"Could not generate thumbnail for picture: {e}")
+        return None
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def save_picture(data: Union[bytes, str], picture_hash: Optional[str] = None) -> str:
+    """画像をsha256をファイル名として保存し、ハッシュを返す (同じ画像は1つだけ保存される)
+
+    dataにはファイルのパスも渡せる (アップロードを書き出したもの。ハッシュが分かっていれば渡す)。
+    """
+    if picture_hash is None:
+        if isinstance(data, str):
+            with open(data, "rb") as f:
+                picture_hash = hashlib.file_digest(f, "sha256").hexdigest()
+        else:
+            picture_hash = digest(data)
+    path = picture_path(picture_hash)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    thumbnail_path = picture_path(picture_hash, thumbnail=True)
+    if not os.path.exists(thumbnail_path):
+        thumbnail = make_thumbnail(data)
+        if thumbnail is not None:
+            _write_atomic(thumbnail_path, thumbnail)
+    return picture_hash
+
+
+def picture_url(employee_id: str, picture_hash: Optional[str]) -> Optional[str]:
+    # ハッシュをクエリに含め、画像が変わればURLも変わるようにする
+    if not picture_hash:
+        return None
+    return f"/employees/{employee_id}/picture?v={picture_hash[:16]}"
@@ -0,0 +1,404 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, delete, or_, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import Employee, EmployeeJobAssignment, JobPost, Recommendation
+from database import SessionLocal, get_engine
+from matching import MatchingEngine, matcher
+
+# 社員ごと・求人ごとに保存するおすすめの件数
+RECOMMENDATION_TOP_N = int(os.getenv("RECOMMENDATION_TOP_N", "50"))
+# スコアの重み (/jobposts/{id}/candidates などの既定値と同じ)
+RECOMMENDATION_CAREER_WEIGHT = float(os.getenv("RECOMMENDATION_CAREER_WEIGHT", "0.7"))
+RECOMMENDATION_PERSONALITY_WEIGHT = float(os.getenv("RECOMMENDATION_PERSONALITY_WEIGHT", "0.3"))
+# 全件の作り直しで一度にスコアを計算する社員数 (社員数×求人数のfloat32行列をこの行数ずつ作る)
+RECOMMENDATION_BLOCK_SIZE = int(os.getenv("RECOMMENDATION_BLOCK_SIZE", "1024"))
+# ベクトルが変わった求人がこの割合を超えたら、差分ではなく全件を作り直す
+RECOMMENDATION_REBUILD_RATIO = float(os.getenv("RECOMMENDATION_REBUILD_RATIO", "0.2"))
+# 別プロセスの更新がロックを持ち続けてbusy_timeoutを超えたときにやり直す回数
+RECOMMENDATION_WRITE_RETRIES = int(os.getenv("RECOMMENDATION_WRITE_RETRIES", "3"))
+
+# IN句に入れるIDの数と、全件の作り直しで1回に挿入する行数
+_IN_CHUNK = 500
+_INSERT_BATCH = 10000
+# PostgreSQLでおすすめの更新を直列にするアドバイザリロックのキー
+_ADVISORY_LOCK_KEY = 0x7265636F
+
+# 社員のリストは求人を、求人のリストは社員をスコア順に持つ (所有者の列, 相手の列, 順位の列)
+_SIDES = {
+    "employee": (Recommendation.employee_id, Recommendation.jobpost_id, Recommendation.employee_rank),
+    "jobpost": (Recommendation.jobpost_id, Recommendation.employee_id, Recommendation.jobpost_rank),
+}
+
+Entries = List[Tuple[Any, float]]
+
+
+def _chunks(items: Sequence, size: int = _IN_CHUNK) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def top_n(scores: np.ndarray, n: int, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """axisに沿ったスコアの上位n件の位置とスコアを降順で返す (行ごと・列ごとにまとめて計算する)"""
+    n = min(n, scores.shape[axis])
+    if n <= 0:
+        shape = (scores.shape[0], 0) if axis == 1 else (0, scores.shape[1])
+        return np.empty(shape, dtype=np.int64), np.empty(shape, dtype=scores.dtype)
+    index = np.argpartition(-scores, n - 1, axis=axis).take(np.arange(n), axis=axis)
+    values = np.take_along_axis(scores, index, axis)
+    order = np.argsort(-values, axis=axis, kind="stable")
+    return np.take_along_axis(index, order, axis), np.take_along_axis(values, order, axis)
+
+
+def _entries(ids: Sequence, index: Iterable[int], values: Iterable[float]) -> Entries:
+    # 除外した組み合わせ (-inf) は入れない
+    return [(ids[i], float(value)) for i, value in zip(index, values) if np.isfinite(value)]
+
+
+def lock_for_write(db: Session) -> None:
+    """おすすめの更新を別プロセスの更新と直列にする (読み出しの前に呼び、commitまでロックを持つ)
+
+    SQLiteは書き込みロックを先に取る (BEGIN IMMEDIATE)。後から書き込みに上げるとほかの書き込みと
+    衝突して失敗するため。PostgreSQLはトランザクションの終わりまで有効なアドバイザリロックを取る。
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        connection = db.connection()
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+    elif dialect == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+
+
+def current_assignments(db: Session, employee_ids: Optional[Sequence[str]] = None,
+                        jobpost_ids: Optional[Sequence[int]] = None) -> Set[Tuple[str, int]]:
+    """現在の配属 (終了日がないか今日以降) の (employee_id, jobpost_id)。おすすめから除外する"""
+    query = select(EmployeeJobAssignment.employee_id, EmployeeJobAssignment.jobpost_id).where(
+        or_(EmployeeJobAssignment.end_date.is_(None), EmployeeJobAssignment.end_date >= date.today())
+    )
+    if employee_ids is None and jobpost_ids is None:
+        return {(employee_id, jobpost_id) for employee_id, jobpost_id in db.execute(query)}
+    column, ids = ((EmployeeJobAssignment.employee_id, employee_ids) if employee_ids is not None
+                   else (EmployeeJobAssignment.jobpost_id, jobpost_ids))
+    pairs = set()
+    for chunk in _chunks(list(ids)):
+        pairs.update((employee_id, jobpost_id) for employee_id, jobpost_id in db.execute(query.where(column.in_(chunk))))
+    return pairs
+
+
+class RecommendationStore:
+    """社員と求人の組み合わせの上位N件をrecommendationテーブルに保存しておく
+
+    閲覧のたびに全件との類似度を計算せず、(所有者, 順位) のインデックスを引く1回のクエリで返せるようにする。
+    社員の登録と求人のベクトルの更新では、影響するリストだけを作り直す。
+    """
+
+    def __init__(self, top_n: int = RECOMMENDATION_TOP_N, career_weight: float = RECOMMENDATION_CAREER_WEIGHT,
+                 personality_weight: float = RECOMMENDATION_PERSONALITY_WEIGHT,
+                 block_size: int = RECOMMENDATION_BLOCK_SIZE):
+        self.top_n = top_n
+        self.career_weight = career_weight
+        self.personality_weight = personality_weight
+        self.block_size = block_size
+        # 同じプロセス内の更新は1つずつ行う (別プロセスとは lock_for_write で直列にする)。
+        # 同期の呼び出しは別スレッドから来る前提で、イベントループからは *_async を使う
+        self._lock = threading.Lock()
+        # イベントループからの更新を1つずつ実行するスレッド (更新ごとに自分のセッションを使う)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommendations")
+
+    # --- 保存済みのリスト ---
+
+    def _read_lists(self, db: Session, side: str, owners: Sequence) -> Dict[Any, Entries]:
+        owner_column, other_column, rank_column = _SIDES[side]
+        lists: Dict[Any, Entries] = {}
+        for chunk in _chunks(list(owners)):
+            rows = db.execute(
+                select(owner_column, other_column, Recommendation.score)
+                .where(owner_column.in_(chunk), rank_column.is_not(None))
+                .order_by(owner_column, rank_column)
+            )
+            for owner, other, score in rows:
+                lists.setdefault(owner, []).append((other, score))
+        return lists
+
+    def _thresholds(self, db: Session, side: str, owners: Sequence) -> Dict[Any, float]:
+        """上位N件が埋まっているリストのN件目のスコア (これを超えればリストに入る)"""
+        owner_column, _, rank_column = _SIDES[side]
+        thresholds = {}
+        for chunk in _chunks(list(owners)):
+            thresholds.update(db.execute(
+                select(owner_column, Recommendation.score).where(owner_column.in_(chunk), rank_column == self.top_n)
+            ).all())
+        return thresholds
+
+    def _write_lists(self, db: Session, side: str, lists: Dict[Any, Entries]) -> None:
+        """所有者ごとのリストを置き換える (順位・スコアが変わった行だけを書き、どちらのリストにもない行は削除する)"""
+        owner_column, other_column, rank_column = _SIDES[side]
+        other_rank_column = _SIDES["jobpost" if side == "employee" else "employee"][2]
+        table = Recommendation.__table__
+        key = (table.c.employee_id == bindparam("_employee_id")) & (table.c.jobpost_id == bindparam("_jobpost_id"))
+        write = table.update().where(key).values({"score": bindparam("_score"), rank_column.key: bindparam("_rank")})
+        for owners in _chunks(list(lists)):
+            wanted = {(owner, other): (score, rank) for owner in owners
+                      for rank, (other, score) in enumerate(lists[owner], start=1)}
+            updates, deletes = [], []
+            rows = db.execute(select(owner_column, other_column, Recommendation.score, rank_column, other_rank_column)
+                              .where(owner_column.in_(owners)))
+            for owner, other, score, rank, other_rank in rows:
+                pair = {owner_column.key: owner, other_column.key: other}
+                new = wanted.pop((owner, other), None)
+                if new is None:
+                    if other_rank is None:
+                        deletes.append(pair)
+                    elif rank is not None:
+                        updates.append({**pair, "score": score, "rank": None})
+                elif new != (score, rank):
+                    updates.append({**pair, "score": new[0], "rank": new[1]})
+            if updates:
+                db.execute(write, [{"_employee_id": row["employee_id"], "_jobpost_id": row["jobpost_id"],
+                                    "_score": row["score"], "_rank": row["rank"]} for row in updates])
+            if deletes:
+                db.execute(table.delete().where(key), [{"_employee_id": row["employee_id"], "_jobpost_id": row["jobpost_id"]}
+                                                       for row in deletes])
+            if wanted:
+                db.execute(table.insert(), [
+                    {owner_column.key: owner, other_column.key: other, "score": score, rank_column.key: rank}
+                    for (owner, other), (score, rank) in wanted.items()
+                ])
+
+    # --- スコアの計算 ---
+
+    def _employee_scores(self, db: Session, employee_ids: Sequence[str]) -> Tuple[List[int], np.ndarray]:
+        """社員×全求人のスコア (現在の配属先は-inf)"""
+        jobpost_ids, scores = matcher.jobpost_scores(employee_ids, self.career_weight, self.personality_weight)
+        rows = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+        columns = {jobpost_id: i for i, jobpost_id in enumerate(jobpost_ids)}
+        for employee_id, jobpost_id in current_assignments(db, employee_ids=employee_ids):
+            if jobpost_id in columns:
+                scores[rows[employee_id], columns[jobpost_id]] = -np.inf
+        return jobpost_ids, scores
+
+    def _refresh_employees(self, db: Session, employee_ids: Sequence[str]) -> None:
+        for block in _chunks(list(employee_ids), self.block_size):
+            jobpost_ids, scores = self._employee_scores(db, block)
+            index, values = top_n(scores, self.top_n, axis=1)
+            self._write_lists(db, "employee", {
+                employee_id: _entries(jobpost_ids, index[i], values[i]) for i, employee_id in enumerate(block)
+            })
+
+    # --- 差分の更新 ---
+
+    def add_employees(self, db: Session, employee_ids: Sequence[str]) -> None:
+        """登録した社員のリストを作り、その社員が上位N件に入る求人のリストに差し込む"""
+        if not employee_ids:
+            return
+        # 全件の読み直しはロックの外で済ませておく
+        matcher.ensure_loaded()
+        with self._lock:
+            try:
+                lock_for_write(db)
+                self._add_employees(db, employee_ids)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+    def _add_employees(self, db: Session, employee_ids: Sequence[str]) -> None:
+        jobpost_ids, scores = self._employee_scores(db, employee_ids)
+        index, values = top_n(scores, self.top_n, axis=1)
+        self._write_lists(db, "employee", {
+            employee_id: _entries(jobpost_ids, index[i], values[i]) for i, employee_id in enumerate(employee_ids)
+        })
+
+        # 社員が増えても既存の社員どうしの順位は変わらないので、保存済みのリストと新しいスコアを併合すればよい
+        thresholds = self._thresholds(db, "jobpost", jobpost_ids)
+        limits = np.array([thresholds.get(jobpost_id, -np.inf) for jobpost_id in jobpost_ids], dtype=np.float32)
+        affected = np.flatnonzero((scores > limits).any(axis=0))
+        current = self._read_lists(db, "jobpost", [jobpost_ids[column] for column in affected])
+        added = set(employee_ids)
+        lists = {}
+        for column in affected:
+            jobpost_id = jobpost_ids[column]
+            merged = [entry for entry in current.get(jobpost_id, []) if entry[0] not in added]
+            merged.extend(_entries(employee_ids, range(len(employee_ids)), scores[:, column]))
+            merged.sort(key=lambda entry: -entry[1])
+            lists[jobpost_id] = merged[:self.top_n]
+        self._write_lists(db, "jobpost", lists)
+
+    def _in_session(self, method, *args) -> Any:
+        # ほかのプロセスの全件の作り直しがbusy_timeoutより長くロックを持っていたらやり直す
+        for attempt in range(RECOMMENDATION_WRITE_RETRIES + 1):
+            get_engine()
+            with SessionLocal() as db:
+                try:
+                    return method(db, *args)
+                except OperationalError:
+                    if attempt == RECOMMENDATION_WRITE_RETRIES:
+                        raise
+                    logging.warning("Recommendations are locked by another writer; retrying")
+
+    async def add_employees_async(self, employee_ids: Sequence[str]) -> None:
+        """イベントループから使う add_employees (更新用のスレッドで自分のセッションを使って実行する)"""
+        if not employee_ids:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._in_session, self.add_employees, list(employee_ids))
+
+    def refresh_jobposts(self, db: Session, jobpost_ids: Sequence[int]) -> None:
+        """ベクトルが変わった求人のリストと、その求人が入る (入っていた) 社員のリストを作り直す"""
+        if not jobpost_ids:
+            return
+        # 別プロセス (embedding.py) で書き込まれたベクトルを読み直す (読み込み済みなら変わった求人だけ)
+        matcher.ensure_loaded()
+        for chunk in _chunks(list(jobpost_ids)):
+            for jobpost in db.query(JobPost).filter(JobPost.jobpost_id.in_(chunk)):
+                matcher.upsert_jobpost(jobpost)
+        jobpost_ids = [jobpost_id for jobpost_id in jobpost_ids if jobpost_id in matcher.jobposts.index]
+        if len(jobpost_ids) > len(matcher.jobposts) * RECOMMENDATION_REBUILD_RATIO:
+            self.rebuild(db)
+            return
+        if not jobpost_ids:
+            return
+        with self._lock:
+            try:
+                lock_for_write(db)
+                employee_ids, scores = matcher.candidate_scores(jobpost_ids, self.career_weight, self.personality_weight)
+                rows = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+                positions = {jobpost_id: i for i, jobpost_id in enumerate(jobpost_ids)}
+                for employee_id, jobpost_id in current_assignments(db, jobpost_ids=jobpost_ids):
+                    if employee_id in rows:
+                        scores[rows[employee_id], positions[jobpost_id]] = -np.inf
+                index, values = top_n(scores, self.top_n, axis=0)
+                self._write_lists(db, "jobpost", {
+                    jobpost_id: _entries(employee_ids, index[:, i], values[:, i]) for i, jobpost_id in enumerate(jobpost_ids)
+                })
+
+                # 求人が新しく上位N件に入る社員と、古いスコアで入っていた社員のリストは全求人から選び直す
+                thresholds = self._thresholds(db, "employee", employee_ids)
+                limits = np.array([thresholds.get(employee_id, -np.inf) for employee_id in employee_ids],
+                                  dtype=np.float32)
+                affected = {employee_ids[row] for row in np.flatnonzero((scores > limits[:, None]).any(axis=1))}
+                for chunk in _chunks(jobpost_ids):
+                    affected.update(db.execute(select(Recommendation.employee_id).where(
+                        Recommendation.jobpost_id.in_(chunk), Recommendation.employee_rank.is_not(None)
+                    )).scalars())
+                self._refresh_employees(db, sorted(affected & set(rows)))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+    # --- 全件の作り直し ---
+
+    def rebuild(self, db: Session) -> Dict[str, Any]:
+        """全社員×全求人のスコアを社員のブロックごとに計算し、テーブルを1トランザクションで置き換える
+
+        計算中はロックを持たない (登録を止めない)。計算を始めた後に登録された社員は、
+        置き換えるトランザクションの中で差分の更新と同じ方法で加える。
+        """
+        start = time.perf_counter()
+        # 計算中にサーバーの行列が変わっても影響しないよう、別のインスタンスに読み込む
+        engine = MatchingEngine()
+        engine.load(db)
+        employee_ids = list(engine.employees.ids)
+        jobpost_ids = list(engine.jobposts.ids)
+        rows = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+        columns = {jobpost_id: i for i, jobpost_id in enumerate(jobpost_ids)}
+        assigned = [(rows[employee_id], columns[jobpost_id]) for employee_id, jobpost_id in current_assignments(db)
+                    if employee_id in rows and jobpost_id in columns]
+        assigned_rows = np.array([row for row, _ in assigned], dtype=np.int64)
+        assigned_columns = np.array([column for _, column in assigned], dtype=np.int64)
+
+        pairs: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        # 求人ごとの上位N件は、ここまでの上位N件と新しいブロックを併合して保つ
+        n = min(self.top_n, len(employee_ids))
+        best_scores = np.full((n, len(jobpost_ids)), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((n, len(jobpost_ids)), dtype=np.int64)
+        for block_start in range(0, len(employee_ids), self.block_size):
+            block = employee_ids[block_start:block_start + self.block_size]
+            _, scores = engine.jobpost_scores(block, self.career_weight, self.personality_weight)
+            mask = (assigned_rows >= block_start) & (assigned_rows < block_start + len(block))
+            scores[assigned_rows[mask] - block_start, assigned_columns[mask]] = -np.inf
+
+            index, values = top_n(scores, self.top_n, axis=1)
+            for i, employee_id in enumerate(block):
+                for rank, (jobpost_id, score) in enumerate(_entries(jobpost_ids, index[i], values[i]), start=1):
+                    pairs[(employee_id, jobpost_id)] = {
+                        "employee_id": employee_id, "jobpost_id": jobpost_id, "score": score,
+                        "employee_rank": rank, "jobpost_rank": None,
+                    }
+
+            merged_scores = np.vstack([best_scores, scores])
+            block_rows = np.broadcast_to(np.arange(block_start, block_start + len(block))[:, None], scores.shape)
+            merged_rows = np.vstack([best_rows, block_rows])
+            index, best_scores = top_n(merged_scores, n, axis=0)
+            best_rows = np.take_along_axis(merged_rows, index, 0)
+
+        for column, jobpost_id in enumerate(jobpost_ids):
+            for rank, (row, score) in enumerate(_entries(best_rows[:, column], range(n), best_scores[:, column]),
+                                                start=1):
+                employee_id = employee_ids[row]
+                pair = pairs.setdefault((employee_id, jobpost_id), {
+                    "employee_id": employee_id, "jobpost_id": jobpost_id, "score": score, "employee_rank": None,
+                })
+                pair["jobpost_rank"] = rank
+
+        with self._lock:
+            try:
+                lock_for_write(db)
+                db.execute(delete(Recommendation))
+                values = list(pairs.values())
+                for batch in _chunks(values, _INSERT_BATCH):
+                    # ORMのinsertは主キーを取得するため細かく分かれるので、テーブルに直接executemanyする
+                    db.execute(Recommendation.__table__.insert(), batch)
+                added = self._employees_since(db, rows)
+                if added:
+                    self._add_employees(db, added)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        stats = {"employees": len(employee_ids) + len(added), "jobposts": len(jobpost_ids), "rows": len(pairs),
+                 "seconds": time.perf_counter() - start}
+        logging.info(f"Recommendations rebuilt: {stats}")
+        return stats
+
+    def _employees_since(self, db: Session, known: Dict[str, int]) -> List[str]:
+        """known にない (計算を始めた後に登録された) 社員。matcher にもベクトルを入れておく"""
+        added = [employee_id for employee_id in db.execute(select(Employee.employee_id)).scalars()
+                 if employee_id not in known]
+        for chunk in _chunks(added):
+            rows = db.execute(select(Employee.employee_id, Employee.career_info_vector, Employee.personality_vector)
+                              .where(Employee.employee_id.in_(chunk)))
+            for employee_id, career, personality in rows:
+                matcher.upsert_employee_vectors(employee_id, career, personality)
+        if added:
+            matcher.ensure_loaded()
+        return added
+
+
+recommendations = RecommendationStore()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the materialized employee/job post recommendations")
+    parser.add_argument("--top-n", type=int, default=RECOMMENDATION_TOP_N, help="entries kept per employee and job post")
+    parser.add_argument("--block-size", type=int, default=RECOMMENDATION_BLOCK_SIZE,
+                        help="employees scored per matrix multiplication")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    get_engine()
+    store = RecommendationStore(top_n=args.top_n, block_size=args.block_size)
+    with SessionLocal() as db:
+        print(store.rebuild(db))
@@ -0,0 +1,52 @@
+import base64
+from typing import Any, Sequence, Union
+
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# ベクトルの返し方: "list" はJSONの数値配列、"b64f32" はリトルエンディアンfloat32のbase64文字列
+VECTOR_FORMATS = ("list", "b64f32")
+
+
+def encode_vector(vector: Sequence[float], vector_format: str = "list") -> Union[np.ndarray, str]:
+    """ベクトルをレスポンス用に変換する。listの場合はndarrayのまま返し、orjsonに直接書き出させる"""
+    array = np.ascontiguousarray(vector, dtype="<f4")
+    if vector_format == "b64f32":
+        return base64.b64encode(array.tobytes()).decode("ascii")
+    return array
+
+
+def dumps(content: Any, exclude_unset: bool = False) -> bytes:
+    """pydanticモデル・ndarray・日付を含むデータをorjsonでJSONにする
+
+    モデルは検証もmodel_dumpも通さず、フィールドの値をそのまま書き出す。
+    DBから読んだ信頼できる値をmodel_constructで組み立てたレスポンス向け。
+    """
+    def default(obj: Any) -> Any:
+        if isinstance(obj, BaseModel):
+            if exclude_unset:
+                return {name: value for name, value in obj.__dict__.items() if name in obj.model_fields_set}
+            return obj.__dict__
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    return orjson.dumps(content, default=default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def to_jsonable(content: Any) -> Any:
+    """dumpsと同じ規則で、JSONに変換できるdict/listにする (ジョブの結果の保存用)"""
+    return orjson.loads(dumps(content))
+
+
+class FastJSONResponse(JSONResponse):
+    """response_modelによる再検証を通さずにorjsonで返すレスポンス"""
+
+    def __init__(self, content: Any, exclude_unset: bool = False, **kwargs: Any):
+        self.exclude_unset = exclude_unset
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content, self.exclude_unset)
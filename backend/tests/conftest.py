@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+# テストではDB・キャッシュ・保存先をすべて一時ディレクトリに置く (モジュールのimport前に設定する)
+_directory = tempfile.mkdtemp(prefix="backend_tests_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_directory, 'test.db')}",
+    "ANALYSIS_CACHE_PATH": os.path.join(_directory, "analysis_cache.db"),
+    "EMBEDDING_CACHE_PATH": os.path.join(_directory, "embedding_cache.db"),
+    "JOB_QUEUE_PATH": os.path.join(_directory, "job_queue.db"),
+    "JOB_FILES_DIR": os.path.join(_directory, "job_files"),
+    "PICTURE_STORE_DIR": os.path.join(_directory, "pictures"),
+    "VECTOR_INDEX_DIR": os.path.join(_directory, "vector_index"),
+    "EMBEDDING_CHECKPOINT_PATH": os.path.join(_directory, "job_detail_vectors.checkpoint.json"),
+    "EMPLOYEE_EMBEDDING_CHECKPOINT_PATH": os.path.join(_directory, "employee_vectors.checkpoint.json"),
+    "OPENAI_API_KEY": "test",
+    "CPU_WORKERS": "0",
+    "BCRYPT_ROUNDS": "4",
+    "EMBEDDING_DIMENSIONS": "8",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def database_url(tmp_path, monkeypatch):
+    """テストごとに空のSQLiteファイルを使う (database.get_engine() などもこのDBにつながる)"""
+    import database
+    import models  # noqa: F401 (テーブル定義をBase.metadataに登録する)
+
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    monkeypatch.setattr(database, "SQLALCHEMY_DATABASE_URL", url)
+    monkeypatch.setattr(database, "_engine", None)
+    monkeypatch.setattr(database, "_async_engine", None)
+    database.migrate(database.get_engine())
+    yield url
+    database.get_engine().dispose()
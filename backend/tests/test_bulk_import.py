@@ -0,0 +1,119 @@
+import io
+import csv
+import asyncio
+import zipfile
+import threading
+from typing import Dict, List, Optional
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import bulk_import
+import utils
+from database import async_session
+from id_allocator import employee_ids
+
+ROW = {
+    "employee_name": "社員", "birthdate": "1990-01-01", "gender": "その他", "academic_background": "学士",
+    "hire_date": "2024-04-01", "recruitment_type": "中途", "grade_id": "1", "department_id": "1", "jobpost_id": "1",
+    "neuroticism_score": "5", "extraversion_score": "5", "openness_score": "5", "agreeableness_score": "5",
+    "conscientiousness_score": "5", "password": "password",
+}
+
+
+def csv_upload(rows: List[Dict[str, str]]) -> UploadFile:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(ROW) + ["resume_file"])
+    writer.writeheader()
+    writer.writerows(rows)
+    return UploadFile(file=io.BytesIO(buffer.getvalue().encode("utf-8")), filename="employees.csv")
+
+
+def zip_upload(files: Dict[str, bytes]) -> UploadFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return UploadFile(file=buffer, filename="files.zip")
+
+
+def run_import(csv_file: UploadFile, archive: Optional[UploadFile] = None):
+    async def scenario():
+        async with async_session() as db:
+            return await bulk_import.import_employees(db, csv_file, archive)
+
+    return asyncio.run(scenario())
+
+
+def test_failed_row_does_not_fail_the_chunk(database_url, monkeypatch):
+    allocate = employee_ids.allocate_async
+
+    async def duplicate_second_id(count):
+        # 2行目に1行目と同じIDを渡し、主キーの重複で失敗させる
+        ids = await allocate(count)
+        return [ids[0], ids[0], *ids[2:]]
+
+    monkeypatch.setattr(bulk_import.employee_ids, "allocate_async", duplicate_second_id)
+    response = run_import(csv_upload([{**ROW, "employee_name": f"社員{i}"} for i in range(3)]))
+    assert [row.status for row in response.rows] == ["created", "failed", "created"]
+    assert (response.created, response.failed) == (2, 1)
+    assert "Error saving employee data" in response.rows[1].error
+
+
+def test_embedding_failure_is_reported_per_row(database_url, monkeypatch):
+    async def extract(contents):
+        return contents.decode("utf-8")
+
+    async def analyze(spec, text):
+        return f"analysis of {text}"
+
+    async def fail_embeddings(texts):
+        raise HTTPException(status_code=503, detail="OpenAI API is unavailable; please retry later")
+
+    monkeypatch.setattr(utils, "extract_text_from_pdf_async", extract)
+    monkeypatch.setattr(utils, "analyze_document_text", analyze)
+    monkeypatch.setattr(utils, "get_embeddings", fail_embeddings)
+    rows = [{**ROW, "resume_file": "resume.pdf"}, {**ROW, "resume_file": ""}]
+    response = run_import(csv_upload(rows), zip_upload({"resume.pdf": b"resume"}))
+    assert [row.status for row in response.rows] == ["failed", "created"]
+    assert response.rows[0].error == "OpenAI API is unavailable; please retry later"
+
+
+def test_row_limit_is_checked_before_importing(database_url, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BULK_MAX_ROWS", 2)
+    monkeypatch.setattr(bulk_import, "BULK_CHUNK_SIZE", 1)
+    with pytest.raises(HTTPException) as raised:
+        run_import(csv_upload([ROW] * 3))
+    assert raised.value.status_code == 413
+    assert employee_ids.current() is None
+
+
+def test_csv_and_archive_are_read_off_the_event_loop(database_url, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BULK_CHUNK_SIZE", 2)
+    threads = {"csv": set(), "archive": set()}
+    read_chunk, read = bulk_import.read_chunk, bulk_import.Archive.read
+
+    def tracked_read_chunk(rows, size):
+        threads["csv"].add(threading.get_ident())
+        return read_chunk(rows, size)
+
+    def tracked_read(self, name, max_bytes):
+        threads["archive"].add(threading.get_ident())
+        return read(self, name, max_bytes)
+
+    monkeypatch.setattr(bulk_import, "read_chunk", tracked_read_chunk)
+    monkeypatch.setattr(bulk_import.Archive, "read", tracked_read)
+    loop_thread = []
+
+    async def scenario():
+        loop_thread.append(threading.get_ident())
+        async with async_session() as db:
+            return await bulk_import.import_employees(
+                db, csv_upload([{**ROW, "employee_name": f"社員{i}"} for i in range(5)]), zip_upload({})
+            )
+
+    response = asyncio.run(scenario())
+    assert response.created == 5
+    assert threads["csv"] and threads["archive"]
+    assert loop_thread[0] not in threads["csv"] | threads["archive"]
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import utils
+from document_text import PromptBudget, chunk_text, clean_text, count_tokens, split_sections
+
+MODEL = "gpt-4o-mini"
+
+
+def resume(sections: int, sentences: int) -> str:
+    parts = []
+    for section in range(1, sections + 1):
+        body = "".join(f"案件{section}-{number}では要件定義から運用までを担当しました。" for number in range(sentences))
+        parts.append(f"【職務経歴{section}】\n{body}")
+    return "\n\n".join(parts)
+
+
+def test_clean_text_removes_headers_footers_and_rules():
+    pages = [f"職務経歴書　山田 太郎\n\n経歴{page}の本文   です。\n-----\n- {page} -" for page in range(1, 5)]
+    assert clean_text("\f".join(pages)) == "\n\n".join(f"経歴{page}の本文 です。" for page in range(1, 5))
+
+
+def test_split_sections_breaks_before_headings():
+    assert split_sections("前置き\n【職歴】\n本文\n1. 資格\n本文") == ["前置き", "【職歴】\n本文", "1. 資格\n本文"]
+
+
+def test_chunks_fit_the_budget_and_keep_the_text():
+    text = resume(6, 12)
+    chunks, dropped = chunk_text(text, 300, MODEL)
+    assert dropped == 0 and len(chunks) > 1
+    assert all(count_tokens(chunk, MODEL) <= 300 for chunk in chunks)
+    # 見出しはチャンクの途中ではなく先頭に来る
+    assert all(line.startswith("【") for chunk in chunks for line in chunk.split("\n") if "職務経歴" in line)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+
+def test_oversized_text_without_separators_is_hard_split():
+    chunks, _ = chunk_text("あ" * 1000, 300, MODEL)
+    assert all(count_tokens(chunk, MODEL) <= 300 for chunk in chunks)
+    assert "".join(chunks) == "あ" * 1000
+
+
+def test_chunks_over_max_chunks_are_dropped():
+    text = resume(6, 12)
+    chunks, _ = chunk_text(text, 300, MODEL)
+    kept, dropped = chunk_text(text, 300, MODEL, max_chunks=2)
+    assert kept == chunks[:2]
+    assert dropped == sum(count_tokens(chunk, MODEL) for chunk in chunks[2:])
+
+
+BUDGET = PromptBudget(model=MODEL, max_tokens=100, input_tokens=400, chunk_tokens=300, summary_tokens=50,
+                      max_chunks=3, summary_model=MODEL)
+SPEC = utils.DOCUMENT_SPECS["resume"]._replace(budget=BUDGET)
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    """要約の呼び出しを記録し、チャンクの先頭行を要約として返す"""
+    calls = []
+
+    async def analyze_text(system_prompt, prompt, model=utils.ANALYSIS_MODEL, max_tokens=utils.ANALYSIS_MAX_TOKENS):
+        calls.append({"prompt": prompt, "max_tokens": max_tokens})
+        if "職務経歴3" in prompt:
+            await asyncio.sleep(1)
+        return prompt.split("【", 1)[1].split("】", 1)[0]
+
+    monkeypatch.setattr(utils, "analyze_text", analyze_text)
+    return calls
+
+
+def test_short_document_is_sent_as_is(summaries):
+    text = resume(1, 3)
+    assert asyncio.run(utils.prepare_document_text(SPEC, text)) == clean_text(text)
+    assert summaries == []
+
+
+def test_long_document_is_summarized_per_chunk(summaries, monkeypatch):
+    monkeypatch.setattr(utils, "ANALYSIS_SUMMARY_TIMEOUT", 0.2)
+    chunks, _ = chunk_text(resume(6, 12), BUDGET.chunk_tokens, MODEL, BUDGET.max_chunks)
+
+    prepared = asyncio.run(utils.prepare_document_text(SPEC, resume(6, 12)))
+
+    # max_chunksまでのチャンクを並行に要約し、要約の合計が input_tokens に収まる
+    assert len(summaries) == BUDGET.max_chunks
+    assert all(call["max_tokens"] == BUDGET.summary_tokens for call in summaries)
+    sections = prepared.split("\n\n")
+    assert sections[0] == utils.SUMMARY_HEADER
+    assert sections[1:3] == ["職務経歴1", "職務経歴2"]
+    # 時間内に要約できなかったチャンクは切り詰めて使う
+    assert chunks[2].startswith(sections[3])
+    assert count_tokens(sections[3], MODEL) <= BUDGET.summary_tokens
+    assert count_tokens(prepared, MODEL) <= BUDGET.input_tokens
@@ -0,0 +1,46 @@
+import types
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import embedding
+from bench.generate_data import generate
+from database import get_engine
+from embedding_cache import EmbeddingCache
+from embedding_config import EMBEDDING_MODEL, embedding_dimensions
+from models import Employee, JobPost
+
+
+class LoopRecordingEmbeddings:
+    """embeddings.createを呼んだイベントループを記録する (AsyncOpenAIのクライアントは最初のループに結びつく)"""
+
+    def __init__(self):
+        self.loops = set()
+        self.texts = 0
+
+    async def create(self, input, model, **params):
+        self.loops.add(asyncio.get_running_loop())
+        self.texts += len(input)
+        data = [types.SimpleNamespace(index=index, embedding=[1.0] * embedding_dimensions())
+                for index in range(len(input))]
+        return types.SimpleNamespace(data=data, usage=None)
+
+
+@pytest.fixture
+def embeddings(database_url, tmp_path, monkeypatch):
+    generate(database_url, 6, 4, embedding_dimensions(), embedding_dimensions(), 4, 1000, seed=5)
+    monkeypatch.setattr(embedding, "embedding_cache", EmbeddingCache(str(tmp_path / "cache.db")))
+    fake = LoopRecordingEmbeddings()
+    monkeypatch.setattr(embedding.scheduler, "_client", types.SimpleNamespace(embeddings=fake))
+    return fake
+
+
+def test_all_runs_both_phases_on_one_event_loop(embeddings):
+    embedding.update_vectors(jobposts=True, employees=True, batch_size=2, force=True, restart=True)
+
+    assert embeddings.texts > 0
+    assert len(embeddings.loops) == 1
+    with get_engine().connect() as connection:
+        assert None not in connection.execute(select(JobPost.job_detail_hash)).scalars().all()
+        assert set(connection.execute(select(Employee.embedding_model)).scalars().all()) == {EMBEDDING_MODEL}
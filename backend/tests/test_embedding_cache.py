@@ -0,0 +1,63 @@
+import time
+import asyncio
+
+from embedding_cache import EmbeddingCache, cache_key
+
+
+def test_only_missing_texts_are_created(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), memory_items=0)
+    created = []
+
+    async def create(texts):
+        created.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    async def scenario():
+        first = await cache.get_or_create_many_async(["a", "bb", "a"], "model", create)
+        second = await cache.get_or_create_many_async(["bb", "ccc"], "model", create)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert created == ["a", "bb", "ccc"]
+    assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert second == [[2.0, 1.0], [3.0, 1.0]]
+
+
+def test_access_times_are_written_in_batches(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), memory_items=0)
+    key = cache_key("text", "model")
+    cache.put_many({key: [1.0, 0.0]}, "model")
+    (written,) = cache._connection().execute("SELECT accessed_at FROM embedding_cache").fetchone()
+
+    # 参照のたびにはcommitしない
+    assert cache.get_many([key]) == {key: [1.0, 0.0]}
+    assert key in cache._touched
+    assert not cache._connection().in_transaction
+
+    cache.put_many({cache_key("other", "model"): [0.0, 1.0]}, "model")
+    (accessed,) = cache._connection().execute(
+        "SELECT accessed_at FROM embedding_cache WHERE key = ?", (key,)
+    ).fetchone()
+    assert accessed > written
+    assert not cache._touched
+
+
+def test_memory_hits_update_access_times(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_bytes=10 ** 9)
+    hot, cold = cache_key("hot", "model"), cache_key("cold", "model")
+    cache.put_many({hot: [1.0, 0.0]}, "model")
+    time.sleep(0.01)
+    cache.put_many({cold: [0.0, 1.0]}, "model")
+    time.sleep(0.01)
+
+    # メモリのLRUで見つかった参照も、次の書き込みでファイル上の参照時刻に反映される
+    assert cache.get_many([hot]) == {hot: [1.0, 0.0]}
+    assert cache.memory_hits == 1
+    cache.put_many({cache_key("new", "model"): [1.0, 1.0]}, "model")
+
+    # 上限を超えたら、よく使われているhotではなくcoldから消す
+    # (1件12バイトなので、3件のうち1件だけ消える上限にする)
+    cache.max_bytes = 30
+    cache._evict()
+    keys = {key for (key,) in cache._connection().execute("SELECT key FROM embedding_cache")}
+    assert cold not in keys and hot in keys
@@ -0,0 +1,74 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import insert
+
+from database import get_engine
+from id_allocator import IdAllocator
+from models import Employee
+
+
+def employee_row(employee_id: str) -> dict:
+    return {
+        "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+        "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+        "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": [], "personality_detail": "",
+        "personality_vector": [], "neuroticism_score": 5, "extraversion_score": 5, "openness_score": 5,
+        "agreeableness_score": 5, "conscientiousness_score": 5, "password_hash": "",
+    }
+
+
+def allocator(block_size: int = 1) -> IdAllocator:
+    return IdAllocator("employee", "SAPPORO", 4, block_size, column=Employee.employee_id)
+
+
+def test_concurrent_allocation_has_no_duplicates(database_url):
+    # プロセスごとのインスタンスを模して、先取りの大きさの違うアロケータを同時に使う
+    allocators = [allocator(1), allocator(1), allocator(5), allocator(7)]
+
+    def allocate(i: int):
+        return allocators[i % len(allocators)].allocate(1 + i % 3)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        batches = list(pool.map(allocate, range(200)))
+
+    ids = [employee_id for batch in batches for employee_id in batch]
+    assert len(ids) == sum(1 + i % 3 for i in range(200))
+    assert len(set(ids)) == len(ids)
+    # カウンタは払い出した番号 (先取り分を含む) より後を指している
+    numbers = sorted(int(employee_id[len("SAPPORO"):]) for employee_id in ids)
+    assert numbers[0] == 1
+    assert allocators[0].current() >= numbers[-1]
+
+
+def test_counter_starts_after_the_largest_legacy_id(database_url):
+    with get_engine().begin() as connection:
+        connection.execute(insert(Employee), [
+            employee_row("SAPPORO0001"), employee_row("SAPPORO9999"), employee_row("SAPPORO0500"),
+        ])
+
+    # 文字列の最大 ("SAPPORO9999") ではなく番号の最大から始め、桁が増えても続けて払い出す
+    ids = allocator().allocate(2)
+    assert ids == ["SAPPORO10000", "SAPPORO10001"]
+    assert allocator().allocate(1) == ["SAPPORO10002"]
+
+
+def test_counter_is_seeded_once_under_concurrency(database_url):
+    with get_engine().begin() as connection:
+        connection.execute(insert(Employee), [employee_row("SAPPORO9999")])
+
+    # カウンタ行がない状態で同時に払い出しても、作成は1回だけで番号は重ならない
+    allocators = [allocator() for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(lambda a: a.allocate(1)[0], allocators))
+    assert sorted(ids) == [f"SAPPORO{10000 + i}" for i in range(8)]
+
+
+def test_sync_advances_past_ids_inserted_elsewhere(database_url):
+    ids = allocator(block_size=10)
+    assert ids.allocate(1) == ["SAPPORO0001"]
+    with get_engine().begin() as connection:
+        connection.execute(insert(Employee), [employee_row("SAPPORO0100")])
+
+    assert ids.sync() == 100
+    assert ids.allocate(1) == ["SAPPORO0101"]
@@ -0,0 +1,112 @@
+import os
+import asyncio
+import threading
+
+import job_queue as job_queue_module
+from job_queue import JobQueue
+
+
+def test_job_runs_without_blocking_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "JOB_FILES_DIR", str(tmp_path / "files"))
+    queue = JobQueue(str(tmp_path / "queue.db"), workers=0)
+    loop_thread = []
+    writer_threads = set()
+    update = queue._update
+
+    def tracked_update(job_id, **values):
+        writer_threads.add(threading.get_ident())
+        update(job_id, **values)
+
+    monkeypatch.setattr(queue, "_update", tracked_update)
+
+    @queue.handler("echo")
+    async def echo(job, on_progress):
+        await on_progress("working")
+        assert queue.get(job.job_id).progress == "working"
+        return {"value": job.payload["value"], "file": job.read_file("data").decode()}
+
+    async def scenario():
+        loop_thread.append(threading.get_ident())
+        job_id = await queue.enqueue_async("echo", {"value": 1}, files={"data": b"hello", "empty": None})
+        assert os.path.exists(os.path.join(tmp_path / "files", job_id, "data"))
+        job = await asyncio.to_thread(queue._claim)
+        await queue._run(job)
+        return await queue.get_async(job_id)
+
+    job = asyncio.run(scenario())
+    assert job.status == "succeeded"
+    assert job.result == {"value": 1, "file": "hello"}
+    assert not os.path.exists(job.files_dir)
+    # 進捗と状態の書き込みはイベントループのスレッドでは行わない
+    assert writer_threads and loop_thread[0] not in writer_threads
+
+
+def test_failed_job_is_retried_then_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "JOB_FILES_DIR", str(tmp_path / "files"))
+    monkeypatch.setattr(job_queue_module, "JOB_RETRY_BASE", 0)
+    queue = JobQueue(str(tmp_path / "queue.db"), workers=0)
+
+    @queue.handler("broken")
+    async def broken(job, on_progress):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        job_id = await queue.enqueue_async("broken", {}, files={"data": b"x"}, max_attempts=2)
+        statuses = []
+        for _ in range(2):
+            job = await asyncio.to_thread(queue._claim)
+            await queue._run(job)
+            statuses.append((await queue.get_async(job_id)).status)
+        return statuses, await queue.get_async(job_id)
+
+    statuses, job = asyncio.run(scenario())
+    assert statuses == ["queued", "failed"]
+    assert job.error == "boom"
+    assert not os.path.exists(job.files_dir)
+
+
+def test_registration_retry_after_commit_does_not_duplicate(database_url, tmp_path, monkeypatch):
+    import main
+    import utils
+    from sqlalchemy import func, select
+    from database import SessionLocal
+    from models import Employee
+
+    monkeypatch.setattr(job_queue_module, "JOB_FILES_DIR", str(tmp_path / "files"))
+    monkeypatch.setattr(job_queue_module, "JOB_RETRY_BASE", 0)
+    queue = JobQueue(str(tmp_path / "queue.db"), workers=0)
+    queue.handlers = main.job_queue.handlers
+    monkeypatch.setattr(main, "job_queue", queue)
+
+    # 社員の保存をコミットした後、レスポンスを作るところで1回だけ失敗させる
+    create_response = utils.create_employee_response
+    calls = []
+
+    def fail_once(employee, db):
+        calls.append(employee.employee_id)
+        if len(calls) == 1:
+            raise RuntimeError("response failed")
+        return create_response(employee, db)
+
+    monkeypatch.setattr(utils, "create_employee_response", fail_once)
+    payload = {
+        "employee_name": "社員", "birthdate": "1990-01-01", "gender": "その他", "academic_background": "学士",
+        "hire_date": "2024-04-01", "recruitment_type": "中途", "grade_id": 1, "department_id": 1, "jobpost_id": 1,
+        "neuroticism_score": 5, "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5,
+        "conscientiousness_score": 5, "password_hash": utils.hash_password("password"),
+    }
+
+    async def scenario():
+        job_id = await queue.enqueue_async("register_employee", payload)
+        statuses = []
+        for _ in range(2):
+            job = await asyncio.to_thread(queue._claim)
+            await queue._run(job)
+            statuses.append((await queue.get_async(job_id)).status)
+        return statuses, await queue.get_async(job_id)
+
+    statuses, job = asyncio.run(scenario())
+    assert statuses == ["queued", "succeeded"]
+    with SessionLocal() as db:
+        assert db.execute(select(func.count()).select_from(Employee)).scalar_one() == 1
+    assert calls[0] == calls[1] == job.payload["employee_id"] == job.result["employee_id"]
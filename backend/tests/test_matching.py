@@ -0,0 +1,135 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import event
+
+import matching
+from bench.generate_data import generate
+from database import SessionLocal, async_session, get_engine
+from matching import MatchingEngine
+
+DIMS = 8
+
+
+@pytest.fixture
+def employee_queries(database_url):
+    """社員ベクトルを読むクエリの回数を数え、各クエリを遅くする (callbackを入れるとクエリ中に呼ぶ)"""
+    generate(database_url, 20, 5, DIMS, DIMS, 4, 1000, seed=3)
+    state = {"count": 0, "delay": 0.2, "callback": None, "started": threading.Event()}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("SELECT employee.employee_id AS employee_employee_id, employee.career_info_vector"):
+            return
+        state["count"] += 1
+        state["started"].set()
+        if state["callback"] is not None:
+            state["callback"]()
+        time.sleep(state["delay"])
+
+    event.listen(get_engine(), "before_cursor_execute", before_cursor_execute)
+    yield state
+    event.remove(get_engine(), "before_cursor_execute", before_cursor_execute)
+
+
+def run_with_timeout(coroutine, timeout: float = 10):
+    """イベントループが止まったままになっても、テストが終わらなくならないよう別スレッドで実行する"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=asyncio.run(coroutine)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "event loop is blocked"
+    return result["value"]
+
+
+def test_concurrent_first_load_reads_once(employee_queries):
+    engine = MatchingEngine()
+    threads = [threading.Thread(target=engine.ensure_loaded) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert employee_queries["count"] == 1
+    assert engine.loaded and len(engine.employees) == 20
+
+
+def test_concurrent_first_load_through_run_sync(employee_queries):
+    engine = MatchingEngine()
+
+    async def call():
+        async with async_session() as db:
+            await db.run_sync(lambda session: engine.ensure_loaded())
+            return len(engine.employees)
+
+    async def scenario():
+        return await asyncio.gather(*[call() for _ in range(4)])
+
+    assert run_with_timeout(scenario()) == [20] * 4
+    assert employee_queries["count"] == 1
+
+
+def test_async_first_load_does_not_block_the_loop(employee_queries):
+    engine = MatchingEngine()
+
+    async def request():
+        # APIと同じく、読み込みを待ってから run_sync で照合する
+        await engine.ensure_loaded_async()
+        async with async_session() as db:
+            return await db.run_sync(lambda session: engine.top_jobposts(engine.employees.ids[0], 3))
+
+    async def ticker(ticks: list):
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        ticks = []
+        task = asyncio.create_task(ticker(ticks))
+        results = await asyncio.gather(*[request() for _ in range(4)])
+        task.cancel()
+        return results, ticks
+
+    results, ticks = run_with_timeout(scenario())
+    assert all(len(result) == 3 for result in results)
+    assert employee_queries["count"] == 1
+    # 読み込み (0.2秒) の間もループは動いている
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+
+
+def test_stale_reload_is_single_flight_and_does_not_block(employee_queries, monkeypatch):
+    engine = MatchingEngine()
+    engine.ensure_loaded()
+    monkeypatch.setattr(matching, "RELOAD_INTERVAL", 0)
+    employee_queries["count"] = 0
+    employee_queries["started"].clear()
+    employee_queries["delay"] = 1.0
+
+    # 古くなった行列の読み直しは裏で行い、呼び出し元は待たずに今の行列を使う
+    started = time.monotonic()
+    engine.ensure_loaded()
+    assert employee_queries["started"].wait(5)
+    reloading = engine._loading
+    for _ in range(4):
+        engine.ensure_loaded()
+        run_with_timeout(engine.ensure_loaded_async())
+    assert time.monotonic() - started < 0.5
+    assert engine.top_jobposts(engine.employees.ids[0], 3)
+    assert engine._loading is reloading
+    reloading.result()
+
+    assert employee_queries["count"] == 1
+
+
+def test_upsert_during_reload_is_kept(employee_queries):
+    engine = MatchingEngine()
+    engine.ensure_loaded()
+    # 読み込みのクエリの後 (行列を入れ替える前) に登録された社員
+    employee_queries["callback"] = lambda: engine.upsert_employee_vectors("NEW0001", [1.0] * DIMS, [0.5] * DIMS)
+    with SessionLocal() as db:
+        engine.load(db)
+
+    assert "NEW0001" in engine.employees.index
+    assert len(engine.employees) == 21
+    assert engine._reloading is None
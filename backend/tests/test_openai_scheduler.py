@@ -0,0 +1,49 @@
+import time
+import asyncio
+import types
+
+import httpx
+import openai
+
+import openai_scheduler
+from openai_scheduler import BATCH, INTERACTIVE, OpenAIScheduler
+
+
+def server_error() -> openai.InternalServerError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.InternalServerError("server error", response=httpx.Response(500, request=request), body=None)
+
+
+class FlakyCompletions:
+    """BATCHの1回目は5xxを返し、それ以外はすぐに応答する"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, model, messages, max_tokens, **params):
+        self.calls.append(messages[0]["content"])
+        if messages[0]["content"] == "batch" and self.calls.count("batch") == 1:
+            raise server_error()
+        await asyncio.sleep(0.01)
+        return types.SimpleNamespace(usage=None)
+
+
+def test_backoff_releases_the_concurrency_slot(monkeypatch):
+    monkeypatch.setattr(openai_scheduler, "OPENAI_RETRY_BASE", 0.5)
+    scheduler = OpenAIScheduler(concurrency=1, max_retries=2)
+    completions = FlakyCompletions()
+    scheduler.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+
+    async def scenario():
+        batch = asyncio.create_task(scheduler.chat("model", [{"role": "user", "content": "batch"}], 10, BATCH))
+        await asyncio.sleep(0.05)
+        # BATCHが再試行を待っている間に、INTERACTIVEの呼び出しが枠を取れる
+        start = time.monotonic()
+        await scheduler.chat("model", [{"role": "user", "content": "interactive"}], 10, INTERACTIVE)
+        interactive_seconds = time.monotonic() - start
+        await batch
+        return interactive_seconds
+
+    assert asyncio.run(scenario()) < 0.3
+    assert completions.calls == ["batch", "interactive", "batch"]
+    assert scheduler._active == 0
@@ -0,0 +1,95 @@
+import io
+import os
+import hashlib
+import datetime
+
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+import main
+import picture_store
+from database import SessionLocal, get_engine
+from models import Employee
+
+
+def png(color: str = "red") -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (400, 300), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+def insert_employee(employee_id: str, picture=None, picture_hash=None) -> None:
+    with get_engine().begin() as connection:
+        connection.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": [], "personality_detail": "",
+            "personality_vector": [], "neuroticism_score": 5, "extraversion_score": 5, "openness_score": 5,
+            "agreeableness_score": 5, "conscientiousness_score": 5, "password_hash": "",
+            "picture": picture, "picture_hash": picture_hash,
+        }])
+
+
+@pytest.fixture
+def client(database_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(picture_store, "PICTURE_STORE_DIR", str(tmp_path / "pictures"))
+    # lifespan (ウォームアップやジョブの実行) は起動しない
+    return TestClient(main.app)
+
+
+def test_stored_picture_and_thumbnail(client):
+    data = png()
+    picture_hash = picture_store.save_picture(data)
+    insert_employee("E1", picture_hash=picture_hash)
+
+    response = client.get("/employees/E1/picture")
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["etag"] == f'"{picture_hash}"'
+
+    thumbnail = client.get("/employees/E1/picture", params={"thumbnail": True})
+    assert thumbnail.headers["content-type"] == "image/jpeg"
+    assert max(Image.open(io.BytesIO(thumbnail.content)).size) == picture_store.PICTURE_THUMBNAIL_SIZE
+
+
+@pytest.mark.parametrize("header, status", [
+    ('"{hash}"', 304),
+    ('W/"{hash}"', 304),
+    ('"other", W/"{hash}"', 304),
+    ("*", 304),
+    ('"other"', 200),
+    ('"{hash}x"', 200),
+])
+def test_if_none_match(client, header, status):
+    data = png()
+    picture_hash = picture_store.save_picture(data)
+    insert_employee("E1", picture_hash=picture_hash)
+    response = client.get("/employees/E1/picture", headers={"If-None-Match": header.format(hash=picture_hash)})
+    assert response.status_code == status
+
+
+def test_legacy_blob_is_served_without_migrating(client, tmp_path):
+    data = png("blue")
+    insert_employee("E1", picture=data)
+
+    response = client.get("/employees/E1/picture", params={"thumbnail": True})
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-type"] == "image/png"
+    etag = f'"{hashlib.sha256(data).hexdigest()}"'
+    assert response.headers["etag"] == etag
+    assert client.get("/employees/E1/picture", headers={"If-None-Match": etag}).status_code == 304
+
+    # GETでは書き込まない (移行は migrate_pictures.py で行う)
+    assert not os.path.exists(tmp_path / "pictures")
+    with SessionLocal() as db:
+        assert db.execute(select(Employee.picture_hash).where(Employee.employee_id == "E1")).scalar_one() is None
+
+
+def test_missing_picture_is_404(client):
+    insert_employee("E1")
+    assert client.get("/employees/E1/picture").status_code == 404
+    assert client.get("/employees/E2/picture").status_code == 404
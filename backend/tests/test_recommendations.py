@@ -0,0 +1,142 @@
+import time
+import asyncio
+import datetime
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from sqlalchemy import insert, select, update
+
+from bench.generate_data import generate, random_vectors
+from database import SessionLocal
+from matching import matcher
+from models import Employee, EmployeeJobAssignment, JobPost, Recommendation
+import recommendations
+from recommendations import RecommendationStore, current_assignments, lock_for_write
+
+TOP_N = 20
+DIMS = 8
+JOBPOSTS = 12
+
+
+@pytest.fixture
+def db(database_url):
+    generate(database_url, 80, JOBPOSTS, DIMS, DIMS, 4, 1000, seed=7)
+    with SessionLocal() as db:
+        matcher.load(db)
+        yield db
+
+
+def insert_employees(db, rng: np.random.Generator, start: int, count: int) -> List[str]:
+    employee_ids = []
+    for number in range(start, start + count):
+        employee_id = f"TEST{number:04d}"
+        career, personality = random_vectors(rng, 2, DIMS)
+        db.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": career,
+            "personality_detail": "", "personality_vector": personality, "neuroticism_score": 5,
+            "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+            "password_hash": "",
+        }])
+        db.execute(insert(EmployeeJobAssignment), [{
+            "employee_id": employee_id, "jobpost_id": int(rng.integers(1, JOBPOSTS + 1)),
+            "start_date": datetime.date(2024, 4, 1),
+        }])
+        db.commit()
+        matcher.upsert_employee_vectors(employee_id, career, personality)
+        employee_ids.append(employee_id)
+    return employee_ids
+
+
+def brute_force(db, store: RecommendationStore) -> Dict[str, Dict]:
+    """全社員×全求人のスコアを1回で計算した上位N件"""
+    employee_ids = list(matcher.employees.ids)
+    jobpost_ids, scores = matcher.jobpost_scores(employee_ids, store.career_weight, store.personality_weight)
+    rows = {employee_id: i for i, employee_id in enumerate(employee_ids)}
+    columns = {jobpost_id: i for i, jobpost_id in enumerate(jobpost_ids)}
+    for employee_id, jobpost_id in current_assignments(db):
+        scores[rows[employee_id], columns[jobpost_id]] = -np.inf
+
+    def best(ids, values):
+        # 現在の配属 (-inf) は入れない
+        return [ids[i] for i in np.argsort(-values, kind="stable")[:TOP_N] if np.isfinite(values[i])]
+
+    return {
+        "employee": {employee_id: best(jobpost_ids, scores[row]) for employee_id, row in rows.items()},
+        "jobpost": {jobpost_id: best(employee_ids, scores[:, column]) for jobpost_id, column in columns.items()},
+    }
+
+
+def stored(db) -> Dict[str, Dict]:
+    lists = {"employee": {}, "jobpost": {}}
+    for owner, other, rank_column, side in (
+        (Recommendation.employee_id, Recommendation.jobpost_id, Recommendation.employee_rank, "employee"),
+        (Recommendation.jobpost_id, Recommendation.employee_id, Recommendation.jobpost_rank, "jobpost"),
+    ):
+        for key, value in db.execute(select(owner, other).where(rank_column.is_not(None))
+                                     .order_by(owner, rank_column)):
+            lists[side].setdefault(key, []).append(value)
+    return lists
+
+
+def test_incremental_updates_match_brute_force(db):
+    store = RecommendationStore(top_n=TOP_N, block_size=16)
+    store.rebuild(db)
+    assert stored(db) == brute_force(db, store)
+
+    rng = np.random.default_rng(1)
+    for employee_id in insert_employees(db, rng, 1, 10):
+        store.add_employees(db, [employee_id])
+    store.add_employees(db, insert_employees(db, rng, 11, 5))
+    assert stored(db) == brute_force(db, store)
+
+    for jobpost_id in (2, 5):
+        db.execute(update(JobPost).where(JobPost.jobpost_id == jobpost_id)
+                   .values(job_detail_vector=random_vectors(rng, 1, DIMS)[0]))
+        db.commit()
+        store.refresh_jobposts(db, [jobpost_id])
+    assert stored(db) == brute_force(db, store)
+
+
+def test_concurrent_updates_match_brute_force(db, monkeypatch):
+    # プロセスごとのストアを複数作り、同じリストを同時に更新させる (DBのロックで直列になること)
+    stores = [RecommendationStore(top_n=TOP_N, block_size=16) for _ in range(4)]
+    read_lists = RecommendationStore._read_lists
+
+    def slow_read_lists(self, *args):
+        # 読み出しから書き込みまでの間にほかの更新が割り込みやすくする
+        lists = read_lists(self, *args)
+        time.sleep(0.005)
+        return lists
+
+    monkeypatch.setattr(RecommendationStore, "_read_lists", slow_read_lists)
+    stores[0].rebuild(db)
+    employee_ids = insert_employees(db, np.random.default_rng(2), 1, 40)
+
+    async def register_all():
+        await asyncio.gather(*[
+            stores[i % len(stores)].add_employees_async([employee_id]) for i, employee_id in enumerate(employee_ids)
+        ])
+
+    asyncio.run(register_all())
+    db.expire_all()
+    assert stored(db) == brute_force(db, stores[0])
+
+
+def test_rebuild_keeps_employees_added_during_the_computation(db, monkeypatch):
+    store = RecommendationStore(top_n=TOP_N, block_size=16)
+    added = []
+
+    def register_before_write(session):
+        # 計算が終わって書き込む直前に、別の接続で登録された社員
+        if not added:
+            with SessionLocal() as other:
+                added.extend(insert_employees(other, np.random.default_rng(3), 1, 3))
+        lock_for_write(session)
+
+    monkeypatch.setattr(recommendations, "lock_for_write", register_before_write)
+    store.rebuild(db)
+    assert set(added) <= set(stored(db)["employee"])
+    assert stored(db) == brute_force(db, store)
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+import schemas
+import utils
+from database import SessionLocal, async_session, get_async_engine
+from models import Department, Grade
+
+
+@pytest.fixture
+def grade_queries(database_url, monkeypatch):
+    """テストごとに空のキャッシュを使い、gradeテーブルを読むクエリの回数を数える"""
+    monkeypatch.setattr(utils, "reference_cache", utils.ReferenceCache())
+    with SessionLocal() as db:
+        db.add_all([Grade(grade_id=1, grade_name="G1"), Grade(grade_id=2, grade_name="G2")])
+        db.commit()
+    utils.reference_cache.invalidate()
+
+    state = {"count": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT grade.grade_id"):
+            state["count"] += 1
+
+    # APIは非同期エンジンで読む
+    engine = get_async_engine().sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield state
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def client(grade_queries):
+    # lifespan (ウォームアップやジョブの実行) は起動しない
+    return TestClient(main.app)
+
+
+def test_cached_response_and_304(client, grade_queries):
+    response = client.get("/grades/")
+    assert response.status_code == 200
+    assert response.json() == [{"grade_id": 1, "grade_name": "G1"}, {"grade_id": 2, "grade_name": "G2"}]
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == f"private, max-age={utils.REFERENCE_CACHE_MAX_AGE}"
+
+    # 2回目以降はDBを読まずに返し、ETagが一致すれば本文を返さない
+    assert client.get("/grades/").headers["etag"] == etag
+    not_modified = client.get("/grades/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert client.get("/grades/", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get("/grades/", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert grade_queries["count"] == 1
+    assert utils.reference_cache.stats()["hits"] == 4
+
+
+def test_commit_invalidates_cache(client, grade_queries):
+    etag = client.get("/grades/").headers["etag"]
+
+    with SessionLocal() as db:
+        db.add(Grade(grade_id=3, grade_name="G3"))
+        db.commit()
+
+    response = client.get("/grades/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [grade["grade_name"] for grade in response.json()] == ["G1", "G2", "G3"]
+    assert response.headers["etag"] != etag
+    assert grade_queries["count"] == 2
+
+
+def test_async_session_commit_invalidates_cache(client, grade_queries):
+    client.get("/grades/")
+
+    async def rename():
+        async with async_session() as db:
+            grade = await db.get(Grade, 1)
+            grade.grade_name = "Renamed"
+            await db.commit()
+
+    asyncio.run(rename())
+    assert client.get("/grades/").json()[0]["grade_name"] == "Renamed"
+
+
+def test_rollback_and_other_tables_keep_cache(client, grade_queries):
+    client.get("/grades/")
+    version = utils.reference_cache.version
+
+    with SessionLocal() as db:
+        db.add(Grade(grade_id=3, grade_name="G3"))
+        db.flush()
+        db.rollback()
+    assert utils.reference_cache.version == version
+
+    client.get("/grades/")
+    assert grade_queries["count"] == 1
+
+
+def test_stale_load_is_not_cached(grade_queries):
+    cache = utils.reference_cache
+    version = cache.version
+    # 読み込み中に書き込みがコミットされた
+    cache.invalidate()
+    cache.put("grades", schemas.GradeResponse, [], version)
+    assert cache.get("grades") is None
+
+
+def test_empty_department_jobposts_is_404(client):
+    with SessionLocal() as db:
+        db.add(Department(department_id=1, department_name="D1", department_detail=""))
+        db.commit()
+    assert client.get("/departments/1/jobposts/").status_code == 404
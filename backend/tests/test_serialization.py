@@ -0,0 +1,80 @@
+import base64
+import datetime
+
+import numpy as np
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import main
+from database import SessionLocal
+from models import Employee
+from serialization import dumps, encode_vector
+
+CAREER = np.array([0.1, -0.25, 1.5, 3.0e-8], dtype=np.float32)
+PERSONALITY = np.array([-1.0, 0.5, 0.0, 2.0], dtype=np.float32)
+
+
+def decode_b64f32(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype="<f4")
+
+
+@pytest.fixture
+def client(database_url):
+    with SessionLocal() as db:
+        db.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": CAREER,
+            "personality_detail": "", "personality_vector": PERSONALITY, "neuroticism_score": 5,
+            "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+            "password_hash": "",
+        } for employee_id in ("E1", "E2")])
+        db.commit()
+    # lifespan (ウォームアップやジョブの実行) は起動しない
+    return TestClient(main.app)
+
+
+def test_employee_vectors_as_list(client):
+    employee = client.get("/employees/E1").json()
+    assert employee["birthdate"] == "1990-01-01"
+    # float32の値を (float32として最短の表記で) 書き出す
+    assert employee["career_info_vector"][0] == 0.1
+    np.testing.assert_array_equal(np.array(employee["career_info_vector"], dtype=np.float32), CAREER)
+    np.testing.assert_array_equal(np.array(employee["personality_vector"], dtype=np.float32), PERSONALITY)
+
+
+def test_employee_vectors_as_b64f32(client):
+    employee = client.get("/employees/E1", params={"vector_format": "b64f32"}).json()
+    np.testing.assert_array_equal(decode_b64f32(employee["career_info_vector"]), CAREER)
+    np.testing.assert_array_equal(decode_b64f32(employee["personality_vector"]), PERSONALITY)
+
+
+def test_employee_list_returns_only_requested_vectors(client):
+    response = client.get("/employees/", params={"limit": 1, "fields": "career_info_vector", "vector_format": "b64f32"})
+    assert response.status_code == 200
+    assert response.headers["x-next-cursor"] == "E1"
+    [employee] = response.json()
+    np.testing.assert_array_equal(decode_b64f32(employee["career_info_vector"]), CAREER)
+    assert "personality_vector" not in employee
+
+    [employee] = client.get("/employees/", params={"cursor": "E1"}).json()
+    assert employee["employee_id"] == "E2"
+    assert "career_info_vector" not in employee and "personality_vector" not in employee
+
+
+def test_unknown_vector_format_is_rejected(client):
+    assert client.get("/employees/E1", params={"vector_format": "b64f16"}).status_code == 422
+
+
+def test_encode_vector_is_little_endian_float32():
+    encoded = encode_vector([1.0, -2.0], "b64f32")
+    assert base64.b64decode(encoded) == np.array([1.0, -2.0], dtype="<f4").tobytes()
+    array = encode_vector([1.0, -2.0])
+    assert isinstance(array, np.ndarray) and array.dtype == np.float32
+
+
+def test_dumps_handles_numpy_and_dates():
+    content = {"date": datetime.date(2024, 4, 1), "score": np.float32(0.5), "vector": np.arange(3, dtype=np.float32)}
+    assert orjson.loads(dumps(content)) == {"date": "2024-04-01", "score": 0.5, "vector": [0.0, 1.0, 2.0]}
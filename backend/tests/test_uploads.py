@@ -0,0 +1,87 @@
+import io
+import os
+import asyncio
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from uploads import RequestSizeLimitMiddleware, UploadSpool
+
+
+def make_app(spooled: list) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware, max_bytes=1024, path_limits={"/bulk": 4096})
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        async with UploadSpool() as spool:
+            document = await spool.add(file, 100)
+            spooled.append(document.path)
+            return {"size": document.size, "sha256": document.sha256}
+
+    @app.post("/bulk")
+    async def bulk(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return app
+
+
+@pytest.fixture
+def client():
+    spooled = []
+    with TestClient(make_app(spooled)) as client:
+        client.spooled = spooled
+        yield client
+
+
+def test_file_within_limit_is_spooled_and_removed(client):
+    response = client.post("/upload", files={"file": ("a.pdf", b"x" * 100)})
+    assert response.status_code == 200
+    assert response.json()["size"] == 100
+    # リクエストが終われば一時ファイルは消える
+    assert client.spooled and not os.path.exists(client.spooled[0])
+
+
+def test_file_over_limit_is_rejected(client):
+    response = client.post("/upload", files={"file": ("a.pdf", b"x" * 101)})
+    assert response.status_code == 413
+    assert "a.pdf exceeds 100 bytes" in response.json()["detail"]
+
+
+def test_spool_removes_partial_file_on_413(tmp_path):
+    async def scenario():
+        spool = UploadSpool(str(tmp_path))
+        async with spool:
+            with pytest.raises(HTTPException) as error:
+                await spool.add(UploadFile(file=io.BytesIO(b"x" * 11), filename="big.pdf"), 10)
+            assert error.value.status_code == 413
+        return os.listdir(tmp_path)
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_request_over_content_length_limit_is_rejected(client):
+    response = client.post("/upload", files={"file": ("a.pdf", b"x" * 2048)})
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body exceeds 1024 bytes"
+
+
+def test_chunked_request_over_limit_is_rejected(client):
+    # Content-Lengthがない場合は受信したバイト数で打ち切る
+    def body():
+        for _ in range(4):
+            yield b"x" * 512
+
+    response = client.post("/upload", content=body(),
+                           headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body exceeds 1024 bytes"
+
+
+def test_path_limit_overrides_default(client):
+    response = client.post("/bulk", files={"file": ("a.csv", b"x" * 2048)})
+    assert response.status_code == 200
+    response = client.post("/bulk", files={"file": ("a.csv", b"x" * 8192)})
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body exceeds 4096 bytes"
@@ -0,0 +1,79 @@
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import event, insert
+
+from bench.generate_data import generate, random_vectors
+from database import SessionLocal, get_engine
+from embedding_config import embedding_dimensions
+from models import Employee
+from vector_index import VectorIndex
+
+
+@pytest.fixture
+def index(database_url, tmp_path):
+    generate(database_url, 200, 5, embedding_dimensions(), embedding_dimensions(), 4, 1000, seed=11)
+    return VectorIndex(str(tmp_path / "vector_index"))
+
+
+def register(employee_id: str, index: VectorIndex, seed: int) -> None:
+    """登録と同じ順序 (DBにコミットしてから追記) で社員を1人加える"""
+    career, personality = random_vectors(np.random.default_rng(seed), 2, embedding_dimensions())
+    with SessionLocal() as db:
+        db.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": career,
+            "personality_detail": "", "personality_vector": personality, "neuroticism_score": 5,
+            "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+            "password_hash": "",
+        }])
+        db.commit()
+    index.add(employee_id, career, personality)
+
+
+def test_appended_employees_survive_compaction(index):
+    assert index.compact() == 1
+    register("TEST0001", index, 1)
+    assert index.stats()["delta"] == 1
+
+    assert index.compact() == 2
+    assert index.stats() == {**index.stats(), "size": 201, "delta": 0}
+    assert index.vectors("TEST0001") is not None
+    assert index.similar("TEST0001", 5)
+
+
+def test_registrations_during_compaction_are_carried_over(index, monkeypatch):
+    assert index.compact() == 1
+    delta_position = index.delta_position
+    registered = []
+
+    def register_after_position():
+        # 追記の位置を取った直後、DBのスナップショットを読み始める前の登録
+        position = delta_position()
+        register("TEST0001", index, 1)
+        return position
+
+    def register_before_streaming(connection, cursor, statement, *args):
+        # スナップショットの件数を数えた後、中身を読み始める前の登録
+        if not registered and statement.startswith("SELECT employee.employee_id, employee.career_info_vector"):
+            registered.append("TEST0002")
+            register("TEST0002", index, 2)
+
+    monkeypatch.setattr(index, "delta_position", register_after_position)
+    event.listen(get_engine(), "before_cursor_execute", register_before_streaming)
+    try:
+        assert index.compact() == 2
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", register_before_streaming)
+    assert registered
+
+    stats = index.stats()
+    # TEST0001 はスナップショットと引き継いだ追記の両方に、TEST0002 は引き継いだ追記にだけある
+    assert stats["size"] == 201
+    assert stats["delta"] == 2
+    for employee_id in ("TEST0001", "TEST0002"):
+        vectors = index.vectors(employee_id)
+        assert vectors is not None
+        assert index.search("blend", vectors, 1)[0][0] == employee_id
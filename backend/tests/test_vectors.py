@@ -0,0 +1,116 @@
+import json
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, insert, select
+
+import migrate_vectors
+from database import SessionLocal, get_engine
+from models import Employee, Vector, pack_vector, unpack_vector
+
+VECTOR = np.linspace(-1.0, 1.0, 12, dtype=np.float32)
+
+
+@pytest.mark.parametrize("dtype, header, size, tolerance", [
+    ("float32", b"F32\x00", 4 + 12 * 4, 0),
+    ("float16", b"F16\x00", 4 + 12 * 2, 1e-3),
+    ("int8", b"I08\x00", 8 + 12, 1 / 127),
+])
+def test_vector_column_round_trip(tmp_path, dtype, header, size, tolerance):
+    table = Table("vectors", MetaData(), Column("id", Integer, primary_key=True), Column("vector", Vector(dtype)))
+    engine = create_engine(f"sqlite:///{tmp_path / 'vectors.db'}")
+    table.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(table), [{"id": 1, "vector": VECTOR.tolist()}, {"id": 2, "vector": None}])
+
+    with engine.connect() as connection:
+        raw = dict(connection.exec_driver_sql("SELECT id, vector FROM vectors").all())
+        vectors = dict(connection.execute(select(table.c.id, table.c.vector)).all())
+    engine.dispose()
+
+    # 先頭4バイトのヘッダで形式を識別する
+    assert raw[1][:4] == header and len(raw[1]) == size
+    assert vectors[1].dtype == np.float32
+    np.testing.assert_allclose(vectors[1], VECTOR, atol=tolerance)
+    assert raw[2] is None and vectors[2] is None
+
+
+def test_float32_is_decoded_without_copying():
+    data = pack_vector(VECTOR, "float32")
+    vector = unpack_vector(data)
+    assert vector.base is data
+    assert not vector.flags.writeable
+    np.testing.assert_array_equal(vector, VECTOR)
+
+
+def test_int8_zero_vector():
+    np.testing.assert_array_equal(unpack_vector(pack_vector(np.zeros(4), "int8")), np.zeros(4))
+
+
+def test_unknown_header_is_rejected():
+    with pytest.raises(ValueError):
+        unpack_vector(b"XYZ\x00" + VECTOR.tobytes())
+
+
+def insert_employee(employee_id: str, vector) -> None:
+    with SessionLocal() as db:
+        db.execute(insert(Employee), [{
+            "employee_id": employee_id, "employee_name": employee_id, "birthdate": datetime.date(1990, 1, 1),
+            "gender": "その他", "academic_background": "学士", "hire_date": datetime.date(2024, 4, 1),
+            "recruitment_type": "中途", "career_info_detail": "", "career_info_vector": vector,
+            "personality_detail": "", "personality_vector": vector, "neuroticism_score": 5,
+            "extraversion_score": 5, "openness_score": 5, "agreeableness_score": 5, "conscientiousness_score": 5,
+            "password_hash": "",
+        }])
+        db.commit()
+
+
+def set_raw(employee_id: str, value) -> None:
+    """型変換を通さずにベクトルカラムを書き換える (移行前のJSONの行を作る)"""
+    with get_engine().begin() as connection:
+        connection.exec_driver_sql(
+            "UPDATE employee SET career_info_vector = ?, personality_vector = ? WHERE employee_id = ?",
+            (value, value, employee_id),
+        )
+
+
+def raw_vectors() -> dict:
+    with get_engine().connect() as connection:
+        return dict(connection.exec_driver_sql("SELECT employee_id, career_info_vector FROM employee").all())
+
+
+def test_legacy_json_rows_are_readable(database_url):
+    insert_employee("JSON", VECTOR)
+    insert_employee("DOUBLE", VECTOR)
+    set_raw("JSON", json.dumps(VECTOR.tolist()))
+    # json.dumpsで二重にエンコードされた文字列
+    set_raw("DOUBLE", json.dumps(json.dumps(VECTOR.tolist())))
+
+    with SessionLocal() as db:
+        rows = dict(db.execute(select(Employee.employee_id, Employee.career_info_vector)).all())
+    for vector in rows.values():
+        assert vector.dtype == np.float32
+        np.testing.assert_allclose(vector, VECTOR, rtol=1e-6)
+
+
+def test_migrate_vectors_streams_and_converts(database_url, monkeypatch):
+    monkeypatch.setattr(migrate_vectors, "BATCH_SIZE", 2)
+    for number in range(5):
+        insert_employee(f"JSON{number}", VECTOR)
+        set_raw(f"JSON{number}", json.dumps(VECTOR.tolist()))
+    insert_employee("F32", VECTOR)
+    insert_employee("F16", VECTOR)
+    set_raw("F32", pack_vector(VECTOR, "float32"))
+    set_raw("F16", pack_vector(VECTOR, "float16"))
+
+    count = migrate_vectors.migrate_table(get_engine(), Employee, "employee_id", migrate_vectors.TARGETS[0][2], "float16")
+
+    # 既に指定の形式の行は書き換えない
+    assert count == 6
+    raw = raw_vectors()
+    assert all(value[:4] == b"F16\x00" for value in raw.values())
+    for value in raw.values():
+        np.testing.assert_allclose(unpack_vector(value), VECTOR, atol=1e-3)
+    # もう一度実行しても何もしない
+    assert migrate_vectors.migrate_table(get_engine(), Employee, "employee_id", ["career_info_vector"], "float16") == 0
@@ -0,0 +1,64 @@
+import os
+import time
+import asyncio
+
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+from workers import CPUPool
+
+
+def sleep_and_report(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def crash() -> None:
+    os._exit(1)
+
+
+@pytest.fixture
+def pool():
+    pool = CPUPool(workers=3, timeout=1.0)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_timeout_does_not_fail_other_tasks(pool):
+    retired = pool._current()
+
+    async def scenario():
+        return await asyncio.gather(
+            pool.run(sleep_and_report, 5), pool.run(sleep_and_report, 0.5), pool.run(sleep_and_report, 0.5),
+            return_exceptions=True,
+        )
+
+    stuck, *others = asyncio.run(scenario())
+    assert isinstance(stuck, asyncio.TimeoutError)
+    assert all(isinstance(pid, int) for pid in others)
+    assert isinstance(asyncio.run(pool.run(sleep_and_report, 0)), int)
+
+    # 切り離したプールのワーカー (止まっているタスクを含む) は終了させる
+    assert len(retired.context.processes) == 3
+    for process in retired.context.processes:
+        process.join(5)
+        assert not process.is_alive()
+
+
+def test_queued_tasks_do_not_time_out(pool):
+    # ワーカー数より多いタスクが来ても、キューで待った時間はタイムアウトに含めない
+    async def scenario():
+        return await asyncio.gather(*[pool.run(sleep_and_report, 0.4) for _ in range(9)], return_exceptions=True)
+
+    started = time.monotonic()
+    results = asyncio.run(scenario())
+    assert time.monotonic() - started > pool.timeout
+    assert all(isinstance(pid, int) for pid in results)
+    assert len(pool._pools) == 1
+
+
+def test_broken_pool_is_rebuilt(pool):
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(pool.run(crash))
+    assert isinstance(asyncio.run(pool.run(sleep_and_report, 0)), int)
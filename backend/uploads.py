@@ -0,0 +1,162 @@
+import os
+import hashlib
+import tempfile
+from typing import List, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+# アップロードを書き出す一時ディレクトリ (空ならOSの既定)
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+# 1リクエストの本文の上限。一括登録 (zipアーカイブ) だけは別の上限を使う
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+BULK_IMPORT_MAX_REQUEST_BYTES = int(os.getenv("BULK_IMPORT_MAX_REQUEST_BYTES", str(1024 * 1024 * 1024)))
+_CHUNK_BYTES = 1024 * 1024
+
+
+class SpooledFile:
+    """ディスク上に書き出したアップロードファイル
+
+    ワーカープロセスにはパスだけを渡し、中身をメモリに載せずにファイルとして読ませる。
+    sha256は書き出すときに計算しておく (ジョブのファイルなど、あとから開いた場合は必要になったときに計算する)。
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None, sha256: Optional[str] = None):
+        self.path = path
+        self.size = os.path.getsize(path) if size is None else size
+        self._sha256 = sha256
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            with open(self.path, "rb") as f:
+                self._sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+        return self._sha256
+
+    def __len__(self) -> int:
+        return self.size
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+# 書類・画像の受け渡しに使う型 (一括登録のzipから読んだものはbytesのまま)
+Document = Union[bytes, SpooledFile]
+
+
+def digest(document: Document) -> str:
+    if isinstance(document, SpooledFile):
+        return document.sha256
+    return hashlib.sha256(document).hexdigest()
+
+
+def source_of(document: Document) -> Union[bytes, str]:
+    """ワーカープロセスに渡す値 (ファイルならパス)"""
+    return document.path if isinstance(document, SpooledFile) else document
+
+
+class UploadSpool:
+    """リクエスト内のアップロードを一時ファイルに書き出し、終了時にまとめて消す
+
+        async with UploadSpool() as spool:
+            resume = await spool.add(resume_upload, PDF_MAX_BYTES)
+    """
+
+    def __init__(self, directory: Optional[str] = UPLOAD_SPOOL_DIR):
+        self.directory = directory
+        self.files: List[SpooledFile] = []
+
+    async def add(self, upload: Optional[UploadFile], max_bytes: int) -> Optional[SpooledFile]:
+        """1MBずつコピーし、max_bytesを超えたら413を返す。空のファイルはNone"""
+        if upload is None:
+            return None
+        fd, path = tempfile.mkstemp(prefix="upload-", dir=self.directory)
+        spooled = SpooledFile(path, 0)
+        self.files.append(spooled)
+        hasher = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(_CHUNK_BYTES):
+                spooled.size += len(chunk)
+                if spooled.size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{upload.filename or 'file'} exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                f.write(chunk)
+        # Starlette側の一時ファイルはここで閉じる (リクエストの終わりまで残さない)
+        await upload.close()
+        if spooled.size == 0:
+            return None
+        spooled._sha256 = hasher.hexdigest()
+        return spooled
+
+    def cleanup(self) -> None:
+        for spooled in self.files:
+            try:
+                os.remove(spooled.path)
+            except FileNotFoundError:
+                # ジョブキューに移動済み
+                pass
+        self.files = []
+
+    async def __aenter__(self) -> "UploadSpool":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.cleanup()
+
+
+class RequestTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+
+
+class RequestSizeLimitMiddleware:
+    """リクエスト本文の大きさを制限するASGIミドルウェア
+
+    Content-Lengthで先に断り、chunked転送でも受信したバイト数を数えて上限を超えた時点で打ち切る
+    (multipartの解析でディスクに書き出される量もこれで抑えられる)。
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_REQUEST_BYTES, path_limits: Optional[dict] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            error = RequestTooLarge(max_bytes)
+            await JSONResponse(status_code=error.status_code, content={"detail": error.detail})(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise RequestTooLarge(max_bytes)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except RequestTooLarge as error:
+            # FastAPIの外 (ミドルウェアなど) で読んでいた場合はここで413を返す
+            if started:
+                raise
+            await JSONResponse(status_code=error.status_code, content={"detail": error.detail})(scope, receive, send)
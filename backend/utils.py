@@ -1,253 +1,857 @@
-import chardet
-from openai import OpenAI
-from typing import Dict, Any, Tuple, Optional
-from io import BytesIO
-import json
-from fastapi import HTTPException, UploadFile
-from pdfminer.high_level import extract_text_to_fp
-from pdfminer.layout import LAParams
-from sqlalchemy.orm import Session
-import datetime
-from models import Employee, EmployeeGrade, Grade, Department, DepartmentMember, JobPost, EmployeeJobAssignment
-from schemas import EmployeeCreate, EmployeeResponse
-import logging
-import bcrypt
-import base64
-
-client = OpenAI()
-
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
-
-def extract_text_from_pdf(contents: bytes) -> str:
-    output_string = BytesIO()
-    laparams = LAParams()
-    extract_text_to_fp(BytesIO(contents), output_string, laparams=laparams)
-    return output_string.getvalue().decode()
-
-async def process_resume_file(file: UploadFile) -> Dict[str, Any]:
-    contents = await file.read()
-    text = extract_text_from_pdf(contents)
-    return process_resume(text)
-
-def process_resume(text: str) -> Dict[str, Any]:
-    prompt = f"""
-    職務経歴書を詳細に分析し、候補者の職務経歴から読み取れる強みを以下のカテゴリーに分けて日本語で具体的かつ明確に説明してください。文章から推測できる情報を活用し、それを汎用的なポータブルスキルと専門的スキルに分けて記述してください。エンベディングベクトル化に適した形式で、明確かつ簡潔に説明することを意識してください：
-
-    1. **専門的スキル**:
-       - 職種や業界に特化した技術的なスキルや知識について、具体的なスキル名、習熟度、適用された文脈や状況を含めて記述してください。
-       - 文章から推測できる他の関連スキルや技術についても言及し、具体的な事例やエピソードを用いて説明してください。
-
-    2. **汎用的なポータブルスキル**:
-       - 様々な職種や業界で応用可能な汎用的なスキルや能力について、具体的なスキル名、適用範囲、実績を記述してください。
-       - 職務経歴書から読み取れる定性的な情報を基に、候補者の持つ潜在的な強みや能力についても分析し、文章に反映させてください。
-
-    3. **主な職務内容と責任**:
-       - これまでの経歴における主要な責任と成果を具体的に記述し、それらの役割を通じて発揮されたスキルや能力についても言及してください。
-       - 特に、業務の中で得た経験や学びがどのように成果に結びついたかを、具体的な例を交えて明確に説明してください。
-
-    4. **強みと差別化要因**:
-       - 候補者の際立った特徴や、他の候補者と差別化できる点について、具体的なエピソードや実績を基に詳しく説明してください。
-       - 職務経歴書に明記されていないが、文脈から推測される強みや特徴も含め、エンベディングベクトル化に有効な情報を提供してください。
-
-    職務経歴書:
-    {text}
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたは経験豊富なキャリアコンサルタントです。書類を詳細に分析し、候補者の強みを的確に言語化することができます。"},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=500,
-    )
-
-    analysis = response.choices[0].message.content.strip()
-    embedding = get_embedding(analysis)
-
-    return {
-        "analysis": analysis,
-        "vector": embedding
-    }
-
-async def process_bigfive_file(file: UploadFile) -> Dict[str, Any]:
-    contents = await file.read()
-    text = extract_text_from_pdf(contents)
-    return process_bigfive(text)
-
-def process_bigfive(text: str) -> Dict[str, Any]:
-    prompt = f"""
-    以下のBigFive性格検査の結果を詳細に分析し、以下のカテゴリーに分けてその人の性格特性を日本語で具体的かつ明確に説明してください。文章から推測できる情報を活用し、ビジネス場面での活用方法や自己成長のためのアドバイスも含めてください。また、エンベディングベクトル化に適した形式で、明確かつ簡潔に説明することを意識してください：
-
-    1. **その人固有の強み**:
-       - 性格検査の結果から読み取れる、他の人と差別化できるその人固有の強みについて、具体的なエピソードや実績を交えて説明してください。
-       - 文章から推測される潜在的な強みについても記述し、それがビジネス場面でどのように活用できるかを説明してください。
-
-    2. **その人らしさ**:
-       - 性格検査の結果から、特にその人らしさが表れる特徴や行動パターンについて説明してください。日常や仕事での具体的な例を挙げ、それらの特徴がどのように現れるかを説明してください。
-
-    3. **行動特性**:
-       - 性格検査結果に基づき、日常生活や職場における行動特性を具体的に説明してください。特定の状況下でどのような行動を取る傾向があるかについて言及し、ビジネスでの活用方法を示唆してください。
-
-    4. **価値観**:
-       - 性格検査結果からその人の価値観を読み取り、どのような状況や仕事に対して高い価値を感じるかについて具体的に説明してください。価値観がどのように意思決定や行動に影響を与えるかについても述べてください。
-
-    5. **キャリア適性**:
-       - 性格検査の結果から、その人に適したキャリアや職種について、具体的な理由と共に説明してください。特に、どのような職場環境や役割でその人が最も能力を発揮できるかについて詳述してください。
-
-    6. **チーム内での役割**:
-       - 性格検査結果に基づき、チーム内での役割について具体的に説明してください。その人がチームにどのように貢献できるか、またどのような役割が適しているかについて、具体的なエピソードや状況を交えて説明してください。
-
-    それぞれの項目について、ビジネス場面での活用方法や自己成長のためのアドバイスも含めてください。
-
-    BigFive性格検査結果:
-    {text}
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたは経験豊富な人事コンサルタントです。BigFive性格検査の結果から人物の特徴を深く洞察し、キャリア開発やチーム編成に活用できる情報を提供することができます。"},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=500,
-    )
-
-    analysis = response.choices[0].message.content.strip()
-    embedding = get_embedding(analysis)
-
-    return {
-        "detailed_analysis": analysis,
-        "vector": embedding
-    }
-
-def get_embedding(text: str, model: str = "text-embedding-3-small") -> list[float]:
-    text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=model).data[0].embedding
-
-async def process_career_files(resume: UploadFile) -> Tuple[str, list[float]]:
-    resume_info = await process_resume_file(resume) if resume else {}
-    career_info_vector = resume_info.get('vector', [])
-    return career_info_vector
-
-async def process_personality_file(bigfive: UploadFile) -> Tuple[str, list[float]]:
-    if not bigfive:
-        return "", []
-    
-    bigfive_info = await process_bigfive_file(bigfive)
-    return bigfive_info['detailed_analysis'], bigfive_info['vector']
-
-def create_employee_id(db: Session) -> str:
-    last_employee = db.query(Employee).order_by(Employee.employee_id.desc()).first()
-    if last_employee:
-        last_id = int(last_employee.employee_id[7:])
-        new_id = f"SAPPORO{str(last_id + 1).zfill(4)}"
-    else:
-        new_id = "SAPPORO0001"
-    return new_id
-
-def save_employee_data(db: Session, employee: EmployeeCreate, career_info_detail: str, career_info_vector: list[float], 
-                       personality_detail: str, personality_vector: list[float], picture: Optional[bytes] = None) -> Employee:
-    try:
-        new_employee_id = create_employee_id(db)
-
-        new_employee = Employee(
-            employee_id=new_employee_id,
-            employee_name=employee.employee_name,
-            birthdate=employee.birthdate,
-            gender=employee.gender,
-            academic_background=employee.academic_background,
-            hire_date=employee.hire_date,
-            recruitment_type=employee.recruitment_type,
-            career_info_detail=career_info_detail,
-            career_info_vector=career_info_vector,
-            personality_detail=personality_detail,
-            personality_vector=personality_vector,
-            neuroticism_score=employee.neuroticism_score,
-            extraversion_score=employee.extraversion_score,
-            openness_score=employee.openness_score,
-            agreeableness_score=employee.agreeableness_score,
-            conscientiousness_score=employee.conscientiousness_score,
-            password_hash=hash_password(employee.password),
-            picture=picture
-        )
-
-        db.add(new_employee)
-        db.flush()
-
-        employee_grade = EmployeeGrade(
-            employee_id=new_employee_id,
-            grade_id=employee.grade_id
-        )
-        db.add(employee_grade)
-
-        department_member = DepartmentMember(
-            employee_id=new_employee_id,
-            department_id=employee.department_id
-        )
-        db.add(department_member)
-
-        job_assignment = EmployeeJobAssignment(
-            employee_id=new_employee_id,
-            jobpost_id=employee.jobpost_id,
-            start_date=employee.hire_date
-        )
-        db.add(job_assignment)
-
-        db.commit()
-        return new_employee
-
-    except Exception as e:
-        db.rollback()
-        logging.exception("Unexpected error occurred while saving employee data")
-        raise HTTPException(status_code=500, detail="Error saving employee data")
-
-
-def create_employee_response(employee: Employee, db: Session) -> EmployeeResponse:
-    grade = db.query(Grade).join(EmployeeGrade).filter(EmployeeGrade.employee_id == employee.employee_id).first()
-    department = db.query(Department).join(DepartmentMember).filter(DepartmentMember.employee_id == employee.employee_id).first()
-
-    picture_base64 = base64.b64encode(employee.picture).decode('utf-8') if employee.picture else None
-
-    return EmployeeResponse(
-        employee_id=employee.employee_id,
-        employee_name=employee.employee_name,
-        birthdate=employee.birthdate,
-        gender=employee.gender,
-        academic_background=employee.academic_background,
-        hire_date=employee.hire_date,
-        recruitment_type=employee.recruitment_type,
-        grade_name=grade.grade_name if grade else None,
-        department_name=department.department_name if department else None,
-        neuroticism_score=employee.neuroticism_score,
-        extraversion_score=employee.extraversion_score,
-        openness_score=employee.openness_score,
-        agreeableness_score=employee.agreeableness_score,
-        conscientiousness_score=employee.conscientiousness_score,
-        career_info_detail=employee.career_info_detail,
-        career_info_vector=employee.career_info_vector,
-        personality_detail=employee.personality_detail,
-        personality_vector=employee.personality_vector,
-        picture=picture_base64
-    )
-
-def get_departments(db: Session):
-    return db.query(Department).all()
-
-def get_grades(db: Session):
-    return db.query(Grade).all()
-
-def get_jobposts(db: Session):
-    return db.query(JobPost).all()
-
-def get_jobposts_by_department(db: Session, department_id: int):
-    return db.query(JobPost).filter(JobPost.department_id == department_id).all()
-
-def get_employees(db: Session):
-    return db.query(Employee).all()
-
-def get_employee_by_id(db: Session, employee_id: str):
-    return db.query(Employee).filter(Employee.employee_id == employee_id).first()
\ No newline at end of file
+import os
+import asyncio
+import chardet
+from typing import Awaitable, Dict, Any, List, NamedTuple, Tuple, Optional, Sequence, Callable, Union
+from io import BytesIO, StringIO
+import json
+import hashlib
+from textwrap import dedent
+from fastapi import HTTPException, UploadFile
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload, defer
+from sqlalchemy.ext.asyncio import AsyncSession
+import datetime
+from models import (Employee, EmployeeGrade, Grade, Department, DepartmentMember, JobPost, EmployeeJobAssignment,
+                    Recommendation)
+from schemas import EmployeeCreate, EmployeeResponse, CandidateResponse, JobPostMatchResponse
+from matching import matcher
+from vector_index import vector_index
+from recommendations import recommendations
+from id_allocator import employee_ids
+from workers import cpu_pool
+from embedding_cache import embedding_cache
+from analysis_cache import analysis_cache, document_key
+from picture_store import save_picture, picture_path, picture_url, PICTURE_MAX_BYTES
+from uploads import Document, SpooledFile, UploadSpool, source_of
+from serialization import encode_vector
+from metrics import timed
+from openai_scheduler import scheduler
+from embedding_config import EMBEDDING_MODEL, embedding_dimensions, embedding_space, request_dimensions
+from document_text import PromptBudget, chunk_text, clean_text, count_tokens, truncate_tokens
+import logging
+import bcrypt
+import numpy as np
+import time
+import threading
+from pydantic import TypeAdapter
+
+# パスワードハッシュのコスト (bcryptのデフォルトは12)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# PDFのサイズ・ページ数の上限と、レイアウト解析を行うかどうか
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "30"))
+PDF_LAYOUT_ANALYSIS = os.getenv("PDF_LAYOUT_ANALYSIS", "false").lower() == "true"
+# プロンプトに入れるのに十分なテキストが取れたら、残りのページは読まない (0なら全ページ)
+PDF_MAX_TEXT_CHARS = int(os.getenv("PDF_MAX_TEXT_CHARS", "50000"))
+
+# 参照データ (グレード・部署・求人) のキャッシュ。TTLは別プロセスでの更新を拾うための上限
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+REFERENCE_CACHE_MAX_AGE = int(os.getenv("REFERENCE_CACHE_MAX_AGE", "60"))
+REFERENCE_MODELS = (Grade, Department, JobPost)
+
+# 書類解析に使うモデルとプロンプト (変更すると解析キャッシュのバージョンも変わる)
+ANALYSIS_MODEL = "gpt-4o-mini"
+ANALYSIS_MAX_TOKENS = 500
+# 書類の種類ごとのトークン数の予算 (RESUME_INPUT_TOKENS などの環境変数で変えられる)。
+# input_tokensを超える書類は見出しごとのチャンクに分け、並行に要約してから解析する
+RESUME_BUDGET = PromptBudget.from_env(
+    "RESUME", model=ANALYSIS_MODEL, max_tokens=ANALYSIS_MAX_TOKENS, input_tokens=12000,
+    chunk_tokens=3000, summary_tokens=150, max_chunks=5,
+)
+BIGFIVE_BUDGET = PromptBudget.from_env(
+    "BIGFIVE", model=ANALYSIS_MODEL, max_tokens=ANALYSIS_MAX_TOKENS, input_tokens=6000,
+    chunk_tokens=3000, summary_tokens=150, max_chunks=3,
+)
+# 要約1件を待つ上限。超えたらそのチャンクは要約せず先頭を切り詰めて使う
+ANALYSIS_SUMMARY_TIMEOUT = float(os.getenv("ANALYSIS_SUMMARY_TIMEOUT", "30"))
+
+RESUME_SYSTEM_PROMPT = "あなたは経験豊富なキャリアコンサルタントです。書類を詳細に分析し、候補者の強みを的確に言語化することができます。"
+RESUME_PROMPT = """
+    職務経歴書を詳細に分析し、候補者の職務経歴から読み取れる強みを以下のカテゴリーに分けて日本語で具体的かつ明確に説明してください。文章から推測できる情報を活用し、それを汎用的なポータブルスキルと専門的スキルに分けて記述してください。エンベディングベクトル化に適した形式で、明確かつ簡潔に説明することを意識してください：
+
+    1. **専門的スキル**:
+       - 職種や業界に特化した技術的なスキルや知識について、具体的なスキル名、習熟度、適用された文脈や状況を含めて記述してください。
+       - 文章から推測できる他の関連スキルや技術についても言及し、具体的な事例やエピソードを用いて説明してください。
+
+    2. **汎用的なポータブルスキル**:
+       - 様々な職種や業界で応用可能な汎用的なスキルや能力について、具体的なスキル名、適用範囲、実績を記述してください。
+       - 職務経歴書から読み取れる定性的な情報を基に、候補者の持つ潜在的な強みや能力についても分析し、文章に反映させてください。
+
+    3. **主な職務内容と責任**:
+       - これまでの経歴における主要な責任と成果を具体的に記述し、それらの役割を通じて発揮されたスキルや能力についても言及してください。
+       - 特に、業務の中で得た経験や学びがどのように成果に結びついたかを、具体的な例を交えて明確に説明してください。
+
+    4. **強みと差別化要因**:
+       - 候補者の際立った特徴や、他の候補者と差別化できる点について、具体的なエピソードや実績を基に詳しく説明してください。
+       - 職務経歴書に明記されていないが、文脈から推測される強みや特徴も含め、エンベディングベクトル化に有効な情報を提供してください。
+
+    職務経歴書:
+    {text}
+    """
+
+BIGFIVE_SYSTEM_PROMPT = "あなたは経験豊富な人事コンサルタントです。BigFive性格検査の結果から人物の特徴を深く洞察し、キャリア開発やチーム編成に活用できる情報を提供することができます。"
+BIGFIVE_PROMPT = """
+    以下のBigFive性格検査の結果を詳細に分析し、以下のカテゴリーに分けてその人の性格特性を日本語で具体的かつ明確に説明してください。文章から推測できる情報を活用し、ビジネス場面での活用方法や自己成長のためのアドバイスも含めてください。また、エンベディングベクトル化に適した形式で、明確かつ簡潔に説明することを意識してください：
+
+    1. **その人固有の強み**:
+       - 性格検査の結果から読み取れる、他の人と差別化できるその人固有の強みについて、具体的なエピソードや実績を交えて説明してください。
+       - 文章から推測される潜在的な強みについても記述し、それがビジネス場面でどのように活用できるかを説明してください。
+
+    2. **その人らしさ**:
+       - 性格検査の結果から、特にその人らしさが表れる特徴や行動パターンについて説明してください。日常や仕事での具体的な例を挙げ、それらの特徴がどのように現れるかを説明してください。
+
+    3. **行動特性**:
+       - 性格検査結果に基づき、日常生活や職場における行動特性を具体的に説明してください。特定の状況下でどのような行動を取る傾向があるかについて言及し、ビジネスでの活用方法を示唆してください。
+
+    4. **価値観**:
+       - 性格検査結果からその人の価値観を読み取り、どのような状況や仕事に対して高い価値を感じるかについて具体的に説明してください。価値観がどのように意思決定や行動に影響を与えるかについても述べてください。
+
+    5. **キャリア適性**:
+       - 性格検査の結果から、その人に適したキャリアや職種について、具体的な理由と共に説明してください。特に、どのような職場環境や役割でその人が最も能力を発揮できるかについて詳述してください。
+
+    6. **チーム内での役割**:
+       - 性格検査結果に基づき、チーム内での役割について具体的に説明してください。その人がチームにどのように貢献できるか、またどのような役割が適しているかについて、具体的なエピソードや状況を交えて説明してください。
+
+    それぞれの項目について、ビジネス場面での活用方法や自己成長のためのアドバイスも含めてください。
+
+    BigFive性格検査結果:
+    {text}
+    """
+
+# 長い書類のチャンクごとの要約 (map) に使うプロンプト。解析 (reduce) には要約をつなげたものを渡す
+SUMMARY_SYSTEM_PROMPT = "あなたは書類から事実を正確に抜き出すアシスタントです。推測や評価は加えません。"
+RESUME_SUMMARY_PROMPT = """
+    以下は職務経歴書の一部です。職務・役割・期間・使用した技術や手法・成果 (数値を含む)・資格などの事実を、
+    漏れなく簡潔な箇条書きで日本語で抜き出してください。
+
+    職務経歴書の一部:
+    {text}
+    """
+BIGFIVE_SUMMARY_PROMPT = """
+    以下はBigFive性格検査結果の一部です。各因子・下位尺度のスコアと、性格特性についての記述を、
+    漏れなく簡潔な箇条書きで日本語で抜き出してください。
+
+    BigFive性格検査結果の一部:
+    {text}
+    """
+SUMMARY_HEADER = "(長い書類のため、書類の各部分から抜き出した要点を順に並べています)"
+
+
+class DocumentSpec(NamedTuple):
+    system_prompt: str
+    prompt: str
+    summary_prompt: str
+    # 解析結果のキー
+    result_key: str
+    budget: PromptBudget
+
+
+# プロンプトの行頭のインデントは送らない
+DOCUMENT_SPECS = {
+    "resume": DocumentSpec(RESUME_SYSTEM_PROMPT, dedent(RESUME_PROMPT).strip(), dedent(RESUME_SUMMARY_PROMPT).strip(),
+                           "analysis", RESUME_BUDGET),
+    "bigfive": DocumentSpec(BIGFIVE_SYSTEM_PROMPT, dedent(BIGFIVE_PROMPT).strip(), dedent(BIGFIVE_SUMMARY_PROMPT).strip(),
+                            "detailed_analysis", BIGFIVE_BUDGET),
+}
+
+def prompt_version(spec: DocumentSpec) -> str:
+    # プロンプト・モデル・予算の組み合わせごとに変わるバージョン文字列
+    source = "\n".join([*map(str, spec.budget), EMBEDDING_MODEL, str(embedding_dimensions()), spec.system_prompt,
+                        spec.prompt, SUMMARY_SYSTEM_PROMPT, spec.summary_prompt])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+def hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed_password.decode('utf-8')
+
+def iter_pdf_pages(fp, layout: bool = True, max_pages: int = 0):
+    """PDFのテキストを1ページずつ返すジェネレータ (途中でやめれば残りのページは解析しない)"""
+    # layout=Falseならレイアウト解析を省略してテキストだけを高速に取り出す
+    resource_manager = PDFResourceManager(caching=True)
+    output = StringIO()
+    device = TextConverter(resource_manager, output, laparams=LAParams() if layout else None)
+    try:
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        for page in PDFPage.get_pages(fp, maxpages=max_pages):
+            interpreter.process_page(page)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    finally:
+        device.close()
+
+def extract_text_from_pdf(source, layout: bool = True, max_pages: int = 0, max_chars: int = 0) -> str:
+    # sourceはファイルのパス (アップロードを書き出したもの) かbytes (zip内のファイル)。
+    # パスならpdfminerはファイルから必要な部分だけを読む
+    pages = []
+    length = 0
+    with (open(source, "rb") if isinstance(source, str) else BytesIO(source)) as fp:
+        for text in iter_pdf_pages(fp, layout, max_pages):
+            pages.append(text)
+            length += len(text)
+            if max_chars and length >= max_chars:
+                break
+    text = "".join(pages)
+    return text[:max_chars] if max_chars else text
+
+@timed("extract_text_from_pdf")
+async def extract_text_from_pdf_async(contents: Document) -> str:
+    if len(contents) > PDF_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"PDF exceeds {PDF_MAX_BYTES} bytes")
+    try:
+        return await cpu_pool.run(
+            extract_text_from_pdf, source_of(contents), PDF_LAYOUT_ANALYSIS, PDF_MAX_PAGES, PDF_MAX_TEXT_CHARS
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out extracting text from PDF")
+
+@timed("hash_password")
+async def hash_password_async(password: str) -> str:
+    return await cpu_pool.run(hash_password, password)
+
+async def save_picture_async(data: Document) -> str:
+    # サムネイル生成はCPU処理なのでワーカープロセスで行う (ファイルならパスだけを渡す)
+    if len(data) > PICTURE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Picture exceeds {PICTURE_MAX_BYTES} bytes")
+    if isinstance(data, SpooledFile):
+        return await cpu_pool.run(save_picture, data.path, data.sha256)
+    return await cpu_pool.run(save_picture, data)
+
+def get_picture(db: Session, employee_id: str, thumbnail: bool = False) -> Optional[Union[str, bytes]]:
+    """画像ストアのファイルのパス。移行前のBLOBしかなければその中身 (サムネイルはないので元の画像)
+
+    BLOBのストアへの移動は migrate_pictures.py で行う (GETのたびに書き込まないように)。
+    """
+    row = db.query(Employee.picture_hash).filter(Employee.employee_id == employee_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    picture_hash = row[0]
+    if picture_hash is None:
+        return db.query(Employee.picture).filter(Employee.employee_id == employee_id).scalar() or None
+
+    path = picture_path(picture_hash, thumbnail)
+    if thumbnail and not os.path.exists(path):
+        path = picture_path(picture_hash)
+    return path if os.path.exists(path) else None
+
+async def analyze_document(contents: Document, kind: str, version: str, analyze) -> Dict[str, Any]:
+    # 同じファイル・同じプロンプトの解析結果があればPDF抽出もLLM呼び出しも省略する
+    key = document_key(contents, kind, version)
+    cached = await analysis_cache.get_async(key)
+    if cached is not None:
+        return cached["result"]
+
+    text = await extract_text_from_pdf_async(contents)
+    result = await analyze(text)
+    await analysis_cache.put_async(key, text, result)
+    return result
+
+async def process_resume_contents(contents: Document) -> Dict[str, Any]:
+    return await analyze_document(
+        contents, "resume", prompt_version(document_spec("resume")), process_resume
+    )
+
+async def process_resume_file(file: UploadFile) -> Dict[str, Any]:
+    async with UploadSpool() as spool:
+        return await process_resume_contents(await spool_document(spool, file))
+
+@timed("process_resume")
+async def process_resume(text: str) -> Dict[str, Any]:
+    analysis = await analyze_document_text(document_spec("resume"), text)
+    embedding = await get_embedding(analysis)
+
+    return {
+        "analysis": analysis,
+        "vector": embedding
+    }
+
+async def process_bigfive_contents(contents: Document) -> Dict[str, Any]:
+    return await analyze_document(
+        contents, "bigfive", prompt_version(document_spec("bigfive")), process_bigfive
+    )
+
+async def process_bigfive_file(file: UploadFile) -> Dict[str, Any]:
+    async with UploadSpool() as spool:
+        return await process_bigfive_contents(await spool_document(spool, file))
+
+async def spool_document(spool: UploadSpool, file: UploadFile) -> SpooledFile:
+    document = await spool.add(file, PDF_MAX_BYTES)
+    if document is None:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    return document
+
+@timed("process_bigfive")
+async def process_bigfive(text: str) -> Dict[str, Any]:
+    analysis = await analyze_document_text(document_spec("bigfive"), text)
+    embedding = await get_embedding(analysis)
+
+    return {
+        "detailed_analysis": analysis,
+        "vector": embedding
+    }
+
+@timed("chat_completion")
+async def analyze_text(system_prompt: str, prompt: str, model: str = ANALYSIS_MODEL,
+                       max_tokens: int = ANALYSIS_MAX_TOKENS) -> str:
+    # 送信の順序・レート制限・再試行はスケジューラが行う
+    response = await scheduler.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content.strip()
+
+async def analyze_document_text(spec: DocumentSpec, text: str) -> str:
+    budget = spec.budget
+    prepared = await prepare_document_text(spec, text)
+    return await analyze_text(spec.system_prompt, spec.prompt.format(text=prepared), budget.model, budget.max_tokens)
+
+@timed("prepare_document_text")
+async def prepare_document_text(spec: DocumentSpec, text: str) -> str:
+    """書類のテキストを予算内に収める
+
+    空白やヘッダー・フッターを除いても input_tokens を超える場合は、見出しの区切りでチャンクに分けて
+    チャンクごとの要約を並行に作り、それをつなげたものを返す (待ち時間は要約1回分 + 解析1回分)。
+    """
+    budget = spec.budget
+    text = clean_text(text)
+    if count_tokens(text, budget.model) <= budget.input_tokens:
+        return text
+
+    chunks, dropped = chunk_text(text, budget.chunk_tokens, budget.summary_model, budget.max_chunks)
+    if dropped:
+        logging.warning(f"Document exceeds {budget.max_chunks} chunks of {budget.chunk_tokens} tokens; "
+                        f"ignoring the last {dropped} tokens")
+    # 要約をつなげたものが input_tokens に収まるようにする
+    summary_tokens = min(budget.summary_tokens, budget.input_tokens // len(chunks))
+    summaries = await asyncio.gather(*[summarize_chunk(spec, chunk, summary_tokens) for chunk in chunks])
+    return "\n\n".join([SUMMARY_HEADER, *summaries])
+
+async def summarize_chunk(spec: DocumentSpec, chunk: str, max_tokens: int) -> str:
+    try:
+        return await asyncio.wait_for(
+            analyze_text(SUMMARY_SYSTEM_PROMPT, spec.summary_prompt.format(text=chunk), spec.budget.summary_model,
+                         max_tokens),
+            ANALYSIS_SUMMARY_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        logging.warning(f"Chunk summary timed out after {ANALYSIS_SUMMARY_TIMEOUT}s; using the truncated chunk")
+        return truncate_tokens(chunk, max_tokens, spec.budget.model)
+
+@timed("get_embedding")
+async def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> list[float]:
+    # 同じテキストは再度APIを呼ばずキャッシュから返す (改行の置換はキャッシュ側で行う)
+    # 同時に来た呼び出しはスケジューラが1回のリクエストにまとめる
+    dimensions = request_dimensions(model)
+
+    async def create(normalized: str) -> list[float]:
+        return await scheduler.embed_one(normalized, model, dimensions)
+
+    return await embedding_cache.get_or_create_async(text, model, create, dimensions)
+
+@timed("get_embeddings")
+async def get_embeddings(texts: list[str], model: str = EMBEDDING_MODEL) -> list[list[float]]:
+    # 複数テキストを1回のAPI呼び出しでまとめて変換する (キャッシュ済みのものは送らない)
+    dimensions = request_dimensions(model)
+
+    async def create(normalized_texts: list[str]) -> list[list[float]]:
+        return await scheduler.embed(normalized_texts, model, dimensions)
+
+    return await embedding_cache.get_or_create_many_async(texts, model, create, dimensions)
+
+def document_spec(kind: str) -> DocumentSpec:
+    if kind not in DOCUMENT_SPECS:
+        raise ValueError(f"Unknown document kind: {kind}")
+    return DOCUMENT_SPECS[kind]
+
+async def analyze_documents(kind: str, documents: list[bytes], batch_size: int = 100) -> list[Any]:
+    """複数の書類をまとめて解析する。LLM呼び出しは並行に行い、Embeddingはまとめて1回で取得する
+
+    解析に失敗した書類は、結果のリストの該当位置に例外オブジェクトが入る。
+    """
+    spec = document_spec(kind)
+    version = prompt_version(spec)
+    keys = [document_key(contents, kind, version) for contents in documents]
+
+    results: list[Optional[Dict[str, Any]]] = []
+    for key in keys:
+        cached = await analysis_cache.get_async(key)
+        results.append(cached["result"] if cached is not None else None)
+
+    async def analyze(contents: bytes) -> Tuple[str, str]:
+        text = await extract_text_from_pdf_async(contents)
+        return text, await analyze_document_text(spec, text)
+
+    # 同じ書類が複数含まれていても解析は1回だけ行う
+    first_index: Dict[str, int] = {}
+    for i, key in enumerate(keys):
+        first_index.setdefault(key, i)
+    pending = [i for i, result in enumerate(results) if result is None and first_index[keys[i]] == i]
+    analyzed = await asyncio.gather(*[analyze(documents[i]) for i in pending], return_exceptions=True)
+    succeeded = []
+    for i, outcome in zip(pending, analyzed):
+        if isinstance(outcome, Exception):
+            results[i] = outcome
+        else:
+            succeeded.append((i, outcome))
+    for start in range(0, len(succeeded), batch_size):
+        chunk = succeeded[start:start + batch_size]
+        try:
+            vectors = await get_embeddings([analysis for _, (_, analysis) in chunk])
+        except Exception as e:
+            # Embeddingの失敗もその書類の失敗として返す (ほかのバッチの結果は使う)
+            for i, _ in chunk:
+                results[i] = e
+            continue
+        for (i, (text, analysis)), vector in zip(chunk, vectors):
+            results[i] = {spec.result_key: analysis, "vector": vector}
+            await analysis_cache.put_async(keys[i], text, results[i])
+    return [results[first_index[key]] for key in keys]
+
+async def process_career_contents(resume: Optional[Document]) -> Tuple[str, list[float]]:
+    resume_info = await process_resume_contents(resume) if resume else {}
+    return resume_info.get('analysis', ""), resume_info.get('vector', [])
+
+async def process_personality_contents(bigfive: Optional[Document]) -> Tuple[str, list[float]]:
+    if not bigfive:
+        return "", []
+    
+    bigfive_info = await process_bigfive_contents(bigfive)
+    return bigfive_info['detailed_analysis'], bigfive_info['vector']
+
+async def register_employee(db: AsyncSession, employee: EmployeeCreate, resume: Optional[Document],
+                            bigfive: Optional[Document], picture: Optional[Document], password_hash: Optional[str] = None,
+                            on_progress: Optional[Callable[[str], Awaitable[None]]] = None,
+                            employee_id: Optional[str] = None) -> Employee:
+    """書類の解析から社員データの保存までの登録処理 (同期APIとジョブキューの両方から使う)
+
+    ジョブキューからは、再試行でも同じIDになるよう払い出し済みのemployee_idを渡す。
+    """
+    if on_progress:
+        await on_progress("analyzing")
+    # 職務経歴書とBigFiveの解析は互いに独立しているので並行して実行
+    (career_info_detail, career_info_vector), (personality_detail, personality_vector), password_hash = await asyncio.gather(
+        process_career_contents(resume),
+        process_personality_contents(bigfive),
+        hash_password_async(employee.password) if password_hash is None else asyncio.sleep(0, result=password_hash),
+    )
+    picture_hash = await save_picture_async(picture) if picture else None
+
+    if on_progress:
+        await on_progress("saving")
+    # IDはカウンタテーブルから払い出すので、同時に登録しても重複しない (登録を直列にする必要はない)
+    employee_id = employee_id or (await employee_ids.allocate_async(1))[0]
+    new_employee = await db.run_sync(
+        save_employee_data,
+        employee=employee,
+        career_info_detail=career_info_detail,
+        career_info_vector=career_info_vector,
+        personality_detail=personality_detail,
+        personality_vector=personality_vector,
+        password_hash=password_hash,
+        picture_hash=picture_hash,
+        employee_id=employee_id
+    )
+    await index_employees([(new_employee.employee_id, career_info_vector, personality_vector)])
+    return new_employee
+
+@timed("save_employee_data")
+def save_employee_data(db: Session, employee: EmployeeCreate, career_info_detail: str, career_info_vector: list[float], 
+                       personality_detail: str, personality_vector: list[float],
+                       password_hash: Optional[str] = None, picture_hash: Optional[str] = None,
+                       employee_id: Optional[str] = None) -> Employee:
+    try:
+        new_employee_id = employee_id or employee_ids.allocate(1)[0]
+
+        new_employee = Employee(
+            employee_id=new_employee_id,
+            employee_name=employee.employee_name,
+            birthdate=employee.birthdate,
+            gender=employee.gender,
+            academic_background=employee.academic_background,
+            hire_date=employee.hire_date,
+            recruitment_type=employee.recruitment_type,
+            career_info_detail=career_info_detail,
+            career_info_vector=career_info_vector,
+            personality_detail=personality_detail,
+            personality_vector=personality_vector,
+            neuroticism_score=employee.neuroticism_score,
+            extraversion_score=employee.extraversion_score,
+            openness_score=employee.openness_score,
+            agreeableness_score=employee.agreeableness_score,
+            conscientiousness_score=employee.conscientiousness_score,
+            password_hash=password_hash or hash_password(employee.password),
+            picture_hash=picture_hash,
+            **embedding_space()
+        )
+
+        db.add(new_employee)
+        db.flush()
+
+        employee_grade = EmployeeGrade(
+            employee_id=new_employee_id,
+            grade_id=employee.grade_id
+        )
+        db.add(employee_grade)
+
+        department_member = DepartmentMember(
+            employee_id=new_employee_id,
+            department_id=employee.department_id
+        )
+        db.add(department_member)
+
+        job_assignment = EmployeeJobAssignment(
+            employee_id=new_employee_id,
+            jobpost_id=employee.jobpost_id,
+            start_date=employee.hire_date
+        )
+        db.add(job_assignment)
+
+        db.commit()
+
+    except Exception as e:
+        db.rollback()
+        logging.exception("Unexpected error occurred while saving employee data")
+        raise HTTPException(status_code=500, detail="Error saving employee data")
+
+    return new_employee
+
+def _index_employees(employees: List[Tuple[str, list, list]]) -> None:
+    for employee_id, career_info_vector, personality_vector in employees:
+        try:
+            matcher.upsert_employee_vectors(employee_id, career_info_vector, personality_vector)
+        except Exception:
+            logging.exception("Failed to update matching engine")
+        try:
+            # ほかのプロセスが作り直し中ならファイルロックを待つので、イベントループの外で行う
+            vector_index.add(employee_id, career_info_vector, personality_vector)
+        except Exception:
+            logging.exception("Failed to update vector index")
+
+async def index_employees(employees: List[Tuple[str, list, list]]) -> None:
+    """コミット済みの社員 (ID, 職務経歴ベクトル, 性格ベクトル) をマッチングの行列・ベクトルインデックス・おすすめに反映する
+
+    登録のトランザクションとは別に、イベントループの外で行う (失敗しても登録自体は成功扱い)。
+    """
+    if not employees:
+        return
+    await asyncio.to_thread(_index_employees, employees)
+    try:
+        await recommendations.add_employees_async([employee_id for employee_id, _, _ in employees])
+    except Exception:
+        logging.exception("Failed to update recommendations")
+
+
+# 社員の関連(等級・部署)を1回のクエリでまとめて読み込むためのオプション
+EMPLOYEE_RELATION_OPTIONS = (
+    selectinload(Employee.grades).joinedload(EmployeeGrade.grade),
+    selectinload(Employee.departments).joinedload(DepartmentMember.department),
+)
+
+def current_grade(employee: Employee) -> Optional[Grade]:
+    # 複数ある場合は最後に登録されたものを現在の等級とする
+    if not employee.grades:
+        return None
+    return max(employee.grades, key=lambda employee_grade: employee_grade.employeegrade_id).grade
+
+def current_department(employee: Employee) -> Optional[Department]:
+    if not employee.departments:
+        return None
+    return max(employee.departments, key=lambda member: member.departmentmember_id).department
+
+# 一覧ではfields=で指定されたときだけ返す重いカラム
+EMPLOYEE_OPTIONAL_FIELDS = ("career_info_vector", "personality_vector")
+
+def parse_employee_fields(fields: Optional[str]) -> set[str]:
+    if not fields:
+        return set()
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(EMPLOYEE_OPTIONAL_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested
+
+def create_employee_response(employee: Employee, db: Session,
+                             fields: Sequence[str] = EMPLOYEE_OPTIONAL_FIELDS,
+                             vector_format: str = "list") -> EmployeeResponse:
+    # 関連が読み込み済みならクエリは発行されない (未読み込みなら遅延ロードされる)
+    grade = current_grade(employee)
+    department = current_department(employee)
+
+    # fieldsに含まれないカラムは遅延ロードを避けるため参照しない
+    # (登録直後はDBから読み直さないので、ベクトルがlistのままの場合もある)
+    optional = {}
+    if "career_info_vector" in fields:
+        optional["career_info_vector"] = encode_vector(employee.career_info_vector, vector_format)
+    if "personality_vector" in fields:
+        optional["personality_vector"] = encode_vector(employee.personality_vector, vector_format)
+
+    # DBから読んだ値なので検証を省略する (ベクトルはndarrayのままserialization.dumpsで書き出す)
+    return EmployeeResponse.model_construct(
+        employee_id=employee.employee_id,
+        employee_name=employee.employee_name,
+        birthdate=employee.birthdate,
+        gender=employee.gender,
+        academic_background=employee.academic_background,
+        hire_date=employee.hire_date,
+        recruitment_type=employee.recruitment_type,
+        grade_name=grade.grade_name if grade else None,
+        department_name=department.department_name if department else None,
+        neuroticism_score=employee.neuroticism_score,
+        extraversion_score=employee.extraversion_score,
+        openness_score=employee.openness_score,
+        agreeableness_score=employee.agreeableness_score,
+        conscientiousness_score=employee.conscientiousness_score,
+        career_info_detail=employee.career_info_detail,
+        personality_detail=employee.personality_detail,
+        picture_hash=employee.picture_hash,
+        picture_url=picture_url(employee.employee_id, employee.picture_hash),
+        **optional
+    )
+
+def create_employee_responses(employees: list[Employee],
+                              fields: Sequence[str] = EMPLOYEE_OPTIONAL_FIELDS,
+                              vector_format: str = "list") -> list[EmployeeResponse]:
+    """EMPLOYEE_RELATION_OPTIONSで読み込んだ社員のリストをまとめてレスポンスに変換する"""
+    return [create_employee_response(employee, None, fields, vector_format) for employee in employees]
+
+def get_departments(db: Session):
+    return db.query(Department.department_id, Department.department_name).all()
+
+def get_grades(db: Session):
+    return db.query(Grade.grade_id, Grade.grade_name).all()
+
+def get_jobposts(db: Session):
+    # job_detail_vectorなどの重いカラムは読まず、レスポンスに必要な列だけ取得する
+    return db.query(JobPost.jobpost_id, JobPost.department_id, JobPost.job_title).all()
+
+def get_jobposts_by_department(db: Session, department_id: int):
+    return (
+        db.query(JobPost.jobpost_id, JobPost.department_id, JobPost.job_title)
+        .filter(JobPost.department_id == department_id)
+        .all()
+    )
+
+class ReferenceData(NamedTuple):
+    body: bytes
+    etag: str
+    count: int
+
+class ReferenceCache:
+    """グレード・部署・求人などの参照データを、シリアライズ済みのJSONとしてメモリに保持する
+
+    フォームの表示ごとに呼ばれるエンドポイントをDBに触れずに返すためのもの。
+    参照テーブルへの書き込みがコミットされると全体を破棄する。別プロセスからの
+    書き込みに備えて、REFERENCE_CACHE_TTL秒ごとにも読み直す。
+    """
+
+    def __init__(self, ttl: float = REFERENCE_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[ReferenceData, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[ReferenceData]:
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl > 0 and time.monotonic() - entry[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, schema: Any, rows: Sequence[Any], version: int) -> ReferenceData:
+        items = TypeAdapter(List[schema]).validate_python(rows, from_attributes=True)
+        body = TypeAdapter(List[schema]).dump_json(items)
+        # ETagは内容のハッシュなので、複数ワーカーのどこで作られても同じ値になる
+        data = ReferenceData(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"', count=len(items))
+        with self._lock:
+            # 読み込み中に無効化されていたら古いデータをキャッシュしない
+            if version == self.version:
+                self._entries[key] = (data, time.monotonic())
+        return data
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+reference_cache = ReferenceCache()
+
+@event.listens_for(Session, "after_flush")
+def _track_reference_writes(session, flush_context):
+    changed = (*session.new, *session.dirty, *session.deleted)
+    if any(isinstance(instance, REFERENCE_MODELS) for instance in changed):
+        session.info["reference_data_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_reference_cache(session):
+    if session.info.pop("reference_data_changed", False):
+        reference_cache.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_reference_writes(session):
+    session.info.pop("reference_data_changed", None)
+
+async def get_reference_data(db: AsyncSession, key: str, schema: Any,
+                             load: Callable[..., Sequence[Any]], *args: Any) -> ReferenceData:
+    """キャッシュにあればそのまま返し、なければloadでDBから読み込んでキャッシュする"""
+    data = reference_cache.get(key)
+    if data is None:
+        version = reference_cache.version
+        data = reference_cache.put(key, schema, await db.run_sync(load, *args), version)
+    return data
+
+def get_employees(db: Session, cursor: Optional[str] = None, limit: Optional[int] = None,
+                  department_id: Optional[int] = None, grade_id: Optional[int] = None,
+                  hired_from: Optional[datetime.date] = None, hired_to: Optional[datetime.date] = None,
+                  fields: Sequence[str] = EMPLOYEE_OPTIONAL_FIELDS):
+    """employee_id順のキーセットページング。cursorより後ろの社員をlimit件返す"""
+    query = db.query(Employee).options(*EMPLOYEE_RELATION_OPTIONS)
+    # 不要な重いカラムはSQLの段階で読み込まない
+    query = query.options(
+        defer(Employee.picture),
+        *[defer(getattr(Employee, field)) for field in EMPLOYEE_OPTIONAL_FIELDS if field not in fields]
+    )
+
+    if cursor is not None:
+        query = query.filter(Employee.employee_id > cursor)
+    if department_id is not None:
+        query = query.filter(Employee.departments.any(DepartmentMember.department_id == department_id))
+    if grade_id is not None:
+        query = query.filter(Employee.grades.any(EmployeeGrade.grade_id == grade_id))
+    if hired_from is not None:
+        query = query.filter(Employee.hire_date >= hired_from)
+    if hired_to is not None:
+        query = query.filter(Employee.hire_date <= hired_to)
+
+    query = query.order_by(Employee.employee_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def get_employee_by_id(db: Session, employee_id: str):
+    return (
+        db.query(Employee)
+        .options(*EMPLOYEE_RELATION_OPTIONS, defer(Employee.picture))
+        .filter(Employee.employee_id == employee_id)
+        .first()
+    )
+
+def get_jobpost_candidates(db: Session, jobpost_id: int, k: int, career_weight: float,
+                           personality_weight: float) -> list[CandidateResponse]:
+    # 行列の読み込みは呼び出し元で済ませておく (matcher.ensure_loaded_async)
+    try:
+        matches = matcher.top_candidates(jobpost_id, k, career_weight, personality_weight)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job post not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    names = dict(db.query(Employee.employee_id, Employee.employee_name)
+                 .filter(Employee.employee_id.in_([employee_id for employee_id, _ in matches])).all())
+    return [
+        CandidateResponse(employee_id=employee_id, employee_name=names[employee_id], score=score)
+        for employee_id, score in matches if employee_id in names
+    ]
+
+def get_employee_jobposts(db: Session, employee_id: str, k: int, career_weight: float,
+                          personality_weight: float) -> list[JobPostMatchResponse]:
+    try:
+        matches = matcher.top_jobposts(employee_id, k, career_weight, personality_weight)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    jobposts = {
+        row.jobpost_id: row for row in
+        db.query(JobPost.jobpost_id, JobPost.department_id, JobPost.job_title)
+        .filter(JobPost.jobpost_id.in_([jobpost_id for jobpost_id, _ in matches])).all()
+    }
+    return [
+        JobPostMatchResponse(
+            jobpost_id=jobpost_id,
+            department_id=jobposts[jobpost_id].department_id,
+            job_title=jobposts[jobpost_id].job_title,
+            score=score
+        )
+        for jobpost_id, score in matches if jobpost_id in jobposts
+    ]
+
+def get_employee_recommendations(db: Session, employee_id: str, limit: int,
+                                 cursor: Optional[int]) -> Tuple[list[JobPostMatchResponse], Optional[int]]:
+    """保存済みの社員へのおすすめ求人 (現在の配属先を除く) を順位順に返す。cursorは前のページの最後の順位"""
+    rows = (
+        db.query(Recommendation.jobpost_id, JobPost.department_id, JobPost.job_title, Recommendation.score,
+                 Recommendation.employee_rank)
+        .join(JobPost, JobPost.jobpost_id == Recommendation.jobpost_id)
+        .filter(Recommendation.employee_id == employee_id, Recommendation.employee_rank > (cursor or 0))
+        .order_by(Recommendation.employee_rank)
+        .limit(limit + 1)
+        .all()
+    )
+    if not rows and cursor is None and db.get(Employee, employee_id) is None:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    # 1件多く取得して次のページがあるかを判定する
+    next_cursor = rows[limit - 1].employee_rank if len(rows) > limit else None
+    return [
+        JobPostMatchResponse(jobpost_id=row.jobpost_id, department_id=row.department_id, job_title=row.job_title,
+                             score=row.score)
+        for row in rows[:limit]
+    ], next_cursor
+
+def get_jobpost_recommendations(db: Session, jobpost_id: int, limit: int,
+                                cursor: Optional[int]) -> Tuple[list[CandidateResponse], Optional[int]]:
+    """保存済みの求人へのおすすめ社員 (その求人に配属中の社員を除く) を順位順に返す"""
+    rows = (
+        db.query(Recommendation.employee_id, Employee.employee_name, Recommendation.score, Recommendation.jobpost_rank)
+        .join(Employee, Employee.employee_id == Recommendation.employee_id)
+        .filter(Recommendation.jobpost_id == jobpost_id, Recommendation.jobpost_rank > (cursor or 0))
+        .order_by(Recommendation.jobpost_rank)
+        .limit(limit + 1)
+        .all()
+    )
+    if not rows and cursor is None and db.get(JobPost, jobpost_id) is None:
+        raise HTTPException(status_code=404, detail="Job post not found")
+    next_cursor = rows[limit - 1].jobpost_rank if len(rows) > limit else None
+    return [
+        CandidateResponse(employee_id=row.employee_id, employee_name=row.employee_name, score=row.score)
+        for row in rows[:limit]
+    ], next_cursor
+
+@timed("similar_employees")
+def get_similar_employees(db: Session, employee_id: str, k: int, space: str) -> list[CandidateResponse]:
+    # インデックスの作成前やエンベディング設定の変更直後、インデックスにない社員は総当たりで探す
+    try:
+        matches = vector_index.similar(employee_id, k, space) if vector_index.available else None
+    except KeyError:
+        matches = None
+    try:
+        if matches is None:
+            matches = matcher.similar_employees(employee_id, k, space)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    names = dict(db.query(Employee.employee_id, Employee.employee_name)
+                 .filter(Employee.employee_id.in_([match_id for match_id, _ in matches])).all())
+    return [
+        CandidateResponse(employee_id=match_id, employee_name=names[match_id], score=score)
+        for match_id, score in matches if match_id in names
+    ]
@@ -0,0 +1,632 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import Employee
+from database import get_engine, read_snapshot
+from embedding_config import EMBEDDING_MODEL, embedding_dimensions
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 「似ている社員」検索用のIVFインデックス (ファイルはmmapで読むので、起動時に全件を読み込まない)
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector_index")
+# クラスタ数 (0なら件数の平方根) と、検索時に調べるクラスタ数
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+VECTOR_INDEX_KMEANS_ITERATIONS = int(os.getenv("VECTOR_INDEX_KMEANS_ITERATIONS", "8"))
+VECTOR_INDEX_TRAIN_PER_LIST = int(os.getenv("VECTOR_INDEX_TRAIN_PER_LIST", "40"))
+# 追記分がこの件数 (または本体の件数×比率) を超えたら、バックグラウンドで作り直す
+VECTOR_INDEX_COMPACT_MIN_DELTA = int(os.getenv("VECTOR_INDEX_COMPACT_MIN_DELTA", "1000"))
+VECTOR_INDEX_COMPACT_RATIO = float(os.getenv("VECTOR_INDEX_COMPACT_RATIO", "0.1"))
+VECTOR_INDEX_COMPACT_INTERVAL = float(os.getenv("VECTOR_INDEX_COMPACT_INTERVAL", "600"))
+# blendは各空間の上位k×この倍数を候補にして、両方の類似度の平均で並べ直す
+VECTOR_INDEX_BLEND_OVERSAMPLE = int(os.getenv("VECTOR_INDEX_BLEND_OVERSAMPLE", "4"))
+
+SPACES = ("career", "personality")
+SEARCH_SPACES = SPACES + ("blend",)
+# 追記ファイルの1レコードに入れる社員IDの最大バイト数
+_ID_BYTES = 64
+_CHUNK_ROWS = 8192
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """複数のuvicornワーカー(プロセス)の間で使う排他ロック。取れたかどうかを返す"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    acquired = False
+    try:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            acquired = True
+        except OSError:
+            if blocking:
+                raise
+        yield acquired
+    finally:
+        if acquired:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+def _length(vector) -> int:
+    return 0 if vector is None else len(vector)
+
+
+def _normalize(vector, dims: int) -> np.ndarray:
+    # 空のベクトル (未登録) はゼロベクトルとして扱う
+    array = np.zeros(dims, dtype=np.float32)
+    if _length(vector) == dims:
+        array[:] = vector
+        norm = np.linalg.norm(array)
+        if norm > 0:
+            array /= norm
+    return array
+
+
+def _normalize_rows(matrix: np.ndarray) -> None:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + _CHUNK_ROWS])
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(sample: np.ndarray, nlist: int, iterations: int = VECTOR_INDEX_KMEANS_ITERATIONS,
+                    seed: int = 0) -> np.ndarray:
+    """正規化済みベクトルの球面k-means"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        present, starts = np.unique(labels[order], return_index=True)
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        updated = np.zeros_like(centroids)
+        updated[present] = sums
+        # 空になったクラスタはランダムな点で置き直す
+        empty = np.setdiff1d(np.arange(nlist), present)
+        if empty.size:
+            updated[empty] = sample[rng.choice(len(sample), empty.size, replace=False)]
+        _normalize_rows(updated)
+        centroids = updated
+    return centroids
+
+
+def build_generation(directory: str, chunks: Iterable[Tuple[Sequence[str], Dict[str, np.ndarray]]], count: int,
+                     dims: int, nlist: int = VECTOR_INDEX_NLIST, seed: int = 0) -> None:
+    """社員ベクトルからインデックスのファイル一式を作る
+
+    chunksは (社員IDのリスト, {空間名: (件数, dims)の行列}) を返す。各空間のベクトルは
+    クラスタ順に並べて保存するので、検索時は調べるクラスタの範囲を連続して読むだけで済む。
+    """
+    os.makedirs(directory, exist_ok=True)
+    raw = {
+        space: np.lib.format.open_memmap(os.path.join(directory, f"{space}.raw.npy"), mode="w+",
+                                         dtype=np.float32, shape=(count, dims))
+        for space in SPACES
+    }
+    ids: List[str] = []
+    for chunk_ids, vectors in chunks:
+        start = len(ids)
+        ids.extend(chunk_ids)
+        for space in SPACES:
+            raw[space][start:len(ids)] = vectors[space]
+    if len(ids) != count:
+        raise ValueError(f"Expected {count} rows but got {len(ids)}")
+
+    # 社員IDの昇順に並べ、IDからの検索は二分探索で行う (辞書を作らないので読み込みが一瞬で済む)
+    id_array = np.array(ids, dtype=f"<U{max([len(i) for i in ids] + [1])}")
+    id_order = np.argsort(id_array, kind="stable")
+    id_rank = np.empty(count, dtype=np.int64)
+    id_rank[id_order] = np.arange(count)
+    np.save(os.path.join(directory, "ids.npy"), id_array[id_order])
+
+    if nlist <= 0:
+        nlist = int(round(np.sqrt(count)))
+    nlist = max(1, min(nlist, count)) if count else 0
+    for space in SPACES:
+        matrix = raw[space]
+        present = np.zeros(count, dtype=bool)
+        for start in range(0, count, _CHUNK_ROWS):
+            block = np.array(matrix[start:start + _CHUNK_ROWS])
+            _normalize_rows(block)
+            matrix[start:start + len(block)] = block
+            present[start:start + len(block)] = np.any(block != 0, axis=1)
+
+        # ベクトルのない社員 (ゼロベクトル) はクラスタの学習に使わない
+        nonzero = np.flatnonzero(present)
+        if nlist and nonzero.size:
+            rng = np.random.default_rng(seed)
+            size = min(nonzero.size, max(nlist, nlist * VECTOR_INDEX_TRAIN_PER_LIST))
+            sample = np.asarray(matrix[np.sort(rng.choice(nonzero, size, replace=False))])
+            centroids = train_centroids(sample, min(nlist, len(sample)), seed=seed)
+            labels = _assign(matrix, centroids)
+        else:
+            centroids = np.zeros((min(nlist, 1), dims), dtype=np.float32)
+            labels = np.zeros(count, dtype=np.int32)
+
+        permutation = np.argsort(labels, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=len(centroids)))
+        vectors = np.lib.format.open_memmap(os.path.join(directory, f"{space}.vectors.npy"), mode="w+",
+                                            dtype=np.float32, shape=(count, dims))
+        for start in range(0, count, _CHUNK_ROWS):
+            vectors[start:start + _CHUNK_ROWS] = matrix[permutation[start:start + _CHUNK_ROWS]]
+        vectors.flush()
+        del vectors
+
+        # rows: クラスタ順の位置 → ID順の行番号、positions: その逆
+        rows = id_rank[permutation].astype(np.int32)
+        positions = np.empty(count, dtype=np.int32)
+        positions[rows] = np.arange(count, dtype=np.int32)
+        np.save(os.path.join(directory, f"{space}.centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(directory, f"{space}.offsets.npy"), offsets)
+        np.save(os.path.join(directory, f"{space}.rows.npy"), rows)
+        np.save(os.path.join(directory, f"{space}.positions.npy"), positions)
+
+    # 作業用のファイルはmmapを閉じてから消す (Windowsでは開いたままだと消せない)
+    del matrix
+    raw.clear()
+    for space in SPACES:
+        os.remove(os.path.join(directory, f"{space}.raw.npy"))
+
+
+class _Segment:
+    """作成済みのインデックス本体 (読み取り専用のmmap)"""
+
+    def __init__(self, directory: str):
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        self.ids = load("ids.npy")
+        self.vectors = {space: load(f"{space}.vectors.npy") for space in SPACES}
+        # セントロイドと境界は小さいのでメモリに載せる
+        self.centroids = {space: np.load(os.path.join(directory, f"{space}.centroids.npy")) for space in SPACES}
+        self.offsets = {space: np.load(os.path.join(directory, f"{space}.offsets.npy")) for space in SPACES}
+        self.rows = {space: load(f"{space}.rows.npy") for space in SPACES}
+        self.positions = {space: load(f"{space}.positions.npy") for space in SPACES}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_of(self, employee_id: str) -> Optional[int]:
+        row = int(np.searchsorted(self.ids, employee_id))
+        if row < len(self.ids) and self.ids[row] == employee_id:
+            return row
+        return None
+
+    def vector(self, space: str, row: int) -> np.ndarray:
+        return self.vectors[space][self.positions[space][row]]
+
+    def candidates(self, space: str, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """queryに近いクラスタをnprobe個調べ、(ID順の行番号, スコア) を返す"""
+        centroids = self.centroids[space]
+        if len(self.ids) == 0 or len(centroids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        offsets = self.offsets[space]
+        ranges = [(offsets[i], offsets[i + 1]) for i in _top_k(centroids @ query, nprobe)]
+        ranges = [(start, stop) for start, stop in ranges if stop > start]
+        if not ranges:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        scores = np.concatenate([self.vectors[space][start:stop] @ query for start, stop in ranges])
+        return self.rows[space][positions], scores
+
+
+class _Delta:
+    """前回の作り直し以降に追記された社員 (同じIDは後の行で上書き)"""
+
+    def __init__(self, dims: int):
+        self.dims = dims
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.offset = 0
+        self._matrices = {space: np.zeros((0, dims), dtype=np.float32) for space in SPACES}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def matrix(self, space: str) -> np.ndarray:
+        return self._matrices[space][:len(self.ids)]
+
+    def apply(self, records: np.ndarray) -> None:
+        for record in records:
+            employee_id = record["id"].decode("utf-8")
+            slot = self.index.get(employee_id)
+            if slot is None:
+                slot = len(self.ids)
+                if slot == len(self._matrices[SPACES[0]]):
+                    # 新しい配列を確保するので、検索中の古いビューはそのまま使える
+                    capacity = max(16, slot * 2)
+                    for space in SPACES:
+                        grown = np.zeros((capacity, self.dims), dtype=np.float32)
+                        grown[:slot] = self._matrices[space][:slot]
+                        self._matrices[space] = grown
+                for space in SPACES:
+                    self._matrices[space][slot] = record[space]
+                self.ids.append(employee_id)
+                self.index[employee_id] = slot
+            else:
+                for space in SPACES:
+                    self._matrices[space][slot] = record[space]
+
+
+def _record_dtype(dims: int) -> np.dtype:
+    return np.dtype([("id", f"S{_ID_BYTES}"), ("career", "<f4", (dims,)), ("personality", "<f4", (dims,))])
+
+
+class VectorIndex:
+    """社員ベクトルの近似最近傍 (IVF) インデックス
+
+    - 本体 (gen-N/) はクラスタ順に並べたfloat32行列で、np.loadのmmapで開くだけなので起動が速い
+    - 登録された社員は gen-N/delta.bin に追記し、検索時は本体と追記分の両方を調べる
+    - 追記分が増えたらDBから作り直し (compact)、manifest.jsonを差し替えて新しい世代に切り替える
+    - 追記と切り替えはファイルロックで排他するので、複数のuvicornワーカーで同じディレクトリを共有できる
+    """
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, nprobe: int = VECTOR_INDEX_NPROBE):
+        self.directory = directory
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._manifest: Dict = {}
+        self._manifest_stat = None
+        self._segment: Optional[_Segment] = None
+        self._delta = _Delta(embedding_dimensions())
+        self._task: Optional[asyncio.Task] = None
+
+    # --- ファイル ---
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _generation_dir(self, generation: int) -> str:
+        return os.path.join(self.directory, f"gen-{generation}")
+
+    def _delta_path(self, generation: int) -> str:
+        return os.path.join(self._generation_dir(generation), "delta.bin")
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # まだ作っていない場合は、追記だけを受け付ける世代0として扱う
+            return {"generation": 0, "dims": embedding_dimensions(), "model": EMBEDDING_MODEL, "count": 0}
+
+    def _refresh(self) -> None:
+        """他のプロセスによる切り替え・追記を反映する (statを2回呼ぶだけなので毎回行う)"""
+        with self._lock:
+            try:
+                stat = os.stat(self._manifest_path)
+                key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except FileNotFoundError:
+                key = None
+            if key != self._manifest_stat or not self._manifest:
+                manifest = self._read_manifest()
+                generation = manifest["generation"]
+                segment = _Segment(self._generation_dir(generation)) if generation else None
+                self._manifest, self._manifest_stat = manifest, key
+                self._segment, self._delta = segment, _Delta(manifest["dims"])
+
+            path = self._delta_path(self._manifest["generation"])
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                return
+            record = _record_dtype(self._delta.dims)
+            end = size - size % record.itemsize
+            if end <= self._delta.offset:
+                return
+            with open(path, "rb") as f:
+                f.seek(self._delta.offset)
+                data = f.read(end - self._delta.offset)
+            self._delta.apply(np.frombuffer(data, dtype=record))
+            self._delta.offset = end
+
+    # --- 状態 ---
+
+    @property
+    def available(self) -> bool:
+        """検索に使えるか (作成済みで、現在のエンベディング設定と一致している)"""
+        self._refresh()
+        return (
+            self._segment is not None
+            and self._manifest.get("dims") == embedding_dimensions()
+            and self._manifest.get("model") == EMBEDDING_MODEL
+        )
+
+    def needs_compaction(self) -> bool:
+        if not self.available:
+            return True
+        threshold = max(VECTOR_INDEX_COMPACT_MIN_DELTA, VECTOR_INDEX_COMPACT_RATIO * self._manifest["count"])
+        return len(self._delta) >= threshold
+
+    def stats(self) -> Dict[str, float]:
+        self._refresh()
+        return {
+            "generation": self._manifest.get("generation", 0),
+            "size": self._manifest.get("count", 0),
+            "delta": len(self._delta),
+            "nlist": len(self._segment.centroids[SPACES[0]]) if self._segment is not None else 0,
+        }
+
+    # --- 追記 ---
+
+    def add(self, employee_id: str, career_vector, personality_vector) -> None:
+        """登録・更新された社員を追記する (DBのコミット後に呼ぶ)"""
+        encoded = employee_id.encode("utf-8")
+        if len(encoded) > _ID_BYTES:
+            raise ValueError(f"Employee id is longer than {_ID_BYTES} bytes: {employee_id}")
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(os.path.join(self.directory, "index.lock")):
+            # 切り替え直後に古い世代へ書かないよう、ロック内で現在の世代を読み直す
+            manifest = self._read_manifest()
+            dims = manifest["dims"]
+            if _length(career_vector) not in (0, dims) or _length(personality_vector) not in (0, dims):
+                # 次元数の違うベクトルは、設定変更後の作り直しで取り込まれる
+                return
+            record = np.zeros(1, dtype=_record_dtype(dims))
+            record["id"] = encoded
+            record["career"] = _normalize(career_vector, dims)
+            record["personality"] = _normalize(personality_vector, dims)
+            path = self._delta_path(manifest["generation"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+            try:
+                os.write(fd, record.tobytes())
+            finally:
+                os.close(fd)
+        self._refresh()
+
+    # --- 検索 ---
+
+    def vectors(self, employee_id: str) -> Optional[Dict[str, np.ndarray]]:
+        self._refresh()
+        return self._lookup(employee_id)
+
+    def _lookup(self, employee_id: str) -> Optional[Dict[str, np.ndarray]]:
+        segment, delta = self._segment, self._delta
+        slot = delta.index.get(employee_id)
+        if slot is not None:
+            return {space: delta.matrix(space)[slot] for space in SPACES}
+        row = segment.row_of(employee_id) if segment is not None else None
+        if row is None:
+            return None
+        return {space: np.asarray(segment.vector(space, row)) for space in SPACES}
+
+    def _search_space(self, space: str, query: np.ndarray, k: int, nprobe: int,
+                      exclude: Optional[str]) -> List[Tuple[str, float]]:
+        segment, delta = self._segment, self._delta
+        results: List[Tuple[str, float]] = []
+        if segment is not None:
+            rows, scores = segment.candidates(space, query, nprobe)
+            # 追記分で上書きされた社員と、検索元の社員は本体側の結果から除く
+            for i in _top_k(scores, k + 1 + len(delta)):
+                employee_id = str(segment.ids[rows[i]])
+                if employee_id == exclude or employee_id in delta.index:
+                    continue
+                results.append((employee_id, float(scores[i])))
+                if len(results) == k:
+                    break
+        if len(delta):
+            scores = delta.matrix(space) @ query
+            for i in _top_k(scores, k + 1):
+                if delta.ids[i] != exclude:
+                    results.append((delta.ids[i], float(scores[i])))
+        results.sort(key=lambda item: -item[1])
+        return results[:k]
+
+    def search(self, space: str, query: Dict[str, np.ndarray], k: int, nprobe: Optional[int] = None,
+               exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """queryに近い社員を上位k件返す。spaceがblendなら職務経歴と性格の類似度の平均で並べる"""
+        self._refresh()
+        nprobe = nprobe or self.nprobe
+        dims = self._delta.dims
+        for space_name in SPACES:
+            if space_name in query and len(query[space_name]) != dims:
+                raise ValueError(f"Embedding dimensions differ: query has {len(query[space_name])}, index has {dims}")
+        if space != "blend":
+            return self._search_space(space, _normalize(query[space], dims), k, nprobe, exclude)
+
+        normalized = {space_name: _normalize(query[space_name], dims) for space_name in SPACES}
+        candidates = {
+            employee_id
+            for space_name in SPACES
+            for employee_id, _ in self._search_space(
+                space_name, normalized[space_name], k * VECTOR_INDEX_BLEND_OVERSAMPLE, nprobe, exclude
+            )
+        }
+        scored = []
+        for employee_id in candidates:
+            vectors = self._lookup(employee_id)
+            if vectors is None:
+                continue
+            score = sum(float(vectors[space_name] @ normalized[space_name]) for space_name in SPACES) / len(SPACES)
+            scored.append((employee_id, score))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:k]
+
+    def similar(self, employee_id: str, k: int, space: str = "blend",
+                nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        query = self.vectors(employee_id)
+        if query is None:
+            raise KeyError(employee_id)
+        return self.search(space, query, k, nprobe, exclude=employee_id)
+
+    # --- 作り直し ---
+
+    def delta_position(self) -> Tuple[Dict, int]:
+        """現在の世代と、その追記ファイルの大きさ
+
+        追記はDBのコミット後に行うので、この位置までの社員は、この後に読み始めたDBのスナップショットに含まれる。
+        作り直しでは、この位置より後の追記を新しい世代に引き継ぐ。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(os.path.join(self.directory, "index.lock")):
+            manifest = self._read_manifest()
+            path = self._delta_path(manifest["generation"])
+            return manifest, os.path.getsize(path) if os.path.exists(path) else 0
+
+    def build(self, chunks: Iterable[Tuple[Sequence[str], Dict[str, np.ndarray]]], count: int,
+              dims: Optional[int] = None, nlist: int = VECTOR_INDEX_NLIST,
+              position: Optional[Tuple[Dict, int]] = None) -> int:
+        """新しい世代を作って切り替える。positionより後の追記は新しい世代に引き継ぐ
+
+        positionはchunksの元になるDBのスナップショットを読み始める前に delta_position() で取っておく
+        (省略したときは今の位置。chunksが既に読み終えたデータのときだけ使える)。
+        """
+        dims = dims or embedding_dimensions()
+        previous, delta_start = position or self.delta_position()
+        generation = previous["generation"] + 1
+        old_delta = self._delta_path(previous["generation"])
+
+        started = time.perf_counter()
+        tmp_dir = f"{self._generation_dir(generation)}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        build_generation(tmp_dir, chunks, count, dims, nlist)
+        final_dir = self._generation_dir(generation)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+
+        with _file_lock(os.path.join(self.directory, "index.lock")):
+            if previous["dims"] == dims and os.path.exists(old_delta):
+                record_size = _record_dtype(dims).itemsize
+                with open(old_delta, "rb") as f:
+                    f.seek(delta_start)
+                    tail = f.read()
+                tail = tail[:len(tail) - len(tail) % record_size]
+                if tail:
+                    with open(self._delta_path(generation), "wb") as f:
+                        f.write(tail)
+            manifest = {
+                "generation": generation, "dims": dims, "model": EMBEDDING_MODEL, "count": count,
+                "created_at": time.time(),
+            }
+            tmp_path = f"{self._manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._manifest_path)
+
+        self._remove_old_generations(generation)
+        self._refresh()
+        logging.info(f"Vector index generation {generation} built with {count} employees "
+                     f"in {time.perf_counter() - started:.1f}s")
+        return generation
+
+    def _remove_old_generations(self, current: int) -> None:
+        for name in os.listdir(self.directory):
+            if not name.startswith("gen-") or name.endswith(".tmp") or name == f"gen-{current}":
+                continue
+            try:
+                shutil.rmtree(os.path.join(self.directory, name))
+            except OSError:
+                # Windowsでは他のプロセスがmmap中のファイルを消せないので、次回の作り直しで消す
+                logging.debug(f"Could not remove old vector index {name}; will retry later")
+
+    def compact(self, bind=None) -> Optional[int]:
+        """DBの社員ベクトルから作り直す。他のプロセスが作り直し中なら何もしない"""
+        bind = bind or get_engine()
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(os.path.join(self.directory, "compact.lock"), blocking=False) as acquired:
+            if not acquired:
+                return None
+            dims = embedding_dimensions()
+            # 追記の位置を先に取る (この後にコミットされた社員は、スナップショットになくても追記から引き継がれる)
+            position = self.delta_position()
+            with read_snapshot(bind) as connection:
+                # 件数と中身を同じスナップショットで読む
+                count = connection.execute(select(func.count()).select_from(Employee)).scalar_one()
+                result = connection.execution_options(yield_per=1000).execute(
+                    select(Employee.employee_id, Employee.career_info_vector, Employee.personality_vector)
+                )
+                skipped = [0]
+
+                def chunks():
+                    for rows in result.partitions():
+                        vectors = {space: np.zeros((len(rows), dims), dtype=np.float32) for space in SPACES}
+                        for i, (_, career, personality) in enumerate(rows):
+                            for space, vector in (("career", career), ("personality", personality)):
+                                if vector is None or len(vector) == 0:
+                                    continue
+                                if len(vector) != dims:
+                                    skipped[0] += 1
+                                    continue
+                                vectors[space][i] = vector
+                        yield [row[0] for row in rows], vectors
+
+                generation = self.build(chunks(), count, dims, position=position)
+            if skipped[0]:
+                logging.warning(f"Vector index skipped {skipped[0]} vectors whose dimension != {dims}; "
+                                f"run embedding.py --employees")
+            return generation
+
+    async def _compaction_loop(self, interval: float) -> None:
+        while True:
+            try:
+                if self.needs_compaction():
+                    await asyncio.to_thread(self.compact)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Vector index compaction failed")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = VECTOR_INDEX_COMPACT_INTERVAL) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._compaction_loop(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+vector_index = VectorIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the similar-employee vector index from the database")
+    parser.add_argument("--dir", default=VECTOR_INDEX_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    index = VectorIndex(args.dir)
+    generation = index.compact()
+    print(f"Built generation {generation}: {index.stats()}" if generation else "Another process is rebuilding the index.")
@@ -0,0 +1,82 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# ウォームアップに失敗したとき (DBに接続できないなど) に再試行するまでの秒数
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+Step = Callable[[], Awaitable[Any]]
+
+
+class Warmup:
+    """起動後にキャッシュ・行列・ワーカープロセスなどを用意し、終わるまで /readyz を503にする
+
+    stagesは順に実行し、同じstageのステップは並行に実行する。失敗したら間隔をあけて最初からやり直す
+    (各ステップは何度実行してもよいものにする)。
+    """
+
+    def __init__(self, retry_interval: float = WARMUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self.status = "pending"
+        self.checks: Dict[str, Dict[str, Any]] = {}
+        self.attempts = 0
+        self.seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    async def _step(self, name: str, step: Step) -> None:
+        start = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            self.checks[name] = {"status": "failed", "ms": (time.perf_counter() - start) * 1000, "error": str(e)}
+            raise
+        self.checks[name] = {"status": "ok", "ms": (time.perf_counter() - start) * 1000}
+
+    async def _run(self, stages: List[Dict[str, Step]], on_ready: Optional[Callable[[], Any]]) -> None:
+        start = time.perf_counter()
+        while True:
+            self.attempts += 1
+            self.status = "running"
+            self.checks = {name: {"status": "pending"} for stage in stages for name in stage}
+            try:
+                for stage in stages:
+                    # 失敗したステップがあっても、やり直す前に同じstageの他のステップが終わるのを待つ
+                    results = await asyncio.gather(*[self._step(name, step) for name, step in stage.items()],
+                                                   return_exceptions=True)
+                    errors = [result for result in results if isinstance(result, BaseException)]
+                    if errors:
+                        raise errors[0]
+                break
+            except Exception:
+                self.status = "failed"
+                logging.exception(f"Warm-up failed (attempt {self.attempts}); retrying in {self.retry_interval}s")
+                await asyncio.sleep(self.retry_interval)
+
+        self.seconds = time.perf_counter() - start
+        if on_ready is not None:
+            on_ready()
+        self.status = "ready"
+        logging.info(f"Warm-up finished in {self.seconds:.2f}s: "
+                     + ", ".join(f"{name} {check['ms']:.0f}ms" for name, check in self.checks.items()))
+
+    def start(self, stages: List[Dict[str, Step]], on_ready: Optional[Callable[[], Any]] = None) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(stages, on_ready))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"status": self.status, "attempts": self.attempts, "seconds": self.seconds, "checks": self.checks}
+
+
+warmup = Warmup()
@@ -0,0 +1,181 @@
+import os
+import asyncio
+import logging
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, List, Optional, Set, Tuple
+
+# CPU負荷の高い処理 (PDF解析・パスワードハッシュ) を実行するプロセス数。0ならスレッドで実行する
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(os.cpu_count() or 1, 4))))
+CPU_TASK_TIMEOUT = float(os.getenv("CPU_TASK_TIMEOUT", "60"))
+
+
+def _warmup() -> int:
+    return os.getpid()
+
+
+class _ProcessContext:
+    """ProcessPoolExecutorが起動したワーカープロセスを記録するmultiprocessingのコンテキスト"""
+
+    def __init__(self):
+        self._context = multiprocessing.get_context()
+        self.processes: List[multiprocessing.process.BaseProcess] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._context, name)
+
+    def Process(self, *args: Any, **kwargs: Any) -> multiprocessing.process.BaseProcess:
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+
+class _Pool:
+    """ProcessPoolExecutorと、そのワーカープロセス・実行中のタスク"""
+
+    def __init__(self, workers: int):
+        self.context = _ProcessContext()
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=self.context)
+        self.running: Set[Future] = set()
+
+    def terminate(self) -> None:
+        for process in self.context.processes:
+            process.terminate()
+
+
+class CPUPool:
+    """ProcessPoolExecutorでCPU処理をイベントループの外に逃がす
+
+    タスクはいったんこのクラスのキューに入れ、空いているワーカーがあるときだけプールに渡す。
+    タイムアウトはプールに渡してから数えるので、混雑してキューで待った時間はタイムアウトに含まれない。
+    """
+
+    def __init__(self, workers: int = CPU_WORKERS, timeout: float = CPU_TASK_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._pool: Optional[_Pool] = None
+        # 作り直す前のプールも含めた全プール (終了時にすべて止めるため)
+        self._pools: Set[_Pool] = set()
+        # ワーカーが空くのを待っているタスク (プールに渡したらstartedに(プール, Future)を入れる)
+        self._queue: Deque[Tuple[Future, Callable, Tuple[Any, ...]]] = deque()
+        # 完了コールバックの中からもキューを進めるので再入可能なロックにする
+        self._lock = threading.RLock()
+
+    def _current(self) -> _Pool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = _Pool(self.workers)
+                self._pools.add(self._pool)
+            return self._pool
+
+    def start(self) -> None:
+        if self.workers <= 0:
+            return
+        executor = self._current().executor
+        # 最初のリクエストでプロセス起動を待たないよう、全ワーカーを先に立ち上げておく
+        futures = [executor.submit(_warmup) for _ in range(self.workers)]
+        pids = {future.result() for future in futures}
+        logging.info(f"CPU pool started with {len(pids)} worker processes")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pools, self._pool = list(self._pools), None
+            self._pools = set()
+            queued = list(self._queue)
+            self._queue.clear()
+        for started, _, _ in queued:
+            started.cancel()
+        for pool in pools:
+            pool.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _dispatch(self) -> None:
+        """空いているワーカーの数だけ、キューのタスクをプールに渡す"""
+        with self._lock:
+            while self._queue:
+                pool = self._current()
+                if len(pool.running) >= self.workers:
+                    return
+                started, fn, args = self._queue.popleft()
+                # 待っている間に呼び出し元がキャンセルしたタスクは実行しない
+                if not started.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future = pool.executor.submit(fn, *args)
+                except BrokenProcessPool as error:
+                    self._detach(pool)
+                    pool.executor.shutdown(wait=False, cancel_futures=True)
+                    started.set_exception(error)
+                    continue
+                pool.running.add(future)
+                future.add_done_callback(functools.partial(self._finished, pool))
+                started.set_result((pool, future))
+
+    def _finished(self, pool: _Pool, future: Future) -> None:
+        with self._lock:
+            pool.running.discard(future)
+            # 壊れたプールにはもう渡せないので、キューの残りは新しいプールで実行する
+            if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                self._detach(pool)
+            self._dispatch()
+
+    def _detach(self, pool: _Pool) -> Set[Future]:
+        # 新しいタスクは新しいプールで実行する (ほかのリクエストが同時に外していれば何もしない)
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            self._pools.discard(pool)
+            return set(pool.running)
+
+    def _discard(self, pool: _Pool) -> None:
+        """ワーカーが異常終了して壊れたプールを捨てる (次のタスクで作り直す)"""
+        self._detach(pool)
+        pool.executor.shutdown(wait=False, cancel_futures=True)
+        self._dispatch()
+
+    def _retire(self, pool: _Pool, stuck: Future) -> None:
+        """タイムアウトしたタスクのプールを切り離し、ほかの実行中のタスクが終わってからワーカーを終了させる
+
+        タイムアウトしたタスクは止められないので、そのワーカーはプールごと終了させるしかない。
+        同じプールで動いているほかのリクエストのタスクは、最大でtimeout秒まで終わるのを待つ。
+        """
+        others = self._detach(pool) - {stuck}
+        # キューで待っているタスクは新しいプールで実行する
+        self._dispatch()
+
+        def drain():
+            concurrent.futures.wait(others, timeout=self.timeout)
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+            pool.terminate()
+
+        threading.Thread(target=drain, name="cpu-pool-retire", daemon=True).start()
+
+    async def run(self, fn: Callable, *args: Any, timeout: Optional[float] = None) -> Any:
+        """fn(*args)をワーカープロセスで実行する。実行が始まってからtimeout秒を超えたらTimeoutErrorを送出する"""
+        timeout = self.timeout if timeout is None else timeout
+        if self.workers <= 0:
+            return await asyncio.wait_for(asyncio.to_thread(fn, *args), timeout)
+
+        started: Future = Future()
+        with self._lock:
+            self._queue.append((started, fn, args))
+            self._dispatch()
+        pool, future = await asyncio.wrap_future(started)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"CPU task {fn.__name__} timed out after {timeout}s; recycling worker pool")
+            self._retire(pool, future)
+            raise
+        except BrokenProcessPool:
+            # ワーカーが異常終了した (OOMなど)。実行中だったタスクは失敗するが、次のタスクからは新しいプールで動く
+            logging.error(f"CPU worker pool broke while running {fn.__name__}; it will be restarted")
+            self._discard(pool)
+            raise
+
+
+cpu_pool = CPUPool()